@@ -3,18 +3,64 @@ RouteSaathi 2.0 - FastAPI Backend
 BMTC Bus Fleet Management System with AI-powered Route Optimization
 """
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 import uvicorn
 
-from routers import auth, buses, routes, tickets, notifications, ai_engine, conductors
+from routers import admin, auth, buses, routes, tickets, notifications, ai_engine, conductors, dashboard, sync
+from services import config, scenario_sim
+from services.fast_json import FastJSONResponse
+from services.metrics import MetricsMiddleware, registry
+from services.pagination import NEXT_CURSOR_HEADER
+from services.profiling import PROFILE_HEADER, ProfilingMiddleware
+from services.revenue_monitor import revenue_monitor
+from services.security import get_current_user, require_role
+from services.change_log import change_log
+from services.shared_state import notifier
+from services.ticket_archive import archive
+from services.warmup import warmup
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background services; warmup runs while the worker already serves requests"""
+    change_log.start()
+    revenue_monitor.start()
+    notifier.start()
+    warmup.start()
+    if config.ARCHIVE_ENABLED:
+        archive.start()
+    yield
+    notifier.stop()
+    scenario_sim.shutdown()
+    archive.shutdown()
 
 app = FastAPI(
     title="RouteSaathi API",
     description="AI-driven bus fleet management system for BMTC",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan
 )
 
+# Compress large payloads (route geometry, full fleet); brotli when available
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, minimum_size=config.COMPRESSION_MIN_SIZE, gzip_fallback=True)
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=config.COMPRESSION_MIN_SIZE)
+
+# Per-route request metrics, exposed at /api/metrics
+if config.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+# Opt-in request profiling (X-Profile: 1, or slower than PROFILE_SLOW_MS)
+if config.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
 # CORS Configuration for React frontend
 app.add_middleware(
     CORSMiddleware,
@@ -22,16 +68,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", PROFILE_HEADER],
 )
 
-# Register Routers
+# Register Routers (everything except login requires a session token)
+protected = [Depends(get_current_user)]
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
-app.include_router(buses.router, prefix="/api/buses", tags=["Buses"])
-app.include_router(routes.router, prefix="/api/routes", tags=["Routes"])
-app.include_router(tickets.router, prefix="/api/tickets", tags=["Tickets"])
-app.include_router(notifications.router, prefix="/api/notifications", tags=["Notifications"])
-app.include_router(ai_engine.router, prefix="/api/ai", tags=["AI Engine"])
-app.include_router(conductors.router, prefix="/api/conductors", tags=["Conductors"])
+app.include_router(buses.router, prefix="/api/buses", tags=["Buses"], dependencies=protected)
+app.include_router(routes.router, prefix="/api/routes", tags=["Routes"], dependencies=protected)
+app.include_router(tickets.router, prefix="/api/tickets", tags=["Tickets"], dependencies=protected)
+app.include_router(notifications.router, prefix="/api/notifications", tags=["Notifications"], dependencies=protected)
+app.include_router(ai_engine.router, prefix="/api/ai", tags=["AI Engine"], dependencies=protected)
+app.include_router(conductors.router, prefix="/api/conductors", tags=["Conductors"], dependencies=protected)
+app.include_router(dashboard.router, prefix="/api/dashboard", tags=["Dashboard"], dependencies=protected)
+app.include_router(sync.router, prefix="/api/sync", tags=["Sync"], dependencies=protected)
+app.include_router(admin.router, prefix="/api/admin", tags=["Admin"], dependencies=[Depends(require_role("coordinator"))])
 
 @app.get("/")
 async def root():
@@ -45,5 +96,23 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "RouteSaathi Backend"}
 
+@app.get("/api/health/live")
+async def liveness():
+    """The process is up and serving requests"""
+    return {"status": "alive"}
+
+@app.get("/api/health/ready")
+async def readiness():
+    """Whether startup warmup has finished, with per-component timings (503 until ready)"""
+    state = warmup.state()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+@app.get("/api/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition of this worker's metrics"""
+    if not config.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
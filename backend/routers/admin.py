@@ -0,0 +1,40 @@
+"""
+Admin Router - Operational endpoints for coordinators
+"""
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse, Response
+from services import config
+from services.profiling import profiles
+
+router = APIRouter()
+
+@router.get("/profiles")
+async def list_profiles():
+    """Recent request profiles captured by this worker, newest first"""
+    return {
+        "enabled": config.PROFILING_ENABLED,
+        "slow_threshold_ms": config.PROFILE_SLOW_MS,
+        "profiles": profiles.list()
+    }
+
+@router.get("/profiles/{profile_id}")
+async def get_profile_summary(profile_id: str):
+    """Top functions of a profile as plain text"""
+    profile = profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile["summary"])
+
+@router.get("/profiles/{profile_id}/download")
+async def download_profile(profile_id: str):
+    """Raw profile: a pstats file for cProfile captures, collapsed stacks for sampled ones"""
+    profile = profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if profile["format"] == "pstats":
+        media_type, filename = "application/octet-stream", f"profile-{profile_id}.prof"
+    else:
+        media_type, filename = "text/plain; charset=utf-8", f"profile-{profile_id}.folded"
+    return Response(profile["data"], media_type=media_type,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
@@ -2,11 +2,20 @@
 AI Engine Router - ML-Based Bus Reallocation Suggestions
 """
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from services.data_utils import read_json
-from datetime import datetime
-from typing import List, Dict, Any
+from services import config, repository
+from services import demand_model, ticket_archive
+from services.congestion_detector import detector
+from services.demand_features import demand_store, shift_features
+from services.fleet_optimizer import expected_passengers, optimize_allocation, plan_moves
+from services.fleet_table import fleet_table
+from services.response_cache import cached_response
+from services.revenue_monitor import revenue_monitor
+from services.scenario_sim import FleetSnapshot, simulate
+from services.security import require_role
+from datetime import date, datetime
+from typing import List, Dict, Any, Optional, Tuple
 from collections import defaultdict
 
 router = APIRouter()
@@ -16,116 +25,131 @@ class AllocationAction(BaseModel):
     action: str  # "add" or "remove"
     buses_change: int
 
-def analyze_route_demand() -> List[Dict[str, Any]]:
+class Scenario(BaseModel):
+    name: Optional[str] = None
+    actions: List[AllocationAction]
+
+class SimulationRequest(BaseModel):
+    scenarios: List[Scenario]
+
+def fleet_plan(now: datetime, ticket_counts: Optional[Dict[str, int]] = None,
+               supply: Optional[Tuple[Dict[str, int], Dict[str, Any], int]] = None) -> Dict[str, Any]:
     """
-    Analyze ticket data and bus allocation to generate ML-based reallocation suggestions.
-    This is the core AI engine logic.
+    Expected demand per route and the optimizer's allocation of the whole
+    fleet (buses on routes plus standby) against it. Callers that already
+    aggregated them can pass the tickets per route and the supply (buses
+    and total occupancy per route, fleet size).
     """
-    tickets = read_json("tickets.json")
-    buses = read_json("buses.json")
-    routes = read_json("routes.json")
+    # Count tickets per route (routes with any ticket history)
+    route_ticket_count = ticket_archive.count_by_route() if ticket_counts is None else ticket_counts
     
-    # Count tickets per route (demand indicator)
-    route_ticket_count = defaultdict(int)
-    for ticket in tickets:
-        route_id = ticket.get("route_id")
-        if route_id:
-            route_ticket_count[route_id] += 1
+    # Rolling demand windows (last 15 min / hour / same hour last week)
+    demand_store.sync()
     
-    # Count buses per route (supply indicator)
-    route_bus_count = defaultdict(int)
-    route_occupancy = defaultdict(list)
-    for bus in buses:
-        route_id = bus.get("route_id")
-        if route_id:
-            route_bus_count[route_id] += 1
-            route_occupancy[route_id].append(bus.get("occupancy_percent", 50))
+    # Count buses and total occupancy per route (supply indicator)
+    route_bus_count, route_occupancy_total, total_buses = supply or fleet_table.get().supply()
+    standby = total_buses - sum(route_bus_count.values())
     
-    # Generate recommendations
-    recommendations = []
+    # Load ML Model (cached; reloaded when a new version is exported)
+    model = demand_model.load_model()
     
-    # Load ML Model
-    try:
-        import joblib
-        import pandas as pd
-        import os
-        
-        base_dir = os.path.dirname(os.path.dirname(__file__))
-        model_path = os.path.join(base_dir, "models", "backup_predictor_rf.joblib")
-        cols_path = os.path.join(base_dir, "models", "feature_columns.joblib")
-        
-        model = joblib.load(model_path)
-        feature_cols = joblib.load(cols_path)
-        model_loaded = True
-    except Exception as e:
-        print(f"ML Model loading failed: {e}")
-        model_loaded = False
+    # Prepare features for every route: recent demand, not all-time totals
+    route_features = {}
+    for route_id in route_ticket_count:
+        demand = demand_store.features(route_id, now)
+        route_features[route_id] = {
+            'n_trips': route_bus_count.get(route_id, 0),
+            'n_stop_events': demand["demand_1h"],
+            **shift_features(now.hour),
+            **demand
+        }
+    
+    # ML Prediction, one batch for all routes
+    predictions = {}
+    if model is not None:
+        try:
+            predictions = dict(zip(route_features, model.predict(list(route_features.values()))))
+        except Exception as e:
+            print(f"Prediction error: {e}")
+    
+    # Expected passengers per route
+    capacity = config.BUS_CAPACITY * config.TARGET_LOAD_FACTOR
+    on_board = {rid: total / 100 * config.BUS_CAPACITY for rid, total in route_occupancy_total.items() if rid}
+    expected = {}
+    for route_id in set(route_bus_count) | set(route_features):
+        features = route_features.get(route_id, {})
+        expected[route_id] = expected_passengers(
+            features.get("demand_1h", 0), features.get("forecast_next_hour", 0.0), on_board.get(route_id, 0.0),
+            route_bus_count.get(route_id, 0), predictions.get(route_id, 0), capacity
+        )
+    
+    plan = optimize_allocation(expected, route_bus_count, standby, capacity, config.MIN_BUSES_PER_ROUTE)
+    return {
+        **plan,
+        "current": route_bus_count,
+        "current_standby": standby,
+        "capacity": capacity,
+        "on_board": on_board,
+        "expected_demand": expected,
+        "ticket_counts": route_ticket_count,
+        "occupancy_totals": route_occupancy_total,
+        "features": route_features,
+        "predictions": predictions,
+        "model_loaded": model is not None,
+    }
 
+def suggestion_counts(plan: Dict[str, Any]) -> Dict[str, int]:
+    """Reallocations a fleet plan suggests: routes gaining buses (HIGH) and losing them (LOW)"""
+    changes = [recommended - plan["current"].get(route_id, 0) for route_id, recommended in plan["allocation"].items()]
+    high = sum(1 for change in changes if change > 0)
+    low = sum(1 for change in changes if change < 0)
+    return {
+        "ml_suggested_reallocations": high + low,
+        "high_priority_count": high,
+        "low_priority_count": low
+    }
+
+def analyze_route_demand() -> List[Dict[str, Any]]:
+    """
+    Analyze ticket data and bus allocation to generate ML-based reallocation suggestions.
+    This is the core AI engine logic: the fleet is rebalanced as a whole, so a
+    bus added to one route comes from standby or from a route that can spare it.
+    """
+    now = datetime.now()
+    plan = fleet_plan(now)
+    model_loaded = plan["model_loaded"]
+    
     # Create route name mapping
-    route_names = {r["id"]: r["name"] for r in routes}
+    route_names = {r["id"]: r["name"] for r in repository.routes.all()}
     
-    # Analyze each route with ticket data
-    for route_id, ticket_count in route_ticket_count.items():
-        current_buses = route_bus_count.get(route_id, 0)
-        avg_occupancy = sum(route_occupancy.get(route_id, [50])) / max(1, len(route_occupancy.get(route_id, [50])))
-        
-        # ML Prediction
-        predicted_demand = 0
-        ml_confidence = "Low"
-        
-        if model_loaded:
-            try:
-                # Prepare features for model
-                # Features: ['n_trips', 'n_stop_events', 'shift_afternoon', 'shift_morning', 'shift_other']
-                hour = datetime.now().hour
-                is_morning = 1 if 6 <= hour < 12 else 0
-                is_afternoon = 1 if 12 <= hour < 18 else 0
-                is_other = 1 if not (is_morning or is_afternoon) else 0
-                
-                features = pd.DataFrame([{
-                    'n_trips': current_buses,
-                    'n_stop_events': ticket_count, # Using total historical tickets as proxy for volume
-                    'shift_afternoon': is_afternoon,
-                    'shift_morning': is_morning,
-                    'shift_other': is_other
-                }])
-                
-                # Ensure columns match exactly
-                for col in feature_cols:
-                    if col not in features.columns:
-                        features[col] = 0
-                features = features[feature_cols]
-                
-                prediction = model.predict(features)[0]
-                predicted_demand = prediction
-                ml_confidence = "High"
-            except Exception as e:
-                print(f"Prediction error for {route_id}: {e}")
-        
-        # Hybrid Decision Logic (ML + Rules)
-        # Calculate demand score (tickets per bus)
-        demand_per_bus = ticket_count / max(1, current_buses)
+    # Generate recommendations
+    recommendations = []
+    
+    # Every route with ticket data, plus any route the plan takes buses from
+    for route_id, recommended_buses in plan["allocation"].items():
+        current_buses = plan["current"].get(route_id, 0)
+        change = recommended_buses - current_buses
+        ticket_count = plan["ticket_counts"].get(route_id, 0)
+        if not ticket_count and not change:
+            continue
+        avg_occupancy = plan["occupancy_totals"].get(route_id, 0) / current_buses if current_buses else 50.0
+        demand = plan["features"].get(route_id) or demand_store.features(route_id, now)
+        predicted_demand = plan["predictions"].get(route_id, 0)
+        expected = plan["expected_demand"].get(route_id, 0)
         
-        # Determine priority and recommendation
-        if (model_loaded and predicted_demand > 0.8) or (avg_occupancy > 80 or demand_per_bus > 30):
+        if change > 0:
             # High demand - need more buses
             priority = "HIGH"
-            recommended_buses = current_buses + 1
-            change = +1
-            reason = f"High demand detected (ML Prediction: {predicted_demand:.2f}), capacity straining."
+            reason = f"High demand detected (ML Prediction: {predicted_demand:.2f}), about {expected:.0f} passengers expected, capacity straining."
             impact = "Reduce overcrowding, improve service."
-        elif (model_loaded and predicted_demand < 0.3) and (avg_occupancy < 30 and current_buses > 1):
-            # Low demand - can reduce buses
+        elif change < 0:
+            # Low demand - buses are needed more elsewhere
             priority = "LOW"
-            recommended_buses = max(1, current_buses - 1)
-            change = -1
-            reason = f"Low predicted demand (ML Prediction: {predicted_demand:.2f}), capacity surplus."
+            reason = f"Low predicted demand (ML Prediction: {predicted_demand:.2f}), capacity surplus; buses needed on busier routes."
             impact = "Save fuel and resource costs."
         else:
             # Optimal
             priority = "MEDIUM"
-            recommended_buses = current_buses
-            change = 0
             reason = "Optimal allocation, maintaining current schedule."
             impact = "Maintain 90%+ efficiency."
         
@@ -140,24 +164,33 @@ def analyze_route_demand() -> List[Dict[str, Any]]:
             "change": change,
             "average_occupancy": round(avg_occupancy, 1),
             "ticket_count": ticket_count,
+            "expected_demand": round(expected, 1),
+            "demand_15m": demand["demand_15m"],
+            "demand_1h": demand["demand_1h"],
+            "demand_same_hour_last_week": demand["demand_same_hour_last_week"],
+            "forecast_next_hour": demand["forecast_next_hour"],
             "ml_prediction": round(float(predicted_demand), 2) if model_loaded else None,
             "reason": reason,
             "impact": impact
         })
     
-    # Sort by priority (HIGH first)
+    # Sort by priority (HIGH first), biggest moves first within a priority
     priority_order = {"HIGH": 0, "MEDIUM": 1, "LOW": 2}
-    recommendations.sort(key=lambda x: priority_order.get(x["priority"], 1))
+    recommendations.sort(key=lambda x: (priority_order.get(x["priority"], 1), -abs(x["change"])))
     
     return recommendations
 
+def _movable(buses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Buses in the order they should be moved: idle first, then the emptiest"""
+    return sorted(buses, key=lambda b: (b.get("status") != "IDLE", b.get("occupancy_percent") or 0))
+
 @router.get("/recommendations")
 async def get_recommendations():
     """Get AI-powered bus reallocation suggestions"""
     recommendations = analyze_route_demand()
     
     return {
-        "analysis_summary": "Based on passenger footfall patterns, congestion data, and historical ticketing records from the past 7 days, the system recommends the following bus reallocations to optimize fleet efficiency.",
+        "analysis_summary": "Based on tickets issued in the last 15 minutes and hour, the same hour last week and the ticket history per route (including archived days), weighed against current buses and occupancy, the system recommends the following bus reallocations to optimize fleet efficiency.",
         "generated_at": datetime.now().isoformat(),
         "recommendations": recommendations[:10]  # Top 10 recommendations
     }
@@ -173,33 +206,90 @@ async def get_high_priority_recommendations():
         "recommendations": high_priority
     }
 
-@router.post("/apply-allocation")
+@router.post("/apply-allocation", dependencies=[Depends(require_role("coordinator"))])
 async def apply_allocation(action: AllocationAction):
-    """Apply an AI-suggested bus reallocation"""
-    # In a real system, this would reassign buses
-    # For the prototype, we'll just acknowledge the action
+    """
+    Apply an AI-suggested bus reallocation. Added buses come from standby,
+    then from routes the fleet plan has in surplus or that have buses to
+    spare; removed buses go to routes the plan is short of, otherwise back to
+    standby.
+    """
+    wanted = abs(action.buses_change)
+    plan = fleet_plan(datetime.now())
+    
+    try:
+        planned = plan_moves(action.route_id, action.action, wanted, plan["current"], plan["current_standby"],
+                             plan["allocation"], config.MIN_BUSES_PER_ROUTE, plan["expected_demand"], plan["capacity"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
+    buses_by_route = defaultdict(list)
+    for bus in repository.buses.all():
+        buses_by_route[bus.get("route_id") or None].append(bus)
+    
+    # Pick concrete buses for each planned move
+    candidates = {source: _movable(buses_by_route[source]) for source, _, _ in planned}
+    moves = []  # (bus, to_route)
+    for source, destination, count in planned:
+        for _ in range(min(count, len(candidates[source]))):
+            moves.append((candidates[source].pop(0), destination))
+    
+    updates = {}
+    for bus, to_route in moves:
+        updates[bus["id"]] = {"route_id": to_route} if to_route else {"route_id": None, "status": "IDLE"}
+    if updates:
+        repository.buses.update_many(updates)
+        fleet_table.apply(updates)
+        detector.observe_many([{**bus, **updates[bus["id"]]} for bus, _ in moves])
+    
+    moved = [{"bus_id": bus["id"], "from_route": bus.get("route_id"), "to_route": to_route} for bus, to_route in moves]
     return {
-        "success": True,
-        "message": f"Allocation applied: {action.action} {abs(action.buses_change)} bus(es) on route {action.route_id}",
-        "route_id": action.route_id
+        "success": bool(moved),
+        "message": f"Allocation applied: {action.action} {len(moved)} of {wanted} bus(es) on route {action.route_id}",
+        "route_id": action.route_id,
+        "moved": moved
     }
 
-@router.get("/predict-demand/{route_id}")
-async def predict_route_demand(route_id: str):
-    """Predict demand for a specific route based on historical data"""
-    tickets = read_json("tickets.json")
-    route_tickets = [t for t in tickets if t.get("route_id") == route_id]
+@router.post("/simulate")
+async def simulate_allocations(request: SimulationRequest):
+    """
+    Preview reallocations without applying them: each scenario's actions run
+    against a copy-on-write snapshot of the fleet and the before/after
+    service metrics are returned
+    """
+    if not request.scenarios or len(request.scenarios) > config.MAX_SCENARIOS:
+        raise HTTPException(status_code=400, detail=f"Provide between 1 and {config.MAX_SCENARIOS} scenarios")
+    for scenario in request.scenarios:
+        for action in scenario.actions:
+            if action.action not in ("add", "remove"):
+                raise HTTPException(status_code=400, detail="action must be 'add' or 'remove'")
     
+    plan = fleet_plan(datetime.now())
+    snapshot = FleetSnapshot(
+        plan["current"], plan["current_standby"], plan["on_board"], plan["features"], plan["predictions"],
+        plan["expected_demand"], plan["allocation"], plan["capacity"], config.BUS_CAPACITY, config.MIN_BUSES_PER_ROUTE
+    )
+    results = await simulate(snapshot, [[action.model_dump() for action in s.actions] for s in request.scenarios])
+    
+    baseline = snapshot.metrics()
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "baseline": baseline,
+        "scenarios": [
+            {
+                "name": scenario.name or f"Scenario {i + 1}",
+                **result,
+                "change": {key: round(value - baseline[key], 1) for key, value in result["metrics"].items()}
+            }
+            for i, (scenario, result) in enumerate(zip(request.scenarios, results))
+        ]
+    }
+
+@router.get("/predict-demand/{route_id}")
+async def predict_route_demand(route_id: str, start: Optional[date] = None, end: Optional[date] = None):
+    """Predict demand for a specific route based on historical data (optionally between two dates)"""
     # Group by hour for pattern analysis
-    hourly_pattern = defaultdict(int)
-    for ticket in route_tickets:
-        try:
-            ts = ticket.get("timestamp", "")
-            hour = datetime.fromisoformat(ts.replace("Z", "")).hour
-            hourly_pattern[hour] += 1
-        except:
-            pass
+    hourly_pattern = ticket_archive.count_by_hour(route_id, start, end)
     
     # Find peak hours
     if hourly_pattern:
@@ -211,25 +301,28 @@ async def predict_route_demand(route_id: str):
         total_tickets = 0
         avg_per_hour = 0
     
+    # Per-hour forecast from the last week of tickets
+    demand_store.sync()
+    forecast = demand_store.hourly_forecast(route_id)
+    
     return {
         "route_id": route_id,
         "total_historical_tickets": total_tickets,
         "peak_hour": f"{peak_hour:02d}:00",
         "average_hourly_demand": round(avg_per_hour, 1),
         "hourly_pattern": dict(hourly_pattern),
-        "prediction": f"High demand expected between {peak_hour-1}:00 and {peak_hour+2}:00"
+        "prediction": f"High demand expected between {peak_hour-1}:00 and {peak_hour+2}:00",
+        "recent_demand": demand_store.features(route_id),
+        "hourly_forecast": {f"{h:02d}:00": expected for h, expected in enumerate(forecast)}
     }
 
 @router.get("/congestion-alerts")
 async def get_congestion_alerts():
     """Get routes with congestion/overcrowding issues"""
-    buses = read_json("buses.json")
-    
-    # Find stuck buses (congestion indicator)
-    stuck_buses = [b for b in buses if b.get("status") == "STUCK"]
-    
-    # Find high occupancy buses
-    overcrowded = [b for b in buses if b.get("occupancy_percent", 0) > 85]
+    # Buses currently flagged by the streaming detector (stuck or overcrowded)
+    flagged = detector.active()
+    stuck_buses = flagged["CONGESTION"]
+    overcrowded = flagged["OVERCROWDING"]
     
     alerts = []
     for bus in stuck_buses:
@@ -257,47 +350,33 @@ async def get_congestion_alerts():
         "alerts": alerts
     }
 
+@router.get("/revenue-anomalies")
+async def get_revenue_anomalies():
+    """Buses and routes whose ticket revenue is currently far from their usual level"""
+    anomalies = revenue_monitor.anomalies()
+    return {
+        "total": len(anomalies),
+        "drops": len([a for a in anomalies if a["anomaly"] == "DROP"]),
+        "spikes": len([a for a in anomalies if a["anomaly"] == "SPIKE"]),
+        "anomalies": anomalies
+    }
+
 @router.get("/ml-suggestions-count")
 async def get_ml_suggestions_count():
     """Get count of ML suggested reallocations for dashboard"""
-    recommendations = analyze_route_demand()
-    
-    # Count non-zero change recommendations
-    action_needed = [r for r in recommendations if r["change"] != 0]
-    
-    return {
-        "ml_suggested_reallocations": len(action_needed),
-        "high_priority_count": len([r for r in action_needed if r["priority"] == "HIGH"]),
-        "low_priority_count": len([r for r in action_needed if r["priority"] == "LOW"])
-    }
+    return suggestion_counts(fleet_plan(datetime.now()))
 @router.get("/analytics")
-async def get_analytics_data():
-    """Get aggregated data for analytics charts"""
-    tickets = read_json("tickets.json")
-    buses = read_json("buses.json")
-    routes = read_json("routes.json")
-    alerts = read_json("alerts.json")
-    
+@cached_response("tickets.json", "routes.json", "alerts.json", "buses.json")
+async def get_analytics_data(start: Optional[date] = None, end: Optional[date] = None):
+    """Get aggregated data for analytics charts (optionally between two dates)"""
     # 1. Demand Over Time (Hourly)
-    hourly_demand = defaultdict(int)
-    for ticket in tickets:
-        try:
-            ts = ticket.get("timestamp", "")
-            hour = datetime.fromisoformat(ts.replace("Z", "")).hour
-            hourly_demand[hour] += 1
-        except:
-            pass
+    hourly_demand = ticket_archive.count_by_hour(start=start, end=end)
     
-    demand_chart = [{"hour": f"{h:02d}:00", "count": hourly_demand[h]} for h in range(24)]
+    demand_chart = [{"hour": f"{h:02d}:00", "count": hourly_demand.get(h, 0)} for h in range(24)]
     
     # 2. Revenue Per Route
-    route_revenue = defaultdict(float)
-    route_names = {r["id"]: r["name"] for r in routes}
-    
-    for ticket in tickets:
-        route_id = ticket.get("route_id")
-        if route_id:
-            route_revenue[route_id] += float(ticket.get("fare", 0))
+    route_revenue = {rid: float(rev) for rid, rev in ticket_archive.revenue_by_route(start, end).items()}
+    route_names = {r["id"]: r["name"] for r in repository.routes.all()}
             
     revenue_chart = [
         {"route": route_names.get(rid, rid), "revenue": round(rev, 2)} 
@@ -306,10 +385,10 @@ async def get_analytics_data():
     revenue_chart.sort(key=lambda x: x["revenue"], reverse=True)
     
     # 3. Alert Distribution
-    alert_counts = defaultdict(int)
-    for alert in alerts:
-        alert_type = alert.get("type", "OTHER")
-        alert_counts[alert_type] += 1
+    alert_counts = repository.alerts.count_by("type")
+    total_alerts = repository.alerts.count()
+    if total_alerts > sum(alert_counts.values()):
+        alert_counts["OTHER"] = alert_counts.get("OTHER", 0) + total_alerts - sum(alert_counts.values())
         
     alert_chart = [
         {"name": name, "value": count} 
@@ -321,9 +400,9 @@ async def get_analytics_data():
         "revenue_per_route": revenue_chart[:8],  # Top 8 routes
         "alert_distribution": alert_chart,
         "summary": {
-            "total_tickets": len(tickets),
+            "total_tickets": ticket_archive.count(start, end),
             "total_revenue": sum(route_revenue.values()),
-            "total_alerts": len(alerts),
-            "active_buses": len([b for b in buses if b.get("status") == "ACTIVE"])
+            "total_alerts": total_alerts,
+            "active_buses": repository.buses.count(status="ACTIVE")
         }
     }
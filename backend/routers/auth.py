@@ -2,25 +2,16 @@
 Authentication Router - Login and User Management
 """
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 from typing import Optional
-from services.data_utils import read_json, find_by_key
+from services.security import (
+    create_access_token, get_current_user, public_user, require_role, verify_user_password
+)
+from services.shared_state import users_by_email, users_by_id
 
 router = APIRouter()
 
-# Mock users data
-USERS = [
-    {"id": "U001", "name": "Admin Controller", "email": "admin@bmtc.gov.in", "password": "admin123", "role": "coordinator"},
-    {"id": "U002", "name": "Ganesh Rao", "email": "ganesh@bmtc.gov.in", "password": "conductor123", "role": "conductor", "bus_id": "KA-01-F-1234", "route_id": "R-276"},
-    {"id": "U003", "name": "Ramesh Kumar", "email": "ramesh@bmtc.gov.in", "password": "conductor123", "role": "conductor", "bus_id": "KA-22-W-7547", "route_id": "R-KBS-1"},
-    {"id": "U004", "name": "Suresh Reddy", "email": "suresh@bmtc.gov.in", "password": "conductor123", "role": "conductor", "bus_id": "KA-03-W-1087", "route_id": "R-201"},
-    {"id": "U005", "name": "Prakash M", "email": "prakash@bmtc.gov.in", "password": "conductor123", "role": "conductor", "bus_id": "KA-01-F-3421", "route_id": "G-10"},
-    {"id": "U006", "name": "Anil S", "email": "anil@bmtc.gov.in", "password": "conductor123", "role": "conductor", "bus_id": "KA-01-F-5678", "route_id": "R-500D"},
-    {"id": "U007", "name": "Venkatesh", "email": "venkatesh@bmtc.gov.in", "password": "conductor123", "role": "conductor", "bus_id": "KA-01-F-7890", "route_id": "R-365C"},
-    {"id": "U008", "name": "Passenger User", "email": "user@gmail.com", "password": "user123", "role": "commuter"},
-]
-
 class LoginRequest(BaseModel):
     email: str
     password: str
@@ -29,43 +20,55 @@ class LoginResponse(BaseModel):
     success: bool
     user: Optional[dict] = None
     message: str
+    access_token: Optional[str] = None
+    token_type: str = "bearer"
+    expires_in: Optional[int] = None
 
 @router.post("/login", response_model=LoginResponse)
 async def login(credentials: LoginRequest):
-    """Authenticate user and return user details with role"""
-    for user in USERS:
-        if user["email"] == credentials.email and user["password"] == credentials.password:
-            # Don't return password in response
-            user_data = {k: v for k, v in user.items() if k != "password"}
-            return LoginResponse(
-                success=True,
-                user=user_data,
-                message="Login successful"
-            )
+    """Authenticate user and return user details with role and a session token"""
+    user = users_by_email.get().get(credentials.email)
+    if await verify_user_password(user, credentials.password):
+        token, expires_in = create_access_token(user)
+        return LoginResponse(
+            success=True,
+            user=public_user(user),  # Don't return credentials in response
+            message="Login successful",
+            access_token=token,
+            expires_in=expires_in
+        )
     
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid email or password"
     )
 
-@router.get("/users")
+@router.get("/me")
+async def get_me(current_user: dict = Depends(get_current_user)):
+    """Get the user identified by the session token"""
+    user = users_by_id.get().get(current_user["sub"]) if current_user else None
+    if user:
+        return public_user(user)
+    raise HTTPException(status_code=404, detail="User not found")
+
+@router.get("/users", dependencies=[Depends(require_role("coordinator"))])
 async def get_all_users():
     """Get all users (for admin purposes)"""
-    return [{"id": u["id"], "name": u["name"], "role": u["role"], "email": u["email"]} for u in USERS]
+    return [{"id": u["id"], "name": u["name"], "role": u["role"], "email": u["email"]} for u in users_by_id.get().values()]
 
-@router.get("/users/{user_id}")
+@router.get("/users/{user_id}", dependencies=[Depends(get_current_user)])
 async def get_user(user_id: str):
     """Get user by ID"""
-    for user in USERS:
-        if user["id"] == user_id:
-            return {k: v for k, v in user.items() if k != "password"}
+    user = users_by_id.get().get(user_id)
+    if user:
+        return public_user(user)
     raise HTTPException(status_code=404, detail="User not found")
 
-@router.get("/conductors")
+@router.get("/conductors", dependencies=[Depends(get_current_user)])
 async def get_conductors():
     """Get all conductors for the communication panel"""
     conductors = []
-    for user in USERS:
+    for user in users_by_id.get().values():
         if user["role"] == "conductor":
             conductors.append({
                 "id": user["id"],
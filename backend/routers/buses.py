@@ -2,14 +2,42 @@
 Buses Router - Bus Management Endpoints
 """
 
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, List
-from services.data_utils import read_json, write_json, find_by_key, update_item_in_json
-import random
+from services import repository
+from services.congestion_detector import detector
+from services.pagination import MAX_PAGE_SIZE, fetch_page
+from services.response_cache import cached_response
+from services.security import require_role
+from services.fleet_table import fleet_table
+from services.track_store import track_store
+from datetime import datetime
+from functools import lru_cache
 
 router = APIRouter()
 
+MAX_TRACK_POINTS = 5000
+
+@lru_cache(maxsize=None)
+def _rng():
+    """Random generator for simulated movement, created (with NumPy) on first use"""
+    import numpy as np
+
+    return np.random.default_rng()
+
+class Bus(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    id: str
+    route_id: Optional[str] = None
+    status: Optional[str] = None
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+    occupancy_percent: Optional[int] = None
+    last_stop: Optional[str] = None
+    speed: Optional[str] = None
+
 class BusStatusUpdate(BaseModel):
     status: str  # MOVING, IDLE, STUCK, BREAKDOWN
 
@@ -21,105 +49,140 @@ class BusLocationUpdate(BaseModel):
 class BusOccupancyUpdate(BaseModel):
     occupancy_percent: int
 
-@router.get("/")
-async def get_all_buses():
-    """Get all buses with live positions and status"""
-    buses = read_json("buses.json")
-    return buses
+@router.get("/", response_model=List[Bus], response_model_exclude_unset=True)
+async def get_all_buses(
+    response: Response,
+    fields: Optional[str] = Query(None, description="Comma-separated fields, e.g. id,lat,lng,status"),
+    status: Optional[str] = None,
+    route_id: Optional[str] = None,
+    min_occupancy: Optional[int] = Query(None, ge=0, le=100),
+    max_occupancy: Optional[int] = Query(None, ge=0, le=100),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    """Get buses with live positions and status (filterable, paginated)"""
+    where = {}
+    if status:
+        where["status"] = status
+    if route_id:
+        where["route_id"] = route_id
+    if min_occupancy is not None:
+        where["occupancy_percent__gte"] = min_occupancy
+    if max_occupancy is not None:
+        where["occupancy_percent__lte"] = max_occupancy
+    return fetch_page(repository.buses, response, limit=limit, cursor=cursor, fields=fields, **where)
 
 @router.get("/stats")
+@cached_response("buses.json")
 async def get_bus_stats():
     """Get fleet statistics for dashboard"""
-    buses = read_json("buses.json")
-    
-    total = len(buses)
-    active = len([b for b in buses if b.get("status") == "MOVING"])
-    idle = len([b for b in buses if b.get("status") == "IDLE"])
-    stuck = len([b for b in buses if b.get("status") == "STUCK"])
-    
-    # Calculate average occupancy
-    avg_occupancy = sum(b.get("occupancy_percent", 0) for b in buses) / total if total > 0 else 0
-    
-    # Count high occupancy buses (>80%)
-    high_occupancy = len([b for b in buses if b.get("occupancy_percent", 0) > 80])
-    
-    return {
-        "total_active_buses": active,
-        "total_buses": total,
-        "idle_buses": idle,
-        "stuck_buses": stuck,
-        "average_occupancy": round(avg_occupancy, 1),
-        "high_occupancy_count": high_occupancy
-    }
+    return fleet_table.get().stats()
 
-@router.get("/by-route/{route_id}")
+@router.get("/by-route/{route_id}", response_model=List[Bus], response_model_exclude_unset=True)
 async def get_buses_by_route(route_id: str):
     """Get all buses on a specific route"""
-    buses = read_json("buses.json")
-    return [b for b in buses if b.get("route_id") == route_id]
+    return fleet_table.get().find(route_id=route_id)
 
-@router.get("/{bus_id}")
+@router.get("/{bus_id}", response_model=Bus, response_model_exclude_unset=True)
 async def get_bus(bus_id: str):
     """Get single bus details"""
-    buses = read_json("buses.json")
-    for bus in buses:
-        if bus["id"] == bus_id:
-            return bus
+    bus = repository.buses.get(bus_id)
+    if bus:
+        return bus
     raise HTTPException(status_code=404, detail="Bus not found")
 
-@router.patch("/{bus_id}/status")
+@router.get("/{bus_id}/track")
+async def get_bus_track(
+    bus_id: str,
+    start: Optional[datetime] = Query(None, description="Range start (default: one hour before end)"),
+    end: Optional[datetime] = Query(None, description="Range end (default: now)"),
+    points: int = Query(500, ge=2, le=MAX_TRACK_POINTS, description="Maximum points returned"),
+    interval: Optional[float] = Query(None, gt=0, description="Seconds per point instead of shape-preserving sampling (widened to fit the range in `points`)"),
+):
+    """Replay a bus's recorded path over a time range, downsampled for display"""
+    end_at = (end or datetime.now()).timestamp()
+    start_at = start.timestamp() if start else end_at - 3600
+    if start_at > end_at:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return {
+        "bus_id": bus_id,
+        "start": datetime.fromtimestamp(start_at).isoformat(),
+        "end": datetime.fromtimestamp(end_at).isoformat(),
+        **track_store.replay(bus_id, start_at, end_at, points=points, interval=interval)
+    }
+
+@router.patch("/{bus_id}/status", dependencies=[Depends(require_role("coordinator", "conductor"))])
 async def update_bus_status(bus_id: str, update: BusStatusUpdate):
     """Update bus status (active/breakdown/break)"""
-    buses = read_json("buses.json")
-    for bus in buses:
-        if bus["id"] == bus_id:
-            bus["status"] = update.status
-            if update.status in ["IDLE", "BREAKDOWN"]:
-                bus["speed"] = "0km/h"
-            write_json("buses.json", buses)
-            return {"success": True, "message": f"Bus {bus_id} status updated to {update.status}"}
+    changes = {"status": update.status}
+    if update.status in ["IDLE", "BREAKDOWN"]:
+        changes["speed"] = "0km/h"
+    bus = repository.buses.update(bus_id, changes)
+    if bus:
+        fleet_table.apply({bus_id: changes})
+        detector.observe_many([bus])
+        return {"success": True, "message": f"Bus {bus_id} status updated to {update.status}"}
     raise HTTPException(status_code=404, detail="Bus not found")
 
-@router.patch("/{bus_id}/location")
+@router.patch("/{bus_id}/location", dependencies=[Depends(require_role("coordinator", "conductor"))])
 async def update_bus_location(bus_id: str, update: BusLocationUpdate):
     """Update bus coordinates (for live tracking simulation)"""
-    buses = read_json("buses.json")
-    for bus in buses:
-        if bus["id"] == bus_id:
-            bus["lat"] = update.lat
-            bus["lng"] = update.lng
-            if update.speed:
-                bus["speed"] = update.speed
-            write_json("buses.json", buses)
-            return {"success": True, "message": "Location updated"}
+    changes = {"lat": update.lat, "lng": update.lng}
+    if update.speed:
+        changes["speed"] = update.speed
+    bus = repository.buses.update(bus_id, changes)
+    if bus:
+        fleet_table.apply({bus_id: changes})
+        detector.observe_many([bus], located=True)
+        track_store.append(bus_id, update.lat, update.lng, bus.get("speed"))
+        return {"success": True, "message": "Location updated"}
     raise HTTPException(status_code=404, detail="Bus not found")
 
-@router.patch("/{bus_id}/occupancy")
+@router.patch("/{bus_id}/occupancy", dependencies=[Depends(require_role("coordinator", "conductor"))])
 async def update_bus_occupancy(bus_id: str, update: BusOccupancyUpdate):
     """Update bus occupancy percentage"""
-    buses = read_json("buses.json")
-    for bus in buses:
-        if bus["id"] == bus_id:
-            bus["occupancy_percent"] = min(100, max(0, update.occupancy_percent))
-            write_json("buses.json", buses)
-            return {"success": True, "message": "Occupancy updated", "new_value": bus["occupancy_percent"]}
+    changes = {"occupancy_percent": min(100, max(0, update.occupancy_percent))}
+    bus = repository.buses.update(bus_id, changes)
+    if bus:
+        fleet_table.apply({bus_id: changes})
+        detector.observe_many([bus])
+        return {"success": True, "message": "Occupancy updated", "new_value": bus["occupancy_percent"]}
     raise HTTPException(status_code=404, detail="Bus not found")
 
-@router.post("/simulate-movement")
+@router.post("/simulate-movement", dependencies=[Depends(require_role("coordinator"))])
 async def simulate_bus_movement():
     """Simulate random bus movement for demo purposes"""
-    buses = read_json("buses.json")
+    import numpy as np
+
+    rng = _rng()
+    table = fleet_table.get()
+    rows = np.flatnonzero(table.mask(status="MOVING") & np.isfinite(table.lat) & np.isfinite(table.lng))
+    count = len(rows)
+    
+    # Small random movement, speed change and occupancy fluctuation, for all moving buses at once
+    lat = table.lat[rows] + rng.uniform(-0.001, 0.001, count)
+    lng = table.lng[rows] + rng.uniform(-0.001, 0.001, count)
+    speed = rng.integers(10, 46, count)
+    occupancy = np.clip(np.nan_to_num(table.occupancy[rows], nan=50) + rng.integers(-5, 6, count), 0, 100)
     
-    for bus in buses:
-        if bus.get("status") == "MOVING":
-            # Small random movement
-            bus["lat"] += random.uniform(-0.001, 0.001)
-            bus["lng"] += random.uniform(-0.001, 0.001)
-            # Random speed change
-            bus["speed"] = f"{random.randint(10, 45)}km/h"
-            # Random occupancy fluctuation
-            current_occ = bus.get("occupancy_percent", 50)
-            bus["occupancy_percent"] = max(0, min(100, current_occ + random.randint(-5, 5)))
+    changes = {}
+    for row, bus_lat, bus_lng, bus_speed, bus_occ in zip(
+        rows.tolist(), lat.tolist(), lng.tolist(), speed.tolist(), occupancy.astype(int).tolist()
+    ):
+        changes[table.ids[row]] = {
+            "lat": bus_lat,
+            "lng": bus_lng,
+            "speed": f"{bus_speed}km/h",
+            "occupancy_percent": bus_occ
+        }
     
-    write_json("buses.json", buses)
+    repository.buses.update_many(changes)
+    fleet_table.apply(changes)
+    moved = [{**table.bus(row), **changes[table.ids[row]]} for row in rows.tolist()]
+    detector.observe_many(moved, located=True)
+    now = datetime.now().timestamp()
+    track_store.append_many(
+        (table.ids[row], now, bus_lat, bus_lng, float(bus_speed))
+        for row, bus_lat, bus_lng, bus_speed in zip(rows.tolist(), lat.tolist(), lng.tolist(), speed.tolist())
+    )
     return {"success": True, "message": "Bus positions simulated"}
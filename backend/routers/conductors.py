@@ -2,66 +2,19 @@
 Conductors Router - Conductor-specific endpoints for the Conductor app
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from services.data_utils import read_json, write_json
+from services import repository
+from services.congestion_detector import detector
+from services.data_utils import generate_id
+from services.fleet_table import fleet_table
+from services.security import require_role
+from services.shared_state import assignments_by_conductor, users_by_id
 from datetime import datetime
 from typing import Optional, List
 
 router = APIRouter()
 
-# Mock conductor assignments
-CONDUCTOR_ASSIGNMENTS = {
-    "U002": {
-        "bus_number": "KA-01-F-4532",
-        "route_id": "335E",
-        "route_name": "Kempegowda Bus Station → Electronic City",
-        "start_time": "06:30 AM",
-        "end_time": "10:30 PM",
-        "status": "ACTIVE"
-    },
-    "U003": {
-        "bus_number": "KA-22-W-7547",
-        "route_id": "R-KBS-1",
-        "route_name": "Majestic → Hebbal → Yelahanka",
-        "start_time": "05:00 AM",
-        "end_time": "09:00 PM",
-        "status": "ACTIVE"
-    },
-    "U004": {
-        "bus_number": "KA-03-W-1087",
-        "route_id": "R-201",
-        "route_name": "Bannerghatta → Jayanagar → Majestic",
-        "start_time": "06:00 AM",
-        "end_time": "10:00 PM",
-        "status": "ACTIVE"
-    },
-    "U005": {
-        "bus_number": "KA-01-F-3421",
-        "route_id": "G-10",
-        "route_name": "Marathahalli → Whitefield ITPL",
-        "start_time": "07:00 AM",
-        "end_time": "11:00 PM",
-        "status": "ACTIVE"
-    },
-    "U006": {
-        "bus_number": "KA-01-F-5678",
-        "route_id": "R-500D",
-        "route_name": "Silk Board → Hebbal via ORR",
-        "start_time": "05:30 AM",
-        "end_time": "09:30 PM",
-        "status": "ACTIVE"
-    },
-    "U007": {
-        "bus_number": "KA-01-F-7890",
-        "route_id": "R-365C",
-        "route_name": "Banashankari → Bannerghatta Rd",
-        "start_time": "06:00 AM",
-        "end_time": "10:00 PM",
-        "status": "ACTIVE"
-    }
-}
-
 class StatusUpdate(BaseModel):
     status: str  # ON_DUTY, ON_BREAK, BREAKDOWN
 
@@ -73,14 +26,13 @@ class BreakdownReport(BaseModel):
 @router.get("/assignment/{conductor_id}")
 async def get_conductor_assignment(conductor_id: str):
     """Get today's assignment for a conductor"""
-    assignment = CONDUCTOR_ASSIGNMENTS.get(conductor_id)
+    assignment = assignments_by_conductor.get().get(conductor_id)
     
     if not assignment:
         raise HTTPException(status_code=404, detail="Assignment not found")
     
     # Get current location from bus data
-    buses = read_json("buses.json")
-    bus = next((b for b in buses if b["id"] == assignment["bus_number"]), None)
+    bus = repository.buses.get(assignment["bus_number"])
     
     tracking_info = {
         "current_location": bus.get("last_stop", "Unknown") if bus else "Unknown",
@@ -91,20 +43,18 @@ async def get_conductor_assignment(conductor_id: str):
     
     return {
         "date": datetime.now().strftime("%A, %d %B %Y"),
-        **assignment,
+        **{k: v for k, v in assignment.items() if k != "conductor_id"},
         "tracking": tracking_info
     }
 
 @router.get("/notifications/{conductor_id}")
 async def get_conductor_notifications(conductor_id: str):
     """Get notifications for a specific conductor"""
-    alerts = read_json("alerts.json")
+    # Get broadcasts and relevant alerts (the 5 newest of each query cover the newest 5 overall)
+    by_type = repository.alerts.find(order_by="timestamp", descending=True, limit=5, type__in=["BROADCAST", "INFO", "TRAFFIC"])
+    critical = repository.alerts.find(order_by="timestamp", descending=True, limit=5, priority="CRITICAL")
     
-    # Get broadcasts and relevant alerts
-    conductor_alerts = [
-        a for a in alerts 
-        if a.get("type") in ["BROADCAST", "INFO", "TRAFFIC"] or a.get("priority") == "CRITICAL"
-    ]
+    conductor_alerts = list({a.get("id"): a for a in by_type + critical}.values())
     
     # Sort by timestamp and take recent ones
     conductor_alerts.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
@@ -156,31 +106,28 @@ def get_time_ago(timestamp: str) -> str:
     except:
         return "Unknown"
 
-@router.patch("/status/{conductor_id}")
+@router.patch("/status/{conductor_id}", dependencies=[Depends(require_role("coordinator", "conductor"))])
 async def update_conductor_status(conductor_id: str, update: StatusUpdate):
     """Update conductor duty status"""
-    if conductor_id in CONDUCTOR_ASSIGNMENTS:
-        CONDUCTOR_ASSIGNMENTS[conductor_id]["status"] = update.status
+    # Written to the shared store so every worker sees the new status
+    if repository.assignments.update(conductor_id, {"status": update.status}):
         return {"success": True, "message": f"Status updated to {update.status}"}
     
     raise HTTPException(status_code=404, detail="Conductor not found")
 
-@router.post("/breakdown-report")
+@router.post("/breakdown-report", dependencies=[Depends(require_role("coordinator", "conductor"))])
 async def report_breakdown(report: BreakdownReport):
     """Report bus breakdown"""
-    alerts = read_json("alerts.json")
-    buses = read_json("buses.json")
-    
     # Update bus status
-    for bus in buses:
-        if bus["id"] == report.bus_id:
-            bus["status"] = "BREAKDOWN"
-            bus["speed"] = "0km/h"
-            break
+    changes = {"status": "BREAKDOWN", "speed": "0km/h"}
+    bus = repository.buses.update(report.bus_id, changes)
+    if bus:
+        fleet_table.apply({report.bus_id: changes})
+        detector.observe_many([bus])
     
     # Create alert
     new_alert = {
-        "id": f"BRK-{datetime.now().strftime('%Y%m%d%H%M%S')}",
+        "id": generate_id("BRK"),
         "timestamp": datetime.now().isoformat(),
         "sender": "CONDUCTOR",
         "type": "BREAKDOWN",
@@ -191,9 +138,7 @@ async def report_breakdown(report: BreakdownReport):
         "bus_id": report.bus_id
     }
     
-    alerts.append(new_alert)
-    write_json("alerts.json", alerts)
-    write_json("buses.json", buses)
+    repository.alerts.insert(new_alert)
     
     return {"success": True, "alert_id": new_alert["id"], "message": "Breakdown reported to Control Center"}
 
@@ -211,7 +156,7 @@ async def get_quick_actions():
 async def get_all_conductors():
     """Get all conductors with their current status"""
     conductors = []
-    for cid, assignment in CONDUCTOR_ASSIGNMENTS.items():
+    for cid, assignment in assignments_by_conductor.get().items():
         conductors.append({
             "id": cid,
             "name": get_conductor_name(cid),
@@ -224,12 +169,5 @@ async def get_all_conductors():
 
 def get_conductor_name(conductor_id: str) -> str:
     """Get conductor name by ID"""
-    names = {
-        "U002": "Ganesh Rao",
-        "U003": "Ramesh Kumar",
-        "U004": "Suresh Reddy",
-        "U005": "Prakash M",
-        "U006": "Anil S",
-        "U007": "Venkatesh"
-    }
-    return names.get(conductor_id, "Unknown")
+    user = users_by_id.get().get(conductor_id)
+    return user.get("name", "Unknown") if user else "Unknown"
@@ -0,0 +1,113 @@
+"""
+Dashboard Router - Coordinator Control Center summary in one request
+"""
+
+import hashlib
+import heapq
+from fastapi import APIRouter, Query
+from routers.ai_engine import fleet_plan, suggestion_counts
+from services import repository
+from services.fleet_table import fleet_table
+from services.storage import get_engine
+from services.ticket_archive import archive
+from datetime import datetime
+from typing import Dict, Any, List
+
+router = APIRouter()
+
+SUMMARY_COLLECTIONS = ("buses.json", "routes.json", "tickets.json", "alerts.json")
+
+# Retries when a write lands while the summary is computed
+SNAPSHOT_ATTEMPTS = 3
+
+def _snapshot_version() -> tuple:
+    engine = get_engine()
+    return tuple(engine.version(name) for name in SUMMARY_COLLECTIONS) + (archive.generation(),)
+
+def _ticket_summary(tickets: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Ticket totals and tickets per route from one pass over the hot tickets plus the archive manifest"""
+    route_counts: Dict[str, int] = {}
+    revenue = 0
+    for ticket in tickets:
+        revenue += ticket.get("fare") or 0
+        route_id = ticket.get("route_id")
+        if route_id is not None:
+            route_counts[route_id] = route_counts.get(route_id, 0) + 1
+    for route_id, archived in archive.route_totals()[0].items():
+        route_counts[route_id] = route_counts.get(route_id, 0) + archived
+
+    top_routes = sorted(route_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+    return {
+        "stats": {
+            "total_tickets": len(tickets) + archive.count(),
+            "total_revenue": revenue + archive.fare_total(),
+            "top_routes": [{"route_id": r, "ticket_count": c} for r, c in top_routes]
+        },
+        "route_counts": route_counts,
+    }
+
+def _route_stats(total_routes: int, route_demand: Dict[str, int]) -> Dict[str, Any]:
+    avg_demand = sum(route_demand.values()) / len(route_demand) if route_demand else 0
+    high_demand_routes = [r for r, d in route_demand.items() if d > avg_demand * 1.5]
+    low_demand_routes = [r for r, d in route_demand.items() if d < avg_demand * 0.5]
+    return {
+        "total_routes": total_routes,
+        "routes_with_high_demand": len(high_demand_routes),
+        "routes_with_low_demand": len(low_demand_routes),
+        "high_demand_route_ids": high_demand_routes[:5],
+        "low_demand_route_ids": low_demand_routes[:5]
+    }
+
+def _alert_summary(alerts: List[Dict[str, Any]], recent: int) -> Dict[str, Any]:
+    """Notification statistics and the most recent alerts from one pass over the alerts"""
+    status_counts: Dict[str, int] = {}
+    congestion = 0
+    for alert in alerts:
+        status = alert.get("status")
+        if status is not None:
+            status_counts[status] = status_counts.get(status, 0) + 1
+        if alert.get("type") == "CONGESTION":
+            congestion += 1
+    # Newest first like /api/notifications/recent (missing timestamps last)
+    latest = heapq.nlargest(recent, alerts, key=lambda a: (a.get("timestamp") is not None, a.get("timestamp") or ""))
+    return {
+        "stats": {
+            "total_alerts": len(alerts),
+            "unread_count": status_counts.get("UNREAD", 0),
+            "active_count": status_counts.get("ACTIVE", 0),
+            "congestion_alerts": congestion
+        },
+        "recent": latest,
+    }
+
+def _summary(recent_alerts: int) -> Dict[str, Any]:
+    fleet = fleet_table.get()
+    tickets = _ticket_summary(repository.tickets.all())
+    alerts = _alert_summary(repository.alerts.all(), recent_alerts)
+    plan = fleet_plan(datetime.now(), ticket_counts=tickets["route_counts"], supply=fleet.supply())
+    return {
+        "buses": fleet.stats(),
+        "routes": _route_stats(repository.routes.count(), tickets["route_counts"]),
+        "tickets": tickets["stats"],
+        "notifications": alerts["stats"],
+        "ml_suggestions": suggestion_counts(plan),
+        "recent_alerts": alerts["recent"],
+    }
+
+@router.get("/summary")
+async def get_dashboard_summary(recent_alerts: int = Query(4, ge=0, le=50)):
+    """
+    Bus, route, ticket and notification statistics, the ML suggestion counts
+    and the latest alerts, each collection read once. `version` identifies
+    the data snapshot all of them were computed from.
+    """
+    for _ in range(SNAPSHOT_ATTEMPTS):
+        version = _snapshot_version()
+        summary = _summary(recent_alerts)
+        if _snapshot_version() == version:
+            break
+    return {
+        "version": hashlib.blake2b(repr(version).encode("utf-8"), digest_size=8).hexdigest(),
+        "generated_at": datetime.now().isoformat(),
+        **summary,
+    }
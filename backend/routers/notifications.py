@@ -2,10 +2,15 @@
 Notifications Router - Broadcast and Alert System
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel
-from services.data_utils import read_json, write_json, generate_id
-from datetime import datetime
+from services import config, repository
+from services.exports import date_range, export_response
+from services.pagination import MAX_PAGE_SIZE, fetch_page
+from services.response_cache import cached_response
+from services.security import require_role
+from services.data_utils import generate_id
+from datetime import date, datetime
 from typing import Optional, List
 
 router = APIRouter()
@@ -21,43 +26,72 @@ class SOSAlert(BaseModel):
     type: str = "SOS"
     message: Optional[str] = None
 
+ALERT_EXPORT_COLUMNS = ("id", "timestamp", "type", "priority", "status", "sender", "bus_id", "route_id",
+                        "message", "location")
+
 class TrafficReport(BaseModel):
     bus_id: str
     location: List[float]
     message: str
 
 @router.get("/")
-async def get_all_notifications():
-    """Get all alerts and notifications"""
-    alerts = read_json("alerts.json")
+async def get_all_notifications(
+    response: Response,
+    fields: Optional[str] = Query(None, description="Comma-separated fields, e.g. id,type,message,timestamp"),
+    status: Optional[str] = None,
+    alert_type: Optional[str] = Query(None, alias="type"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    """Get alerts and notifications, newest first (filterable, paginated)"""
+    where = {}
+    if status:
+        where["status"] = status
+    if alert_type:
+        where["type__iexact"] = alert_type
     # Sort by timestamp descending
-    alerts.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-    return alerts
+    return fetch_page(repository.alerts, response, limit=limit, cursor=cursor, fields=fields,
+                      order_by="timestamp", descending=True, **where)
+
+@router.get("/export")
+async def export_notifications(
+    export_format: str = Query("csv", alias="format", description="csv or ndjson"),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    status: Optional[str] = None,
+    alert_type: Optional[str] = Query(None, alias="type"),
+    route_id: Optional[str] = None,
+    gzip: bool = False,
+):
+    """Stream every alert between two dates, in the order they were raised"""
+    where = date_range(start, end)
+    if status:
+        where["status"] = status
+    if alert_type:
+        where["type__iexact"] = alert_type
+    if route_id:
+        where["route_id"] = route_id
+    chunks = repository.alerts.scan(config.EXPORT_CHUNK_SIZE, **where)
+    return export_response("alerts", chunks, ALERT_EXPORT_COLUMNS, export_format, gzip)
 
 @router.get("/recent")
 async def get_recent_notifications(limit: int = 10):
     """Get recent notifications for dashboard"""
-    alerts = read_json("alerts.json")
-    alerts.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-    return alerts[:limit]
+    return repository.alerts.find(order_by="timestamp", descending=True, limit=limit)
 
 @router.get("/unread")
 async def get_unread_notifications():
     """Get unread notifications"""
-    alerts = read_json("alerts.json")
-    return [a for a in alerts if a.get("status") == "UNREAD"]
+    return repository.alerts.find(status="UNREAD")
 
 @router.get("/by-type/{alert_type}")
 async def get_notifications_by_type(alert_type: str):
     """Get notifications by type"""
-    alerts = read_json("alerts.json")
-    return [a for a in alerts if a.get("type", "").upper() == alert_type.upper()]
+    return repository.alerts.find(type__iexact=alert_type)
 
-@router.post("/broadcast")
+@router.post("/broadcast", dependencies=[Depends(require_role("coordinator"))])
 async def send_broadcast(message_data: BroadcastMessage):
     """Send broadcast message to all conductors"""
-    alerts = read_json("alerts.json")
-    
     new_alert = {
         "id": generate_id("ALRT"),
         "timestamp": datetime.now().isoformat(),
@@ -68,16 +102,13 @@ async def send_broadcast(message_data: BroadcastMessage):
         "status": "SENT"
     }
     
-    alerts.append(new_alert)
-    write_json("alerts.json", alerts)
+    repository.alerts.insert(new_alert)
     
     return {"success": True, "alert_id": new_alert["id"], "message": "Broadcast sent successfully"}
 
 @router.post("/sos")
 async def send_sos_alert(sos_data: SOSAlert):
     """Handle SOS emergency alert from conductor or passenger"""
-    alerts = read_json("alerts.json")
-    
     new_alert = {
         "id": generate_id("SOS"),
         "timestamp": datetime.now().isoformat(),
@@ -90,16 +121,13 @@ async def send_sos_alert(sos_data: SOSAlert):
         "bus_id": sos_data.bus_id
     }
     
-    alerts.append(new_alert)
-    write_json("alerts.json", alerts)
+    repository.alerts.insert(new_alert)
     
     return {"success": True, "alert_id": new_alert["id"], "message": "SOS Alert sent to Control Center"}
 
-@router.post("/traffic")
+@router.post("/traffic", dependencies=[Depends(require_role("coordinator", "conductor"))])
 async def report_traffic(report: TrafficReport):
     """Report traffic issue from conductor"""
-    alerts = read_json("alerts.json")
-    
     new_alert = {
         "id": generate_id("TRF"),
         "timestamp": datetime.now().isoformat(),
@@ -112,46 +140,36 @@ async def report_traffic(report: TrafficReport):
         "bus_id": report.bus_id
     }
     
-    alerts.append(new_alert)
-    write_json("alerts.json", alerts)
+    repository.alerts.insert(new_alert)
     
     return {"success": True, "alert_id": new_alert["id"], "message": "Traffic report submitted"}
 
-@router.patch("/{alert_id}/resolve")
+@router.patch("/{alert_id}/resolve", dependencies=[Depends(require_role("coordinator"))])
 async def resolve_alert(alert_id: str):
     """Mark an alert as resolved"""
-    alerts = read_json("alerts.json")
-    
-    for alert in alerts:
-        if alert["id"] == alert_id:
-            alert["status"] = "RESOLVED"
-            write_json("alerts.json", alerts)
-            return {"success": True, "message": "Alert resolved"}
+    if repository.alerts.update(alert_id, {"status": "RESOLVED"}):
+        return {"success": True, "message": "Alert resolved"}
     
     raise HTTPException(status_code=404, detail="Alert not found")
 
-@router.patch("/{alert_id}/read")
+@router.patch("/{alert_id}/read", dependencies=[Depends(require_role("coordinator", "conductor"))])
 async def mark_as_read(alert_id: str):
     """Mark a notification as read"""
-    alerts = read_json("alerts.json")
-    
-    for alert in alerts:
-        if alert["id"] == alert_id:
-            alert["status"] = "READ"
-            write_json("alerts.json", alerts)
-            return {"success": True}
+    if repository.alerts.update(alert_id, {"status": "READ"}):
+        return {"success": True}
     
     raise HTTPException(status_code=404, detail="Alert not found")
 
 @router.get("/stats")
+@cached_response("alerts.json")
 async def get_notification_stats():
     """Get notification statistics for dashboard"""
-    alerts = read_json("alerts.json")
+    status_counts = repository.alerts.count_by("status")
     
-    total = len(alerts)
-    unread = len([a for a in alerts if a.get("status") == "UNREAD"])
-    active = len([a for a in alerts if a.get("status") == "ACTIVE"])
-    congestion = len([a for a in alerts if a.get("type") == "CONGESTION"])
+    total = repository.alerts.count()
+    unread = status_counts.get("UNREAD", 0)
+    active = status_counts.get("ACTIVE", 0)
+    congestion = repository.alerts.count(type="CONGESTION")
     
     return {
         "total_alerts": total,
@@ -2,40 +2,48 @@
 Routes Router - Route Management Endpoints
 """
 
-from fastapi import APIRouter, HTTPException
-from services.data_utils import read_json, find_by_key
-from typing import List, Dict
+from fastapi import APIRouter, HTTPException, Query, Response
+from pydantic import BaseModel, ConfigDict
+from routers.buses import Bus
+from services import config, repository, ticket_archive
+from services.fleet_table import fleet_table
+from services.load_profiles import load_profiles
+from services.pagination import MAX_PAGE_SIZE, fetch_page
+from services.response_cache import cached_response
+from typing import List, Dict, Optional
 
 router = APIRouter()
 
-@router.get("/")
-async def get_all_routes():
-    """Get all routes"""
-    routes = read_json("routes.json")
-    return routes
+class Route(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    id: str
+    name: Optional[str] = None
+    stops: List[str] = []
+    coordinates: List[List[float]] = []
+
+# The route catalogue rarely changes; let browsers reuse it between sessions
+ROUTES_CACHE_CONTROL = f"private, max-age={config.ROUTES_MAX_AGE}"
+
+@router.get("/", response_model=List[Route], response_model_exclude_unset=True)
+@cached_response("routes.json", cache_control=ROUTES_CACHE_CONTROL)
+async def get_all_routes(
+    response: Response,
+    fields: Optional[str] = Query(None, description="Comma-separated fields, e.g. id,name"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    """Get routes (paginated, optionally without stop geometry)"""
+    return fetch_page(repository.routes, response, limit=limit, cursor=cursor, fields=fields)
 
 @router.get("/stats")
+@cached_response("routes.json", "tickets.json")
 async def get_route_stats():
     """Get route statistics for dashboard"""
-    routes = read_json("routes.json")
-    buses = read_json("buses.json")
-    tickets = read_json("tickets.json")
-    
-    total_routes = len(routes)
+    total_routes = repository.routes.count()
     
-    # Count buses per route
-    route_bus_count = {}
-    for bus in buses:
-        route_id = bus.get("route_id")
-        if route_id:
-            route_bus_count[route_id] = route_bus_count.get(route_id, 0) + 1
-    
-    # Count tickets per route (last 7 days for demand)
-    route_demand = {}
-    for ticket in tickets:
-        route_id = ticket.get("route_id")
-        if route_id:
-            route_demand[route_id] = route_demand.get(route_id, 0) + 1
+    # Count tickets per route (demand indicator)
+    route_demand = ticket_archive.count_by_route()
     
     # Identify high demand vs low demand routes
     avg_demand = sum(route_demand.values()) / len(route_demand) if route_demand else 0
@@ -50,25 +58,32 @@ async def get_route_stats():
         "low_demand_route_ids": low_demand_routes[:5]
     }
 
-@router.get("/{route_id}")
+@router.get("/{route_id}", response_model=Route, response_model_exclude_unset=True)
+@cached_response("routes.json", cache_control=ROUTES_CACHE_CONTROL)
 async def get_route(route_id: str):
     """Get route details with stops"""
-    routes = read_json("routes.json")
-    for route in routes:
-        if route["id"] == route_id:
-            return route
+    route = repository.routes.get(route_id)
+    if route:
+        return route
     raise HTTPException(status_code=404, detail="Route not found")
 
-@router.get("/{route_id}/buses")
+@router.get("/{route_id}/buses", response_model=List[Bus], response_model_exclude_unset=True)
 async def get_buses_on_route(route_id: str):
     """Get all buses currently on a route"""
-    buses = read_json("buses.json")
-    return [b for b in buses if b.get("route_id") == route_id]
+    return fleet_table.get().find(route_id=route_id)
+
+@router.get("/{route_id}/load-profile")
+async def get_route_load_profile(route_id: str, hour: Optional[int] = Query(None, ge=0, le=23)):
+    """Passengers on each segment between stops, from ticket origins and destinations"""
+    profile = load_profiles.profile(route_id, hour)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Route not found")
+    return profile
 
-@router.get("/search/{query}")
+@router.get("/search/{query}", response_model=List[Route], response_model_exclude_unset=True)
 async def search_routes(query: str):
     """Search routes by name or stop"""
-    routes = read_json("routes.json")
+    routes = repository.routes.all()
     query = query.lower()
     
     results = []
@@ -0,0 +1,24 @@
+"""
+Sync Router - Delta sync for conductor handhelds and dashboards
+"""
+
+from fastapi import APIRouter, HTTPException, Query
+from services.change_log import SYNCED, change_log
+from services.storage import collection_name
+from typing import Optional
+
+router = APIRouter()
+
+SYNC_COLLECTIONS = {collection_name(filename): filename for filename in SYNCED}
+
+@router.get("")
+async def sync(
+    since: int = Query(0, ge=0, description="Version returned by the previous sync (0 for a full snapshot)"),
+    collections: Optional[str] = Query(None, description="Comma-separated subset of buses, alerts, routes, assignments"),
+):
+    """Records changed and keys deleted since a version, with the version to send next time"""
+    names = [name.strip() for name in collections.split(",") if name.strip()] if collections else list(SYNC_COLLECTIONS)
+    unknown = [name for name in names if name not in SYNC_COLLECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown collections: {', '.join(unknown)}")
+    return change_log.changes(since, [SYNC_COLLECTIONS[name] for name in names])
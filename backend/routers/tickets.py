@@ -2,11 +2,22 @@
 Tickets Router - Ticketing System Endpoints
 """
 
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from services.data_utils import read_json, write_json, generate_id
-from datetime import datetime
-from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from pydantic import BaseModel, ConfigDict, Field
+from services import config, repository, ticket_archive
+from services.congestion_detector import detector
+from services.demand_features import demand_store
+from services.exports import date_range, export_response
+from services.fare_tables import fare_tables
+from services.fleet_table import fleet_table
+from services.load_profiles import load_profiles
+from services.pagination import MAX_PAGE_SIZE, fetch_page
+from services.revenue_monitor import revenue_monitor
+from services.response_cache import cached_response
+from services.security import require_role
+from services.data_utils import generate_id
+from datetime import date, datetime
+from typing import List, Optional
 
 router = APIRouter()
 
@@ -15,34 +26,71 @@ class TicketCreate(BaseModel):
     route_id: str
     from_stop: str
     to_stop: str
-    fare: int
+    fare: Optional[int] = None  # computed from the route's fare table when omitted
     quantity: int = 1
 
+class Ticket(BaseModel):
+    model_config = ConfigDict(extra="allow", populate_by_name=True)
+
+    tid: str
+    bus_id: Optional[str] = None
+    route_id: Optional[str] = None
+    timestamp: Optional[str] = None
+    from_stop: Optional[str] = Field(None, alias="from")
+    to_stop: Optional[str] = Field(None, alias="to")
+    fare: Optional[int] = None
+
+TICKET_EXPORT_COLUMNS = ("tid", "timestamp", "route_id", "bus_id", "from", "to", "fare")
+
 class TicketResponse(BaseModel):
     success: bool
     ticket_id: str
     message: str
 
-@router.get("/")
-async def get_all_tickets():
-    """Get all tickets (for admin/analytics)"""
-    tickets = read_json("tickets.json")
-    return tickets[-100:]  # Return last 100 tickets
+@router.get("/", response_model=List[Ticket], response_model_exclude_unset=True)
+async def get_all_tickets(
+    response: Response,
+    fields: Optional[str] = Query(None, description="Comma-separated fields, e.g. tid,fare,timestamp"),
+    route_id: Optional[str] = None,
+    bus_id: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    """
+    Get tickets (for admin/analytics). Pages walk back from the newest ticket;
+    each page is returned oldest first.
+    """
+    where = {}
+    if route_id:
+        where["route_id"] = route_id
+    if bus_id:
+        where["bus_id"] = bus_id
+    tickets = fetch_page(repository.tickets, response, limit=limit, cursor=cursor, fields=fields, descending=True, **where)
+    tickets.reverse()
+    return tickets
+
+@router.get("/export")
+async def export_tickets(
+    export_format: str = Query("csv", alias="format", description="csv or ndjson"),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    route_id: Optional[str] = None,
+    gzip: bool = False,
+):
+    """Stream every ticket (archived and current) between two dates, oldest first"""
+    date_range(start, end)
+    chunks = ticket_archive.scan(start, end, route_id, config.EXPORT_CHUNK_SIZE)
+    return export_response("tickets", chunks, TICKET_EXPORT_COLUMNS, export_format, gzip)
 
 @router.get("/stats")
+@cached_response("tickets.json")
 async def get_ticket_stats():
     """Get ticketing statistics"""
-    tickets = read_json("tickets.json")
-    
-    total_tickets = len(tickets)
-    total_revenue = sum(t.get("fare", 0) for t in tickets)
+    total_tickets = ticket_archive.count()
+    total_revenue = ticket_archive.total_revenue()
     
     # Group by route
-    route_sales = {}
-    for t in tickets:
-        route_id = t.get("route_id")
-        if route_id:
-            route_sales[route_id] = route_sales.get(route_id, 0) + 1
+    route_sales = ticket_archive.count_by_route()
     
     # Top routes
     top_routes = sorted(route_sales.items(), key=lambda x: x[1], reverse=True)[:5]
@@ -53,13 +101,30 @@ async def get_ticket_stats():
         "top_routes": [{"route_id": r, "ticket_count": c} for r, c in top_routes]
     }
 
-@router.post("/issue")
+@router.get("/fare-quote")
+async def get_fare_quote(route_id: str, from_stop: str, to_stop: str, quantity: int = Query(1, ge=1)):
+    """Fare between two stops of a route (for the conductor ticketing screen)"""
+    quote = fare_tables.quote(route_id, from_stop, to_stop)
+    if quote is None:
+        raise HTTPException(status_code=404, detail="Route or stop not found")
+    return {**quote, "quantity": quantity, "total_fare": quote["fare"] * quantity}
+
+@router.post("/issue", dependencies=[Depends(require_role("coordinator", "conductor"))])
 async def issue_ticket(ticket_data: TicketCreate):
     """Issue a new ticket (from conductor)"""
-    tickets = read_json("tickets.json")
-    buses = read_json("buses.json")
-    
+    fare = ticket_data.fare
+    quote = None if config.FARE_POLICY == "client" else fare_tables.quote(
+        ticket_data.route_id, ticket_data.from_stop, ticket_data.to_stop
+    )
+    if quote is not None:
+        if config.FARE_POLICY == "validate" and fare is not None and fare != quote["fare"]:
+            raise HTTPException(status_code=400, detail=f"Fare {fare} does not match the route fare {quote['fare']}")
+        fare = quote["fare"]
+    if fare is None:
+        raise HTTPException(status_code=400, detail="Fare is required")
+
     # Create ticket(s)
+    tickets = []
     new_tickets = []
     for _ in range(ticket_data.quantity):
         ticket_id = generate_id("T")
@@ -70,56 +135,54 @@ async def issue_ticket(ticket_data: TicketCreate):
             "timestamp": datetime.now().isoformat(),
             "from": ticket_data.from_stop,
             "to": ticket_data.to_stop,
-            "fare": ticket_data.fare
+            "fare": fare
         }
         tickets.append(new_ticket)
         new_tickets.append(ticket_id)
     
-    # Update bus occupancy
-    for bus in buses:
-        if bus["id"] == ticket_data.bus_id:
-            current_occ = bus.get("occupancy_percent", 0)
-            # Each ticket adds ~2% occupancy (assuming 50 seat capacity)
-            bus["occupancy_percent"] = min(100, current_occ + (ticket_data.quantity * 2))
-            break
+    repository.tickets.insert(*tickets)
+    demand_store.observe_many(tickets)
+    load_profiles.observe_many(tickets)
+    revenue_monitor.observe_many(tickets)
     
-    write_json("tickets.json", tickets)
-    write_json("buses.json", buses)
+    # Update bus occupancy from the passengers still on board
+    bus = repository.buses.get(ticket_data.bus_id)
+    if bus:
+        occupancy = None
+        if load_profiles.maps(ticket_data.route_id, ticket_data.from_stop, ticket_data.to_stop):
+            occupancy = load_profiles.occupancy_percent(bus["id"], bus.get("last_stop"))
+        if occupancy is None:
+            # Stops not on the route: each ticket adds ~2% occupancy (assuming 50 seat capacity)
+            occupancy = min(100, bus.get("occupancy_percent", 0) + (ticket_data.quantity * 2))
+        bus = repository.buses.update(bus["id"], {"occupancy_percent": occupancy})
+        if bus:
+            fleet_table.apply({bus["id"]: {"occupancy_percent": occupancy}})
+            detector.observe_many([bus])
     
     return {
         "success": True,
         "ticket_ids": new_tickets,
+        "fare": fare,
+        "total_fare": fare * ticket_data.quantity,
         "message": f"Issued {ticket_data.quantity} ticket(s) successfully"
     }
 
-@router.get("/by-bus/{bus_id}")
+@router.get("/by-bus/{bus_id}", response_model=List[Ticket], response_model_exclude_unset=True)
 async def get_tickets_by_bus(bus_id: str):
     """Get recent tickets issued on a bus"""
-    tickets = read_json("tickets.json")
-    bus_tickets = [t for t in tickets if t.get("bus_id") == bus_id]
-    return bus_tickets[-20:]  # Last 20 tickets
+    return ticket_archive.tail(20, bus_id=bus_id)  # Last 20 tickets
 
-@router.get("/by-route/{route_id}")
+@router.get("/by-route/{route_id}", response_model=List[Ticket], response_model_exclude_unset=True)
 async def get_tickets_by_route(route_id: str):
     """Get tickets for a specific route"""
-    tickets = read_json("tickets.json")
-    route_tickets = [t for t in tickets if t.get("route_id") == route_id]
-    return route_tickets[-50:]  # Last 50 tickets
+    return ticket_archive.tail(50, route_id=route_id)  # Last 50 tickets
 
 @router.get("/hourly-demand/{route_id}")
-async def get_hourly_demand(route_id: str):
-    """Get hourly demand pattern for a route (for AI training)"""
-    tickets = read_json("tickets.json")
-    route_tickets = [t for t in tickets if t.get("route_id") == route_id]
-    
+async def get_hourly_demand(route_id: str, start: Optional[date] = None, end: Optional[date] = None):
+    """Get hourly demand pattern for a route (for AI training), optionally between two dates"""
     # Group by hour
     hourly = {f"{h:02d}:00": 0 for h in range(24)}
-    for t in route_tickets:
-        ts = t.get("timestamp", "")
-        try:
-            hour = datetime.fromisoformat(ts.replace("Z", "")).hour
-            hourly[f"{hour:02d}:00"] += 1
-        except:
-            pass
+    for hour, count in ticket_archive.count_by_hour(route_id, start, end).items():
+        hourly[f"{hour:02d}:00"] += count
     
     return hourly
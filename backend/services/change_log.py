@@ -0,0 +1,204 @@
+"""
+Change log behind the delta sync API
+
+Each synced collection (buses, alerts, routes, assignments) is tracked per
+primary key: a digest of the record and the version at which it last
+changed. Versions come from one counter shared by every collection and
+every worker, so they only ever increase. When a collection's storage
+version moves (seen by the change notifier, and checked again before each
+sync request) the collection is diffed against the stored digests, and
+its added or modified records and deleted keys get the next version.
+
+Only the last change of each key is kept, so the log never grows beyond
+the collections themselves and GET /api/sync?since=V returns every changed
+record once, with its current body. Deleted keys are kept as tombstones,
+at most SYNC_TOMBSTONES per collection; dropping older ones raises the
+log's floor, and a client whose `since` is below the floor (or who has
+never synced) gets a full snapshot instead.
+
+The log lives in SYNC_DIR/changes.json, replaced atomically under a lock
+file so all workers share one counter.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from services import config
+from services.fast_json import dumps
+from services.shared_state import notifier
+from services.storage import collection_name, get_engine, primary_key
+
+SYNCED = ("buses.json", "alerts.json", "routes.json", "assignments.json")
+
+LOG_FILE = "changes.json"
+
+def _digest(item: Dict[str, Any]) -> str:
+    return hashlib.blake2b(dumps(item), digest_size=8).hexdigest()
+
+def _token(version: Any) -> str:
+    """Storage version token in a form that survives a JSON round trip"""
+    return json.dumps(version)
+
+def _empty() -> Dict[str, Any]:
+    return {"version": 0, "floor": 0, "collections": {}}
+
+class ChangeLog:
+    """Per-key change versions of the synced collections, shared by all workers"""
+
+    def __init__(self, root: str, collections: Sequence[str], tombstones: int):
+        self.root = root
+        self.collections = tuple(collections)
+        self.tombstones = tombstones
+        self._lock = threading.RLock()
+        self._state: Dict[str, Any] = _empty()
+        self._stamp: Any = None
+
+    def path(self) -> str:
+        return os.path.join(self.root, LOG_FILE)
+
+    def state(self) -> Dict[str, Any]:
+        """{"version", "floor", "collections": {name: entry}}, re-read when the file changes"""
+        try:
+            stat = os.stat(self.path())
+            stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            return _empty()
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    try:
+                        with open(self.path(), "r", encoding="utf-8") as f:
+                            self._state = json.load(f)
+                    except (OSError, json.JSONDecodeError) as e:
+                        print(f"Error reading sync change log: {e}")
+                        return _empty()
+                    self._stamp = stamp
+        return self._state
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Serialise log updates across threads and processes"""
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            try:
+                import fcntl
+            except ImportError:
+                yield
+                return
+            with open(os.path.join(self.root, ".changes.lock"), "a") as handle:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+    def _save(self, state: Dict[str, Any]):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp-", suffix=".json")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(dumps(state))
+            os.replace(tmp_path, self.path())
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _diff(self, state: Dict[str, Any], entry: Dict[str, Any], filename: str, items: List[Dict[str, Any]]):
+        """Give added, modified and deleted keys of a collection the next version"""
+        key = primary_key(filename)
+        version = state["version"] + 1
+        records, deleted = entry["records"], entry["deleted"]
+        seen = set()
+        touched = False
+        for item in items:
+            if item.get(key) is None:
+                continue
+            pk = str(item[key])
+            seen.add(pk)
+            digest = _digest(item)
+            record = records.get(pk)
+            if record is None or record[0] != digest:
+                records[pk] = [digest, version]
+                deleted.pop(pk, None)
+                touched = True
+        for pk in [pk for pk in records if pk not in seen]:
+            del records[pk]
+            deleted[pk] = version
+            touched = True
+        if not touched:
+            return
+        state["version"] = entry["version"] = version
+        # Compaction: past the tombstone limit the oldest deletions are forgotten
+        excess = len(deleted) - max(0, self.tombstones)
+        if excess > 0:
+            dropped = sorted(deleted.items(), key=lambda pair: pair[1])[:excess]
+            for pk, _ in dropped:
+                del deleted[pk]
+            state["floor"] = max(state["floor"], dropped[-1][1])
+
+    def record(self, filenames: Optional[Sequence[str]] = None) -> int:
+        """Log changes to the collections since they were last diffed; returns the current version"""
+        filenames = filenames or self.collections
+        engine = get_engine()
+        # Tokens are read before the data, so a concurrent write is never missed
+        tokens = {filename: _token(engine.version(filename)) for filename in filenames}
+        state = self.state()
+        stale = [
+            filename for filename in filenames
+            if state["collections"].get(collection_name(filename), {}).get("token") != tokens[filename]
+        ]
+        if not stale:
+            return state["version"]
+        with self._locked():
+            state = json.loads(json.dumps(self.state()))
+            for filename in stale:
+                entry = state["collections"].setdefault(
+                    collection_name(filename), {"token": None, "version": 0, "records": {}, "deleted": {}}
+                )
+                if entry["token"] == tokens[filename]:
+                    continue
+                self._diff(state, entry, filename, engine.read_all(filename))
+                entry["token"] = tokens[filename]
+            self._save(state)
+            return state["version"]
+
+    def changes(self, since: int, filenames: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """
+        Records changed and keys deleted after version `since`, per collection,
+        and the version to send next time. A full snapshot if `since` is 0,
+        older than the log's floor or ahead of the log.
+        """
+        filenames = filenames or self.collections
+        self.record(filenames)
+        state = self.state()
+        full = since <= 0 or since < state["floor"] or since > state["version"]
+        result: Dict[str, Any] = {"version": state["version"], "since": since, "full": full, "collections": {}}
+        engine = get_engine()
+        for filename in filenames:
+            name = collection_name(filename)
+            entry = state["collections"].get(name, {"version": 0, "records": {}, "deleted": {}})
+            if full:
+                result["collections"][name] = {"changed": engine.read_all(filename), "deleted": []}
+                continue
+            changed: List[Dict[str, Any]] = []
+            if entry["version"] > since:
+                key, records = primary_key(filename), entry["records"]
+                for item in engine.read_all(filename):
+                    record = records.get(str(item.get(key)))
+                    if record is not None and record[1] > since:
+                        changed.append(item)
+            deleted = [pk for pk, version in entry["deleted"].items() if version > since]
+            result["collections"][name] = {"changed": changed, "deleted": deleted}
+        return result
+
+    def start(self):
+        """Log changes as soon as the change notifier sees them, not only on sync requests"""
+        for filename in self.collections:
+            notifier.subscribe(filename, lambda changed: self.record([changed]))
+
+change_log = ChangeLog(config.SYNC_DIR, SYNCED, config.SYNC_TOMBSTONES)
@@ -0,0 +1,222 @@
+"""
+Compiled random forest: flat NumPy arrays and a pure-NumPy evaluator
+
+    python -m services.compiled_forest                       # compile backup_predictor_rf.joblib
+    python -m services.compiled_forest models/demand_rf-<version>.joblib
+
+A fitted sklearn RandomForestClassifier/Regressor is flattened into one set
+of node arrays for all trees (feature, threshold, left/right child, leaf
+value) plus the tree roots, and saved as an uncompressed .npz. Loading maps
+each array straight from the file with np.memmap, so every worker shares the
+same pages and nothing from sklearn, pandas or joblib is imported.
+
+The evaluator walks all (sample, tree) pairs one level per step and averages
+leaf values in tree order, exactly as sklearn does, so predictions are
+identical to the original model's.
+"""
+
+import os
+import struct
+import sys
+import zipfile
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+LEAF = -2  # sklearn's TREE_UNDEFINED feature marker
+
+def compile_forest(model: Any, feature_columns: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    """Flatten a fitted sklearn forest into node arrays"""
+    if getattr(model, "n_outputs_", 1) != 1:
+        raise ValueError("Only single-output forests can be compiled")
+    is_classifier = hasattr(model, "classes_")
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    max_depth = 0
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        internal = tree.children_left != -1
+        roots.append(offset)
+        features.append(np.where(internal, tree.feature, LEAF).astype(np.int32))
+        thresholds.append(tree.threshold.astype(np.float64))
+        lefts.append(np.where(internal, tree.children_left + offset, -1).astype(np.int32))
+        rights.append(np.where(internal, tree.children_right + offset, -1).astype(np.int32))
+        value = tree.value[:, 0, :].astype(np.float64)
+        if is_classifier:
+            # Per-tree class probabilities, normalised the way predict_proba does
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            value = value / normalizer
+        values.append(value)
+        max_depth = max(max_depth, tree.max_depth)
+        offset += tree.node_count
+
+    arrays = {
+        "feature": np.concatenate(features),
+        "threshold": np.concatenate(thresholds),
+        "left": np.concatenate(lefts),
+        "right": np.concatenate(rights),
+        "value": np.concatenate(values),
+        "roots": np.array(roots, dtype=np.int32),
+        "max_depth": np.array(max_depth, dtype=np.int32),
+        "n_features": np.array(model.n_features_in_, dtype=np.int32),
+    }
+    if is_classifier:
+        arrays["classes"] = np.asarray(model.classes_)
+    if feature_columns is None and hasattr(model, "feature_names_in_"):
+        feature_columns = list(model.feature_names_in_)
+    if feature_columns is not None:
+        arrays["feature_columns"] = np.array(list(feature_columns), dtype=str)
+    return arrays
+
+def save_compiled(path: str, arrays: Dict[str, np.ndarray]):
+    """Write compiled arrays as an uncompressed (memory-mappable) .npz"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+def load_npz(path: str, mmap: bool = True) -> Dict[str, np.ndarray]:
+    """
+    Load every array of an .npz. Uncompressed members are memory-mapped in
+    place (np.load cannot mmap inside a zip); others are read normally.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if not mmap or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            # Skip the zip local file header to reach the .npy payload
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_length, extra_length = struct.unpack("<HH", header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                raise ValueError(f"{path}: object arrays are not supported")
+            if not shape or 0 in shape:
+                arrays[name] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+                continue
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                     order="F" if fortran_order else "C")
+    return arrays
+
+class CompiledForest:
+    """Pure-NumPy evaluator over compiled forest arrays"""
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        self.max_depth = int(arrays["max_depth"])
+        self.n_features = int(arrays["n_features"])
+        self.classes = arrays.get("classes")
+        columns = arrays.get("feature_columns")
+        self.feature_columns: Optional[List[str]] = [str(c) for c in columns] if columns is not None else None
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "CompiledForest":
+        return cls(load_npz(path, mmap=mmap))
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def leaves(self, X: Any) -> np.ndarray:
+        """Leaf node index reached by each sample in each tree, shape (n_samples, n_trees)"""
+        # sklearn evaluates splits on float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got shape {X.shape}")
+        nodes = np.repeat(np.asarray(self.roots)[None, :], X.shape[0], axis=0)
+        rows = np.arange(X.shape[0])[:, None]
+        for _ in range(self.max_depth):
+            feature = self.feature[nodes]
+            internal = feature != LEAF
+            if not internal.any():
+                break
+            go_left = X[rows, np.where(internal, feature, 0)] <= self.threshold[nodes]
+            nodes = np.where(internal, np.where(go_left, self.left[nodes], self.right[nodes]), nodes)
+        return nodes
+
+    def _mean_value(self, X: Any) -> np.ndarray:
+        leaf_values = self.value[self.leaves(X)]
+        total = np.zeros((leaf_values.shape[0], leaf_values.shape[2]), dtype=np.float64)
+        # Accumulate tree by tree, in the same order as sklearn
+        for tree in range(leaf_values.shape[1]):
+            total += leaf_values[:, tree, :]
+        return total / self.n_trees
+
+    def predict_proba(self, X: Any) -> np.ndarray:
+        if self.classes is None:
+            raise ValueError("predict_proba is only available for classifiers")
+        return self._mean_value(X)
+
+    def predict(self, X: Any) -> np.ndarray:
+        mean = self._mean_value(X)
+        if self.classes is None:
+            return mean[:, 0]
+        return np.asarray(self.classes)[np.argmax(mean, axis=1)]
+
+def compiled_path(model_path: str) -> str:
+    """Path of the compiled counterpart of a .joblib model"""
+    return os.path.splitext(model_path)[0] + ".npz"
+
+def compile_file(model_path: str, columns_path: Optional[str] = None, check_rows: int = 2000) -> str:
+    """Compile a .joblib model next to itself and verify predictions match"""
+    import joblib
+
+    model = joblib.load(model_path)
+    columns = joblib.load(columns_path) if columns_path else None
+    out_path = compiled_path(model_path)
+    save_compiled(out_path, compile_forest(model, columns))
+
+    if check_rows:
+        compiled = CompiledForest.load(out_path)
+        rng = np.random.default_rng(0)
+        probe = np.column_stack([
+            rng.integers(0, int(max(1, abs(t))) * 2 + 2, size=check_rows)
+            for t in _feature_scales(compiled)
+        ]).astype(np.float64)
+        expected = model.predict(_as_model_input(model, probe))
+        if not np.array_equal(expected, compiled.predict(probe)):
+            os.remove(out_path)
+            raise ValueError(f"Compiled predictions differ from {model_path}")
+    return out_path
+
+def _feature_scales(compiled: CompiledForest) -> List[float]:
+    """Largest split threshold per feature, to probe realistic input ranges"""
+    scales = [1.0] * compiled.n_features
+    feature = np.asarray(compiled.feature)
+    threshold = np.asarray(compiled.threshold)
+    for index in range(compiled.n_features):
+        used = threshold[feature == index]
+        if used.size:
+            scales[index] = float(np.abs(used).max())
+    return scales
+
+def _as_model_input(model: Any, X: np.ndarray) -> Any:
+    if hasattr(model, "feature_names_in_"):
+        import pandas as pd
+        return pd.DataFrame(X, columns=model.feature_names_in_)
+    return X
+
+if __name__ == "__main__":
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if len(sys.argv) > 1:
+        model_file = sys.argv[1]
+        columns_file = sys.argv[2] if len(sys.argv) > 2 else None
+    else:
+        model_file = os.path.join(base_dir, "models", "backup_predictor_rf.joblib")
+        columns_file = os.path.join(base_dir, "models", "feature_columns.joblib")
+    print(f"Compiled {model_file} -> {compile_file(model_file, columns_file)}")
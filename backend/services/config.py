@@ -0,0 +1,158 @@
+"""
+Runtime configuration read from environment variables
+"""
+
+import os
+
+# Data directory (relative to the backend folder)
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "data")
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer environment variable, falling back to the default"""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Invalid value for {name}: {value!r}, using {default}")
+        return default
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float environment variable, falling back to the default"""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"Invalid value for {name}: {value!r}, using {default}")
+        return default
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Read a boolean environment variable (1/true/yes/on)"""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+# Snowflake worker id (0-1023). -1 claims a free slot per process automatically.
+WORKER_ID = _env_int("ROUTESAATHI_WORKER_ID", -1)
+
+# Storage engine: "json" (one file per collection) or "sqlite"
+STORAGE_BACKEND = os.getenv("ROUTESAATHI_STORAGE", "json")
+
+# SQLite database file used by the sqlite storage engine
+SQLITE_PATH = os.getenv("ROUTESAATHI_SQLITE_PATH", os.path.join(DATA_DIR, "routesaathi.db"))
+
+# Seconds between cross-worker change polls (services.shared_state.ChangeNotifier)
+CHANGE_POLL_INTERVAL = _env_float("ROUTESAATHI_CHANGE_POLL_INTERVAL", 1.0)
+
+# Require a bearer token on every API endpoint except login and health
+AUTH_REQUIRED = _env_bool("ROUTESAATHI_AUTH_REQUIRED", True)
+
+# HS256 signing secret; generated per host into data/.jwt_secret when unset
+JWT_SECRET = os.getenv("ROUTESAATHI_JWT_SECRET", "")
+
+# Session token lifetime (one long shift)
+TOKEN_TTL_MINUTES = _env_int("ROUTESAATHI_TOKEN_TTL_MINUTES", 720)
+
+# Decoded tokens kept in the verification LRU
+TOKEN_CACHE_SIZE = _env_int("ROUTESAATHI_TOKEN_CACHE_SIZE", 4096)
+
+# bcrypt work factor for new password hashes
+BCRYPT_ROUNDS = _env_int("ROUTESAATHI_BCRYPT_ROUNDS", 12)
+
+# Serialized responses kept by services.response_cache (per worker)
+RESPONSE_CACHE_SIZE = _env_int("ROUTESAATHI_RESPONSE_CACHE_SIZE", 512)
+
+# Browser cache lifetime for the route catalogue, which rarely changes
+ROUTES_MAX_AGE = _env_int("ROUTESAATHI_ROUTES_MAX_AGE", 3600)
+
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = _env_int("ROUTESAATHI_COMPRESSION_MIN_SIZE", 1024)
+
+# Serve the demand model from its compiled .npz (NumPy only) when one exists
+USE_COMPILED_MODEL = _env_bool("ROUTESAATHI_USE_COMPILED_MODEL", True)
+
+# Passengers one bus carries; the fleet optimizer plans for TARGET_LOAD_FACTOR of it
+BUS_CAPACITY = _env_int("ROUTESAATHI_BUS_CAPACITY", 50)
+TARGET_LOAD_FACTOR = _env_float("ROUTESAATHI_TARGET_LOAD_FACTOR", 0.8)
+
+# Buses a served route keeps when the fleet is rebalanced
+MIN_BUSES_PER_ROUTE = _env_int("ROUTESAATHI_MIN_BUSES_PER_ROUTE", 1)
+
+# Worker processes for what-if scenario simulation (1 runs scenarios inline)
+SIMULATION_WORKERS = _env_int("ROUTESAATHI_SIMULATION_WORKERS", min(4, os.cpu_count() or 1))
+
+# Requests with fewer scenarios run inline: below this the pool round trip costs more than it saves
+SIMULATION_PARALLEL_MIN = _env_int("ROUTESAATHI_SIMULATION_PARALLEL_MIN", 4)
+
+# Scenarios accepted in one simulation request
+MAX_SCENARIOS = _env_int("ROUTESAATHI_MAX_SCENARIOS", 8)
+
+# Congestion detection: a bus that stays within STUCK_RADIUS_M for STUCK_MINUTES
+# is congested until it moves more than STUCK_CLEAR_RADIUS_M
+STUCK_MINUTES = _env_float("ROUTESAATHI_STUCK_MINUTES", 5.0)
+STUCK_RADIUS_M = _env_float("ROUTESAATHI_STUCK_RADIUS_M", 50.0)
+STUCK_CLEAR_RADIUS_M = _env_float("ROUTESAATHI_STUCK_CLEAR_RADIUS_M", 150.0)
+POSITION_SAMPLE_SECONDS = _env_float("ROUTESAATHI_POSITION_SAMPLE_SECONDS", 30.0)
+
+# Overcrowding alert raised above ENTER percent occupancy, cleared below EXIT
+OVERCROWDED_ENTER = _env_int("ROUTESAATHI_OVERCROWDED_ENTER", 85)
+OVERCROWDED_EXIT = _env_int("ROUTESAATHI_OVERCROWDED_EXIT", 75)
+
+# Per-bus daily position track segments, and how many days are kept (0 keeps all)
+TRACKS_DIR = os.getenv("ROUTESAATHI_TRACKS_DIR", os.path.join(DATA_DIR, "tracks"))
+TRACK_RETENTION_DAYS = _env_int("ROUTESAATHI_TRACK_RETENTION_DAYS", 30)
+
+# Record request/storage/model metrics and serve them at /api/metrics
+METRICS_ENABLED = _env_bool("ROUTESAATHI_METRICS_ENABLED", True)
+
+# Request profiling (services.profiling); nothing is installed unless enabled
+PROFILING_ENABLED = _env_bool("ROUTESAATHI_PROFILING_ENABLED", False)
+# Keep a sampled profile of requests slower than this (0 disables)
+PROFILE_SLOW_MS = _env_float("ROUTESAATHI_PROFILE_SLOW_MS", 1000.0)
+PROFILE_SAMPLE_INTERVAL_MS = _env_float("ROUTESAATHI_PROFILE_SAMPLE_INTERVAL_MS", 5.0)
+PROFILE_BUFFER_SIZE = _env_int("ROUTESAATHI_PROFILE_BUFFER_SIZE", 20)
+
+# Segment loads: tickets are bucketed per LOAD_BUCKET_MINUTES, and a bus's
+# passengers count as on board for LOAD_WINDOW_MINUTES after their ticket
+LOAD_BUCKET_MINUTES = _env_int("ROUTESAATHI_LOAD_BUCKET_MINUTES", 15)
+LOAD_WINDOW_MINUTES = _env_int("ROUTESAATHI_LOAD_WINDOW_MINUTES", 90)
+
+# Distance-stage fares: FARE_MINIMUM for the first FARE_STAGE_KM, FARE_PER_STAGE for each further stage
+FARE_STAGE_KM = _env_float("ROUTESAATHI_FARE_STAGE_KM", 3.0)
+FARE_MINIMUM = _env_int("ROUTESAATHI_FARE_MINIMUM", 10)
+FARE_PER_STAGE = _env_int("ROUTESAATHI_FARE_PER_STAGE", 5)
+# How issued tickets are priced on known routes: "compute" charges the table
+# fare, "validate" rejects a client fare that differs, "client" trusts the client
+FARE_POLICY = os.getenv("ROUTESAATHI_FARE_POLICY", "compute").lower()
+
+# Roll tickets from before today into compressed day partitions (services.ticket_archive)
+ARCHIVE_ENABLED = _env_bool("ROUTESAATHI_ARCHIVE_ENABLED", False)
+ARCHIVE_DIR = os.getenv("ROUTESAATHI_ARCHIVE_DIR", os.path.join(DATA_DIR, "archive", "tickets"))
+ARCHIVE_CHECK_SECONDS = _env_float("ROUTESAATHI_ARCHIVE_CHECK_SECONDS", 600.0)
+# Worker processes summarising archive partitions (1 reads them inline)
+ARCHIVE_WORKERS = _env_int("ROUTESAATHI_ARCHIVE_WORKERS", min(4, os.cpu_count() or 1))
+
+# Streaming exports: items read per chunk, and the gzip level for gzip=true
+EXPORT_CHUNK_SIZE = _env_int("ROUTESAATHI_EXPORT_CHUNK_SIZE", 1000)
+EXPORT_GZIP_LEVEL = _env_int("ROUTESAATHI_EXPORT_GZIP_LEVEL", 6)
+
+# Revenue anomaly detection: bucket length, EWMA weight of the latest bucket,
+# |z-score| that raises / resolves an alert, buckets seen before scoring, and
+# the longest run of empty buckets still counted as zero revenue
+REVENUE_BUCKET_MINUTES = _env_int("ROUTESAATHI_REVENUE_BUCKET_MINUTES", 15)
+REVENUE_EWMA_ALPHA = _env_float("ROUTESAATHI_REVENUE_EWMA_ALPHA", 0.3)
+REVENUE_Z_ENTER = _env_float("ROUTESAATHI_REVENUE_Z_ENTER", 3.0)
+REVENUE_Z_EXIT = _env_float("ROUTESAATHI_REVENUE_Z_EXIT", 1.5)
+REVENUE_MIN_BUCKETS = _env_int("ROUTESAATHI_REVENUE_MIN_BUCKETS", 8)
+REVENUE_MAX_GAP_BUCKETS = _env_int("ROUTESAATHI_REVENUE_MAX_GAP_BUCKETS", 4)
+
+# Delta sync change log: where it lives, and deleted keys remembered per collection
+SYNC_DIR = os.getenv("ROUTESAATHI_SYNC_DIR", os.path.join(DATA_DIR, "sync"))
+SYNC_TOMBSTONES = _env_int("ROUTESAATHI_SYNC_TOMBSTONES", 1000)
+
+# Preload storage, indexes and the demand model on a background thread at startup
+WARMUP_ENABLED = _env_bool("ROUTESAATHI_WARMUP_ENABLED", True)
@@ -0,0 +1,218 @@
+"""
+Streaming congestion and overcrowding detection
+
+The detector runs on every bus position, occupancy or status update. Each
+update costs O(1) and touches only the bus that changed. Per bus it keeps:
+
+    positions   - ring buffer of recent positions, at most one sample per
+                  POSITION_SAMPLE_SECONDS, covering the last STUCK_MINUTES
+    reported    - when the bus last reported its position; a bus whose GPS
+                  went quiet is not taken to be standing still
+    congested   - set when the bus has stayed within STUCK_RADIUS_M for
+                  STUCK_MINUTES, with a position report inside that window
+                  (or reports status STUCK); cleared only once it moves more
+                  than STUCK_CLEAR_RADIUS_M
+    overcrowded - set above OVERCROWDED_ENTER percent occupancy, cleared below
+                  OVERCROWDED_EXIT percent
+
+The separate enter and clear thresholds (hysteresis) stop alerts from
+flapping. On each transition into a flagged state one CONGESTION or
+OVERCROWDING alert is written to the alert store, unless an active one
+already exists for that bus, and it is resolved when the flag clears.
+
+Updates written by other workers are picked up by sync(), which runs only
+when the buses collection's version has changed and re-observes just the
+buses whose fields differ from the last seen copy. After feeding its own
+writes a process skips that re-read only if no other write came before
+them.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from services import config, repository
+from services.data_utils import generate_id
+from services.storage import get_engine
+
+TRACKED_FIELDS = ("lat", "lng", "status", "occupancy_percent", "route_id", "last_stop")
+
+def distance_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Approximate ground distance in metres (equirectangular, fine below a few km)"""
+    x = math.radians(lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return 6371000.0 * math.hypot(x, y)
+
+class BusTrack:
+    """Recent positions and alert flags for one bus"""
+
+    __slots__ = ("positions", "bus", "reported", "congested", "overcrowded")
+
+    def __init__(self):
+        self.positions: Deque[Tuple[float, float, float]] = deque(
+            maxlen=math.ceil(config.STUCK_MINUTES * 60 / config.POSITION_SAMPLE_SECONDS) + 2
+        )
+        self.bus: Dict[str, Any] = {}
+        self.reported: Optional[float] = None
+        self.congested = False
+        self.overcrowded = False
+
+    def add_position(self, now: float, lat: float, lng: float):
+        # Samples are kept at least an interval apart; within one the newest replaces the last
+        if len(self.positions) > 1 and now - self.positions[-2][0] < config.POSITION_SAMPLE_SECONDS:
+            self.positions[-1] = (now, lat, lng)
+        else:
+            self.positions.append((now, lat, lng))
+
+    def displacement(self, now: float) -> Tuple[float, bool]:
+        """
+        Largest distance from the latest position over the stuck window, and
+        whether the recorded history covers the whole window
+        """
+        if not self.positions:
+            return 0.0, False
+        window_start = now - config.STUCK_MINUTES * 60
+        _, lat, lng = self.positions[-1]
+        farthest = 0.0
+        for sampled_at, sample_lat, sample_lng in reversed(self.positions):
+            farthest = max(farthest, distance_m(lat, lng, sample_lat, sample_lng))
+            if sampled_at <= window_start:
+                return farthest, True
+        return farthest, False
+
+class CongestionDetector:
+    """Per-bus streaming detector that writes deduplicated alerts"""
+
+    def __init__(self):
+        self._tracks: Dict[str, BusTrack] = {}
+        self._lock = threading.Lock()
+        self._version: Any = object()
+        self._seeded = False
+
+    def observe(self, bus: Dict[str, Any], now: Optional[float] = None, emit: bool = True, located: bool = False):
+        """
+        Feed the current state of one bus (after an update). `located` marks
+        a position report; otherwise only a changed position counts as one.
+        """
+        bus_id = bus.get("id")
+        if bus_id is None:
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            track = self._tracks.get(bus_id)
+            if track is None:
+                track = self._tracks[bus_id] = BusTrack()
+            previous = track.bus
+            track.bus = {field: bus.get(field) for field in TRACKED_FIELDS}
+            if bus.get("lat") is not None and bus.get("lng") is not None:
+                moved = (bus.get("lat"), bus.get("lng")) != (previous.get("lat"), previous.get("lng"))
+                if moved or not track.positions:
+                    track.add_position(now, float(bus["lat"]), float(bus["lng"]))
+                if moved or located:
+                    track.reported = now
+            transitions = self._update_flags(track, now)
+        if emit:
+            for alert_type, active in transitions:
+                self._publish(bus_id, track.bus, alert_type, active)
+
+    def observe_many(self, buses: List[Dict[str, Any]], located: bool = False):
+        """
+        Feed buses this thread just wrote. If the collection was at the last
+        synced version right before that write, no other write came in
+        between and sync() need not re-read them.
+        """
+        write = get_engine().last_write(repository.buses.filename)
+        now = time.monotonic()
+        for bus in buses:
+            self.observe(bus, now, located=located)
+        if write is not None:
+            self._mark_synced(*write)
+
+    def _update_flags(self, track: BusTrack, now: float) -> List[Tuple[str, bool]]:
+        transitions = []
+        status = track.bus.get("status")
+        parked = status in ("IDLE", "BREAKDOWN")
+        farthest, covered = track.displacement(now)
+        # Standing still needs a position report within the window, not just an old one
+        fresh = track.reported is not None and track.reported >= now - config.STUCK_MINUTES * 60
+        stationary = covered and fresh and farthest < config.STUCK_RADIUS_M
+        if not track.congested and not parked and (status == "STUCK" or stationary):
+            track.congested = True
+            transitions.append(("CONGESTION", True))
+        elif track.congested and status != "STUCK" and (parked or farthest > config.STUCK_CLEAR_RADIUS_M):
+            track.congested = False
+            transitions.append(("CONGESTION", False))
+
+        occupancy = track.bus.get("occupancy_percent") or 0
+        if not track.overcrowded and occupancy > config.OVERCROWDED_ENTER:
+            track.overcrowded = True
+            transitions.append(("OVERCROWDING", True))
+        elif track.overcrowded and occupancy < config.OVERCROWDED_EXIT:
+            track.overcrowded = False
+            transitions.append(("OVERCROWDING", False))
+        return transitions
+
+    def _publish(self, bus_id: str, bus: Dict[str, Any], alert_type: str, active: bool):
+        """Raise or resolve the bus's alert; at most one active alert per bus and type"""
+        existing = repository.alerts.find(bus_id=bus_id, type=alert_type, status="ACTIVE")
+        if not active:
+            if existing:
+                repository.alerts.update_many({alert["id"]: {"status": "RESOLVED"} for alert in existing})
+            return
+        if existing:
+            return
+        if alert_type == "CONGESTION":
+            message = f"Bus {bus_id} stuck at {bus.get('last_stop') or 'unknown location'}"
+            priority = "HIGH"
+        else:
+            message = f"Bus {bus_id} at {bus.get('occupancy_percent')}% capacity"
+            priority = "MEDIUM"
+        repository.alerts.insert({
+            "id": generate_id("AUTO"),
+            "timestamp": datetime.now().isoformat(),
+            "sender": "SYSTEM_AI",
+            "type": alert_type,
+            "priority": priority,
+            "message": message,
+            "status": "ACTIVE",
+            "location": [bus.get("lat"), bus.get("lng")],
+            "bus_id": bus_id,
+            "route_id": bus.get("route_id"),
+        })
+
+    def sync(self):
+        """
+        Catch up with writes made outside this process. The first call loads
+        every bus without raising alerts for conditions that already existed.
+        """
+        version = get_engine().version(repository.buses.filename)
+        if version == self._version:
+            return
+        seeding = not self._seeded
+        now = time.monotonic()
+        for bus in repository.buses.all():
+            track = self._tracks.get(bus.get("id"))
+            if track is None or any(track.bus.get(field) != bus.get(field) for field in TRACKED_FIELDS):
+                self.observe(bus, now, emit=not seeding)
+        self._seeded = True
+        self._version = version
+
+    def _mark_synced(self, before: Any, after: Any):
+        with self._lock:
+            if self._seeded and before == self._version:
+                self._version = after
+
+    def active(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Buses currently flagged, by alert type"""
+        self.sync()
+        with self._lock:
+            tracks = list(self._tracks.items())
+        return {
+            "CONGESTION": [{"id": bus_id, **track.bus} for bus_id, track in tracks if track.congested],
+            "OVERCROWDING": [{"id": bus_id, **track.bus} for bus_id, track in tracks if track.overcrowded],
+        }
+
+detector = CongestionDetector()
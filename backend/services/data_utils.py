@@ -1,78 +1,52 @@
 """
-Data utility module for reading/writing JSON data files
+Data utility module for reading/writing collection data
+
+All functions go through the configured storage engine (see services.storage),
+so callers work unchanged on the JSON files or on SQLite.
 """
 
-import json
 import os
 from typing import List, Dict, Any, Optional
-from datetime import datetime
+from services import config
+from services.id_generator import next_id
+from services.storage import get_engine
 
 # Get the data directory path (relative to backend folder)
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "data")
+DATA_DIR = config.DATA_DIR
 
 def get_data_path(filename: str) -> str:
     """Get the full path to a data file"""
     return os.path.join(DATA_DIR, filename)
 
 def read_json(filename: str) -> List[Dict[str, Any]]:
-    """Read data from a JSON file"""
-    filepath = get_data_path(filename)
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
-    except json.JSONDecodeError:
-        return []
+    """Read all items of a collection"""
+    return get_engine().read_all(filename)
 
 def write_json(filename: str, data: List[Dict[str, Any]]) -> bool:
-    """Write data to a JSON file"""
-    filepath = get_data_path(filename)
-    try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        return True
-    except Exception as e:
-        print(f"Error writing to {filename}: {e}")
-        return False
+    """Replace all items of a collection"""
+    return get_engine().write_all(filename, data)
 
 def append_to_json(filename: str, item: Dict[str, Any]) -> bool:
-    """Append a single item to a JSON array file"""
-    data = read_json(filename)
-    data.append(item)
-    return write_json(filename, data)
+    """Append a single item to a collection"""
+    return get_engine().insert(filename, [item])
 
 def update_item_in_json(filename: str, key: str, key_value: str, updates: Dict[str, Any]) -> bool:
-    """Update a specific item in a JSON array by key"""
-    data = read_json(filename)
-    for item in data:
-        if item.get(key) == key_value:
-            item.update(updates)
-            return write_json(filename, data)
-    return False
+    """Update a specific item in a collection by key"""
+    return get_engine().update(filename, key, key_value, updates) is not None
 
 def delete_from_json(filename: str, key: str, key_value: str) -> bool:
-    """Delete an item from a JSON array by key"""
-    data = read_json(filename)
-    filtered = [item for item in data if item.get(key) != key_value]
-    if len(filtered) != len(data):
-        return write_json(filename, filtered)
-    return False
+    """Delete an item from a collection by key"""
+    return get_engine().delete(filename, key, key_value)
 
 def find_by_key(filename: str, key: str, value: str) -> Optional[Dict[str, Any]]:
     """Find a single item by key value"""
-    data = read_json(filename)
-    for item in data:
-        if item.get(key) == value:
-            return item
-    return None
+    results = get_engine().find(filename, {key: value}, limit=1)
+    return results[0] if results else None
 
 def filter_by_key(filename: str, key: str, value: str) -> List[Dict[str, Any]]:
     """Filter items by key value"""
-    data = read_json(filename)
-    return [item for item in data if item.get(key) == value]
+    return get_engine().find(filename, {key: value})
 
 def generate_id(prefix: str = "ID") -> str:
-    """Generate a unique ID with timestamp"""
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-    return f"{prefix}-{timestamp}"
+    """Generate a unique, time-ordered ID (see services.id_generator)"""
+    return f"{prefix}-{next_id()}"
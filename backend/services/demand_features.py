@@ -0,0 +1,283 @@
+"""
+Rolling demand features per route for the AI engine
+
+Ticket events are folded into per-route ring buffers keyed on event time
+(the ticket's timestamp, not arrival time):
+
+    minute ring  - 60 one-minute buckets with running 15 min / 1 h totals
+    hour ring    - one bucket per hour for the last week plus the current hour,
+                   with running per-hour-of-day totals for forecasting
+
+Reading features is O(1) and never rescans ticket history. The store follows
+the tickets collection incrementally (see DemandFeatureStore.sync), so
+tickets issued by any worker are picked up on the next read.
+
+The incremental stores keep their place with a TicketCursor. Tickets a
+request has just inserted are handed to them directly (observe_many); the
+collection is only counted and read from the cursor's offset after another
+worker wrote it.
+"""
+
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from services import repository
+from services.storage import get_engine
+
+MINUTE_SLOTS = 60
+WEEK_HOURS = 7 * 24
+# A full week of past hours plus the current one
+HOUR_SLOTS = WEEK_HOURS + 1
+SHORT_WINDOW_MINUTES = 15
+
+def parse_event_time(value: Any) -> Optional[datetime]:
+    """Naive local datetime of an ISO timestamp, or None if it cannot be parsed"""
+    try:
+        moment = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+def minute_index(moment: datetime) -> int:
+    """Minutes since 0001-01-01; minute_index // 60 % 24 is the hour of day"""
+    return (moment.toordinal() * 24 + moment.hour) * 60 + moment.minute
+
+def shift_features(hour: int) -> Dict[str, int]:
+    """One-hot shift columns used by the model"""
+    is_morning = 1 if 6 <= hour < 12 else 0
+    is_afternoon = 1 if 12 <= hour < 18 else 0
+    return {
+        "shift_afternoon": is_afternoon,
+        "shift_morning": is_morning,
+        "shift_other": 1 if not (is_morning or is_afternoon) else 0,
+    }
+
+class RouteDemand:
+    """Ring buffers of ticket counts for one route"""
+
+    __slots__ = ("minutes", "hours", "profile", "head_minute", "head_hour", "first_hour", "sum_short", "sum_hour")
+
+    def __init__(self, minute: int):
+        self.minutes = [0] * MINUTE_SLOTS
+        self.hours = [0] * HOUR_SLOTS
+        self.profile = [0] * 24
+        self.head_minute = minute
+        self.head_hour = minute // 60
+        self.first_hour = self.head_hour
+        self.sum_short = 0
+        self.sum_hour = 0
+
+    def advance(self, minute: int):
+        """Move the window end forward, expiring buckets that fall out"""
+        if minute > self.head_minute:
+            if minute - self.head_minute >= MINUTE_SLOTS:
+                self.minutes = [0] * MINUTE_SLOTS
+                self.sum_short = self.sum_hour = 0
+            else:
+                for t in range(self.head_minute + 1, minute + 1):
+                    self.sum_short -= self.minutes[(t - SHORT_WINDOW_MINUTES) % MINUTE_SLOTS]
+                    slot = t % MINUTE_SLOTS
+                    self.sum_hour -= self.minutes[slot]
+                    self.minutes[slot] = 0
+            self.head_minute = minute
+
+        hour = minute // 60
+        if hour > self.head_hour:
+            if hour - self.head_hour >= HOUR_SLOTS:
+                self.hours = [0] * HOUR_SLOTS
+                self.profile = [0] * 24
+            else:
+                for h in range(self.head_hour + 1, hour + 1):
+                    slot = h % HOUR_SLOTS
+                    # The recycled slot held hour h - HOUR_SLOTS
+                    self.profile[(h - HOUR_SLOTS) % 24] -= self.hours[slot]
+                    self.hours[slot] = 0
+            self.head_hour = hour
+
+    def add(self, minute: int, count: int = 1) -> bool:
+        """Record tickets at an event minute; returns False if too late to count"""
+        self.advance(minute)
+        hour = minute // 60
+        if hour <= self.head_hour - HOUR_SLOTS:
+            return False
+        self.hours[hour % HOUR_SLOTS] += count
+        self.profile[hour % 24] += count
+        self.first_hour = min(self.first_hour, hour)
+        if minute > self.head_minute - MINUTE_SLOTS:
+            self.minutes[minute % MINUTE_SLOTS] += count
+            self.sum_hour += count
+            if minute > self.head_minute - SHORT_WINDOW_MINUTES:
+                self.sum_short += count
+        return True
+
+    def same_hour_last_week(self) -> int:
+        return self.hours[(self.head_hour - WEEK_HOURS) % HOUR_SLOTS]
+
+    def hourly_mean(self, hour_of_day: int) -> float:
+        """Average tickets in this hour of day over the completed hours of the past week"""
+        total = self.profile[hour_of_day]
+        if self.head_hour % 24 == hour_of_day:
+            # The current hour is still filling up
+            total -= self.hours[self.head_hour % HOUR_SLOTS]
+        low = max(self.first_hour, self.head_hour - WEEK_HOURS)
+        high = self.head_hour - 1
+        covered = (high - hour_of_day) // 24 - (low - 1 - hour_of_day) // 24
+        return total / covered if covered > 0 else 0.0
+
+class TicketCursor:
+    """
+    How far an incremental store has read the hot tickets collection: the
+    number of tickets read, the id of the last one, and the collection
+    version and archive generation they were read at. Callers hold the
+    store's lock.
+    """
+
+    def __init__(self):
+        self.seen = 0
+        self.last_tid: Any = None
+        self.version: Any = object()
+        self.generation: Any = 0
+
+    def reset(self):
+        """Read everything again on the next pending()"""
+        self.seen = 0
+        self.last_tid = None
+        self.generation = None
+
+    def _advance(self, tickets: List[Dict[str, Any]], version: Any, generation: Any) -> List[Dict[str, Any]]:
+        self.seen += len(tickets)
+        if tickets:
+            self.last_tid = tickets[-1].get("tid")
+        self.version = version
+        self.generation = generation
+        return tickets
+
+    def pending(self, rebuild: Optional[Callable[[], None]] = None) -> List[Dict[str, Any]]:
+        """
+        Tickets written (by any worker) since the last read. If tickets were
+        archived or removed, rebuild() is called first and the whole hot
+        collection is returned; without rebuild the cursor moves to just
+        after the last ticket it read, wherever that now is (the start if
+        that ticket was archived too).
+        """
+        from services.ticket_archive import archive
+
+        # The version is read before the data, so a concurrent write is never missed
+        version = get_engine().version(repository.tickets.filename)
+        generation = archive.generation()
+        if version == self.version and generation == self.generation:
+            return []
+        total = repository.tickets.count()
+        if generation != self.generation or total < self.seen:
+            if rebuild is not None:
+                self.seen, self.last_tid = 0, None
+                rebuild()
+            else:
+                hot = repository.tickets.all()
+                self.seen = 0
+                if self.last_tid is not None:
+                    self.seen = next(
+                        (row + 1 for row in range(len(hot) - 1, -1, -1) if hot[row].get("tid") == self.last_tid), 0
+                    )
+                return self._advance(hot[self.seen:], version, generation)
+        tickets = repository.tickets.find(offset=self.seen) if total != self.seen else []
+        return self._advance(tickets, version, generation)
+
+    def adopt(self, tickets: List[Dict[str, Any]]) -> bool:
+        """
+        Move past tickets this thread has just inserted, if the cursor was up
+        to date right before that write; otherwise pending() must catch up
+        """
+        from services.ticket_archive import archive
+
+        write = get_engine().last_write(repository.tickets.filename)
+        if write is None or write[0] != self.version or archive.generation() != self.generation:
+            return False
+        self._advance(tickets, write[1], self.generation)
+        return True
+
+class DemandFeatureStore:
+    """Per-route rolling demand, kept in step with the tickets collection"""
+
+    def __init__(self):
+        self._routes: Dict[str, RouteDemand] = {}
+        self._lock = threading.Lock()
+        self._cursor = TicketCursor()
+        self.watermark: Optional[int] = None
+        self.late_events = 0
+
+    def _ingest(self, tickets: Iterable[Dict[str, Any]]):
+        for ticket in tickets:
+            route_id = ticket.get("route_id")
+            moment = parse_event_time(ticket.get("timestamp"))
+            if not route_id or moment is None:
+                continue
+            minute = minute_index(moment)
+            route = self._routes.get(route_id)
+            if route is None:
+                route = self._routes[route_id] = RouteDemand(minute)
+            if not route.add(minute):
+                self.late_events += 1
+            if self.watermark is None or minute > self.watermark:
+                self.watermark = minute
+
+    def _rebuild(self):
+        from services.ticket_archive import archive
+
+        self._routes.clear()
+        self.watermark = None
+        self._ingest(archive.tickets(start=date.today() - timedelta(hours=HOUR_SLOTS)))
+
+    def sync(self) -> int:
+        """
+        Fold in tickets appended since the last sync (by any worker); returns
+        how many were read. Tickets are append-only, so only the new tail is
+        fetched. If the collection shrank or tickets were archived the store
+        is rebuilt, replaying the archived past week first.
+        """
+        with self._lock:
+            tickets = self._cursor.pending(self._rebuild)
+            self._ingest(tickets)
+            return len(tickets)
+
+    def observe_many(self, tickets: List[Dict[str, Any]]):
+        """Fold in tickets this thread has just inserted, catching up first if another worker wrote"""
+        with self._lock:
+            if self._cursor.adopt(tickets):
+                self._ingest(tickets)
+                return
+        self.sync()
+
+    def _route_at(self, route_id: str, as_of: Optional[datetime]) -> Optional[RouteDemand]:
+        route = self._routes.get(route_id)
+        if route is not None:
+            route.advance(minute_index(as_of or datetime.now()))
+        return route
+
+    def features(self, route_id: str, as_of: Optional[datetime] = None) -> Dict[str, float]:
+        """Rolling demand features for a route at a point in time (default now)"""
+        as_of = as_of or datetime.now()
+        with self._lock:
+            route = self._route_at(route_id, as_of)
+            if route is None:
+                return {"demand_15m": 0, "demand_1h": 0, "demand_same_hour_last_week": 0, "forecast_next_hour": 0.0}
+            next_hour = (route.head_hour + 1) % 24
+            return {
+                "demand_15m": route.sum_short,
+                "demand_1h": route.sum_hour,
+                "demand_same_hour_last_week": route.same_hour_last_week(),
+                "forecast_next_hour": round(route.hourly_mean(next_hour), 2),
+            }
+
+    def hourly_forecast(self, route_id: str, as_of: Optional[datetime] = None) -> List[float]:
+        """Expected tickets for each hour of the day, from the past week"""
+        with self._lock:
+            route = self._route_at(route_id, as_of)
+            if route is None:
+                return [0.0] * 24
+            return [round(route.hourly_mean(hour), 2) for hour in range(24)]
+
+demand_store = DemandFeatureStore()
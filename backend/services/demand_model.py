@@ -0,0 +1,122 @@
+"""
+Demand model loading for the AI engine
+
+The current model is the version named in backend/models/manifest.json
+(written by services.model_training). When no trained version exists the
+original backup_predictor_rf.joblib is used. The loaded model is cached per
+process and reloaded only when the manifest changes, so a newly exported
+version is picked up without a restart.
+
+A compiled .npz next to the model (see services.compiled_forest) is
+preferred: it is memory-mapped and evaluated with NumPy alone, so workers
+never import sklearn, pandas or joblib.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from services import config
+from services.metrics import MODEL_LOAD_SECONDS, MODEL_PREDICT_SECONDS
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "models")
+MANIFEST_PATH = os.path.join(MODELS_DIR, "manifest.json")
+
+LEGACY_MODEL = "backup_predictor_rf.joblib"
+LEGACY_COLUMNS = "feature_columns.joblib"
+LEGACY_COMPILED = "backup_predictor_rf.npz"
+
+class LoadedModel:
+    """A model with the feature columns it was trained on"""
+
+    def __init__(self, model: Any, feature_columns: List[str], version: str, compiled: bool = False):
+        self.model = model
+        self.feature_columns = list(feature_columns)
+        self.version = version
+        self.compiled = compiled
+
+    def predict(self, rows: List[Dict[str, Any]]) -> List[float]:
+        """Predict a batch of feature rows (missing features are 0)"""
+        started = time.perf_counter()
+        matrix = [[row.get(col, 0) for col in self.feature_columns] for row in rows]
+        if self.compiled:
+            predictions = [float(value) for value in self.model.predict(matrix)]
+        else:
+            import pandas as pd
+
+            frame = pd.DataFrame(matrix, columns=self.feature_columns)
+            predictions = [float(value) for value in self.model.predict(frame)]
+        MODEL_PREDICT_SECONDS.labels(self.format).observe(time.perf_counter() - started)
+        return predictions
+
+    @property
+    def format(self) -> str:
+        return "compiled" if self.compiled else "sklearn"
+
+def read_manifest() -> Dict[str, Any]:
+    """Model manifest ({"current": version, "versions": {...}}), empty if absent"""
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def _load_compiled(filename: Optional[str], version: str) -> Optional[LoadedModel]:
+    """Memory-mapped compiled forest, if enabled and present"""
+    path = os.path.join(MODELS_DIR, filename) if filename else None
+    if not config.USE_COMPILED_MODEL or path is None or not os.path.exists(path):
+        return None
+    from services.compiled_forest import CompiledForest
+
+    forest = CompiledForest.load(path)
+    if forest.feature_columns is None:
+        return None
+    return LoadedModel(forest, forest.feature_columns, version, compiled=True)
+
+def _load(manifest: Dict[str, Any]) -> LoadedModel:
+    current = manifest.get("current")
+    entry = manifest.get("versions", {}).get(current) if current else None
+    if entry:
+        version, model_file, columns_file = current, entry["model_file"], entry["columns_file"]
+        compiled_file = entry.get("compiled_file")
+    else:
+        version, model_file, columns_file, compiled_file = "legacy", LEGACY_MODEL, LEGACY_COLUMNS, LEGACY_COMPILED
+
+    loaded = _load_compiled(compiled_file, version)
+    if loaded is not None:
+        return loaded
+    import joblib
+
+    model = joblib.load(os.path.join(MODELS_DIR, model_file))
+    columns = joblib.load(os.path.join(MODELS_DIR, columns_file))
+    return LoadedModel(model, columns, version)
+
+_lock = threading.Lock()
+_cached: Optional[LoadedModel] = None
+_cached_stamp: Any = object()
+
+def _manifest_stamp() -> Any:
+    try:
+        stat = os.stat(MANIFEST_PATH)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+def load_model() -> Optional[LoadedModel]:
+    """Current model, or None if it cannot be loaded"""
+    global _cached, _cached_stamp
+    stamp = _manifest_stamp()
+    if stamp != _cached_stamp:
+        with _lock:
+            if stamp != _cached_stamp:
+                started = time.perf_counter()
+                try:
+                    _cached = _load(read_manifest())
+                    MODEL_LOAD_SECONDS.labels(_cached.format).observe(time.perf_counter() - started)
+                except Exception as e:
+                    print(f"ML Model loading failed: {e}")
+                    _cached = None
+                _cached_stamp = stamp
+    return _cached
@@ -0,0 +1,84 @@
+"""
+Streaming CSV / NDJSON exports
+
+An export is a generator over chunks of items (from Repository.scan and
+the ticket archive) that encodes each chunk as it goes, so memory stays
+bounded by one chunk however large the export is. StreamingResponse sends
+the output with chunked transfer encoding and pulls the generator in a
+worker thread, so a long export never blocks the event loop.
+
+    format=csv      header row plus one row per item (listed columns only)
+    format=ndjson   one JSON object per line (every field)
+    gzip=true       the stream is gzip-compressed on the fly and sent with
+                    Content-Encoding: gzip
+"""
+
+import csv
+import io
+import zlib
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from services import config
+from services.fast_json import dumps
+from services.ticket_archive import hot_range
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, (list, dict)):
+        return dumps(value).decode("utf-8")
+    return value
+
+def encode_csv(chunks: Iterable[List[Dict[str, Any]]], columns: Sequence[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in chunks:
+        for item in chunk:
+            writer.writerow([_csv_value(item.get(column)) for column in columns])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    tail = buffer.getvalue()
+    if tail:
+        yield tail.encode("utf-8")
+
+def encode_ndjson(chunks: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    for chunk in chunks:
+        if chunk:
+            yield b"\n".join(dumps(item) for item in chunk) + b"\n"
+
+def gzip_stream(parts: Iterable[bytes], level: int) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for part in parts:
+        compressed = compressor.compress(part)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def date_range(start: Optional[date], end: Optional[date]) -> Dict[str, str]:
+    """Timestamp lookups for items between two dates (inclusive), after validating them"""
+    if start is not None and end is not None and start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return hot_range(start, end)
+
+def export_response(name: str, chunks: Iterable[List[Dict[str, Any]]], columns: Sequence[str],
+                    fmt: str = "csv", compress: bool = False) -> StreamingResponse:
+    """Stream chunks of items as a CSV or NDJSON download"""
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    body = encode_csv(chunks, columns) if fmt == "csv" else encode_ndjson(chunks)
+    filename = f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if compress:
+        body = gzip_stream(body, config.EXPORT_GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return StreamingResponse(body, media_type=FORMATS[fmt], headers=headers)
@@ -0,0 +1,125 @@
+"""
+Precomputed fare tables per route
+
+For every route in the catalogue a FareTable holds the stop-name -> index
+map, the cumulative distance of each stop along the route (haversine over
+the route's `coordinates`) and the fare between every pair of stops, so a
+quote is two dict lookups and a list index.
+
+Fares follow distance stages: a trip of d km covers ceil(d / FARE_STAGE_KM)
+stages (at least one) and costs FARE_MINIMUM plus FARE_PER_STAGE for every
+stage after the first. A route whose coordinates do not line up with its
+stops counts one stage per stop instead.
+
+Tables are rebuilt when the routes collection changes, and only for routes
+whose stops or coordinates differ from the last build.
+"""
+
+import math
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from services import config, repository
+from services.storage import get_engine
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in kilometres"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+def stage_fare(stages: int) -> int:
+    return config.FARE_MINIMUM + config.FARE_PER_STAGE * (max(1, stages) - 1)
+
+def _signature(stops: List[str], coordinates: List[List[float]]) -> Tuple[Any, ...]:
+    return tuple(stops), tuple(tuple(point) for point in coordinates)
+
+class FareTable:
+    """Stop index, cumulative distances and the fare matrix of one route"""
+
+    __slots__ = ("route_id", "signature", "stops", "index", "distances", "stages", "fares")
+
+    def __init__(self, route_id: str, stops: List[str], coordinates: List[List[float]]):
+        self.route_id = route_id
+        self.signature = _signature(stops, coordinates)
+        self.stops = list(stops)
+        self.index: Dict[str, int] = {}
+        for position, stop in enumerate(self.stops):
+            self.index.setdefault(stop.strip().lower(), position)
+
+        self.distances: Optional[List[float]] = None
+        if len(coordinates) == len(stops) and all(len(point) >= 2 for point in coordinates):
+            self.distances = [0.0]
+            for start, end in zip(coordinates, coordinates[1:]):
+                self.distances.append(self.distances[-1] + haversine_km(start[0], start[1], end[0], end[1]))
+
+        n = len(self.stops)
+        self.stages = [[self._stages(i, j) for j in range(n)] for i in range(n)]
+        self.fares = [[stage_fare(stages) for stages in row] for row in self.stages]
+
+    def _stages(self, i: int, j: int) -> int:
+        if i == j:
+            return 0
+        if self.distances is None:
+            return abs(j - i)
+        return max(1, math.ceil(abs(self.distances[j] - self.distances[i]) / config.FARE_STAGE_KM))
+
+    def locate(self, stop: str) -> Optional[int]:
+        return self.index.get(str(stop or "").strip().lower())
+
+    def quote(self, from_stop: str, to_stop: str) -> Optional[Dict[str, Any]]:
+        """Fare between two stops of the route, or None if either is not on it"""
+        i, j = self.locate(from_stop), self.locate(to_stop)
+        if i is None or j is None or i == j:
+            return None
+        return {
+            "route_id": self.route_id,
+            "from": self.stops[i],
+            "to": self.stops[j],
+            "stops_travelled": abs(j - i),
+            "distance_km": round(abs(self.distances[j] - self.distances[i]), 2) if self.distances is not None else None,
+            "stages": self.stages[i][j],
+            "fare": self.fares[i][j],
+        }
+
+class FareTables:
+    """Fare tables for the whole route catalogue, kept in step with the routes collection"""
+
+    def __init__(self):
+        self._tables: Dict[str, FareTable] = {}
+        self._lock = threading.Lock()
+        self._version: Any = object()
+        self.rebuilt = 0
+
+    def refresh(self) -> int:
+        """Rebuild tables of routes added or changed since the last refresh; returns how many"""
+        version = get_engine().version(repository.routes.filename)
+        if version == self._version:
+            return 0
+        with self._lock:
+            if version == self._version:
+                return 0
+            tables: Dict[str, FareTable] = {}
+            rebuilt = 0
+            for route in repository.routes.all():
+                stops, coordinates = route.get("stops") or [], route.get("coordinates") or []
+                table = self._tables.get(route["id"])
+                if table is None or table.signature != _signature(stops, coordinates):
+                    table = FareTable(route["id"], stops, coordinates)
+                    rebuilt += 1
+                tables[route["id"]] = table
+            self._tables = tables
+            self._version = version
+            self.rebuilt += rebuilt
+            return rebuilt
+
+    def get(self, route_id: str) -> Optional[FareTable]:
+        self.refresh()
+        return self._tables.get(route_id)
+
+    def quote(self, route_id: str, from_stop: str, to_stop: str) -> Optional[Dict[str, Any]]:
+        """Fare between two stops of a route, or None if the route or a stop is unknown"""
+        table = self.get(route_id)
+        return table.quote(from_stop, to_stop) if table is not None else None
+
+fare_tables = FareTables()
@@ -0,0 +1,32 @@
+"""
+Fast JSON responses
+
+FastJSONResponse renders with orjson when it is installed (several times
+faster than the stdlib encoder and produces compact UTF-8 bytes directly) and
+falls back to the standard JSONResponse encoding otherwise. It is the
+application's default response class.
+"""
+
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY if orjson else 0
+
+def dumps(content: Any) -> bytes:
+    """Encode already JSON-compatible content to compact UTF-8 bytes"""
+    if orjson is not None:
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when available"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,285 @@
+"""
+Struct-of-arrays view of the fleet
+
+FleetTable holds the buses collection column-wise: lat and lng as float64,
+speed (km/h, parsed once from strings such as "22km/h") and occupancy as
+float32, NaN where a bus has no value, and status and route as small
+integer codes into per-table label lists, plus a bus id -> row index.
+Fleet statistics, per-route aggregates and filters are single vectorised
+passes over the arrays; dicts are built only for the rows an endpoint
+returns.
+
+The table is a SharedView over buses.json: it is rebuilt with one read of
+the collection when another worker writes it, and reused until then. Bus
+writes this process makes are applied to their rows in place (see
+FleetView.apply). The collection stays the source of truth, in its original
+format.
+"""
+
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from services.shared_state import SharedView
+from services.storage import get_engine
+from services.track_store import parse_speed
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# NumPy is imported when the first table is built, so importing the app stays light
+
+FIELDS = ("id", "route_id", "status", "lat", "lng", "occupancy_percent", "last_stop", "speed")
+_FIELD_SET = frozenset(FIELDS)
+
+# Known statuses get fixed codes; others are added per table. Code 0 is "no status".
+STATUSES = (None, "MOVING", "IDLE", "STUCK", "BREAKDOWN")
+
+def _encode(values: Iterable[Any], labels: Sequence[Any], dtype) -> Tuple["np.ndarray", List[Any]]:
+    """Integer codes of values into a label list, extended with unseen values in order"""
+    import numpy as np
+
+    labels = list(labels)
+    index = {label: code for code, label in enumerate(labels)}
+    codes = []
+    for value in values:
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(labels)
+            labels.append(value)
+        codes.append(code)
+    if len(labels) > np.iinfo(dtype).max:
+        dtype = np.int32
+    return np.array(codes, dtype=dtype), labels
+
+def _number(value: float) -> Any:
+    """A float column value as JSON would have stored it (ints stay ints, NaN is None)"""
+    if value != value:
+        return None
+    return int(value) if float(value).is_integer() else float(value)
+
+def format_speed(speed: float) -> Optional[str]:
+    return None if speed != speed else f"{float(speed):g}km/h"
+
+class FleetTable:
+    """Column arrays of every bus, in collection order"""
+
+    def __init__(self, buses: List[Dict[str, Any]]):
+        import numpy as np
+
+        self.ids: List[str] = [bus.get("id") for bus in buses]
+        self.index: Dict[str, int] = {bus_id: row for row, bus_id in enumerate(self.ids) if bus_id is not None}
+        self.status, self.statuses = _encode((bus.get("status") for bus in buses), STATUSES, np.uint8)
+        self.route, self.routes = _encode((bus.get("route_id") for bus in buses), (None,), np.uint16)
+        self.last_stop: List[Optional[str]] = [bus.get("last_stop") for bus in buses]
+        # Sparse: stored values the columns cannot reproduce (e.g. a speed of
+        # "N/A"), fields outside FIELDS and FIELDS a bus does not have at all
+        self.raw: Dict[int, Dict[str, Any]] = {}
+        self.extra: Dict[int, Dict[str, Any]] = {}
+        self.absent: Dict[int, Tuple[str, ...]] = {}
+        self.lat = self._column(buses, "lat", np.float64)
+        self.lng = self._column(buses, "lng", np.float64)
+        self.occupancy = self._column(buses, "occupancy_percent", np.float32)
+        self.speed = self._speeds(buses)
+        for row, bus in enumerate(buses):
+            self._shape(row, bus)
+
+    def _shape(self, row: int, bus: Dict[str, Any]):
+        """Record the fields of a row outside FIELDS and the FIELDS it lacks"""
+        self.extra.pop(row, None)
+        self.absent.pop(row, None)
+        if bus.keys() != _FIELD_SET:
+            extra = {key: value for key, value in bus.items() if key not in _FIELD_SET}
+            if extra:
+                self.extra[row] = extra
+            absent = tuple(field for field in FIELDS if field not in bus)
+            if absent:
+                self.absent[row] = absent
+
+    def _column(self, buses: List[Dict[str, Any]], field: str, dtype) -> "np.ndarray":
+        """A numeric field as an array, NaN where missing"""
+        import numpy as np
+
+        values = [bus.get(field) for bus in buses]
+        for row, value in enumerate(values):
+            if value is not None and type(value) not in (int, float):
+                self.raw.setdefault(row, {})[field] = value
+                values[row] = None
+        exact = np.array(values, dtype=np.float64)
+        column = exact.astype(dtype)
+        # Numbers a narrower dtype would round are kept as stored
+        for row in np.flatnonzero((column != exact) & ~np.isnan(exact)).tolist():
+            self.raw.setdefault(row, {})[field] = values[row]
+        return column
+
+    def _speeds(self, buses: List[Dict[str, Any]]) -> "np.ndarray":
+        """Speeds in km/h, each distinct stored value parsed once"""
+        import numpy as np
+
+        values = [bus.get("speed") for bus in buses]
+        parsed = {value: parse_speed(value) for value in set(values) if value is not None}
+        lossless = {value: format_speed(np.float32(speed)) == value for value, speed in parsed.items()}
+        for row, value in enumerate(values):
+            if value is not None and not lossless[value]:
+                self.raw.setdefault(row, {})["speed"] = value
+        return np.array([np.nan if value is None else parsed[value] for value in values], dtype=np.float32)
+
+    def _set_number(self, column: "np.ndarray", row: int, field: str, value: Any):
+        if value is not None and type(value) not in (int, float):
+            self.raw.setdefault(row, {})[field] = value
+            value = None
+        column[row] = float("nan") if value is None else value
+        if value is not None and column[row] != float(value):
+            self.raw.setdefault(row, {})[field] = value
+
+    def _label(self, labels: List[Any], codes: "np.ndarray", value: Any) -> Optional[int]:
+        """Code of a label, added to the list if new; None if the code column is full"""
+        import numpy as np
+
+        if value in labels:
+            return labels.index(value)
+        if len(labels) + 1 > np.iinfo(codes.dtype).max:
+            return None
+        labels.append(value)
+        return len(labels) - 1
+
+    def patch(self, changes_by_id: Dict[str, Dict[str, Any]]) -> bool:
+        """
+        Apply per-bus field changes in place. False if a bus is not in the
+        table, is renamed or a new label does not fit its code column; the
+        table must then be rebuilt.
+        """
+        import numpy as np
+
+        for bus_id, changes in changes_by_id.items():
+            row = self.index.get(bus_id)
+            if row is None or changes.get("id", bus_id) != bus_id:
+                return False
+            bus = {**self.bus(row), **changes}
+            status = self._label(self.statuses, self.status, bus.get("status"))
+            route = self._label(self.routes, self.route, bus.get("route_id"))
+            if status is None or route is None:
+                return False
+            self.status[row] = status
+            self.route[row] = route
+            self.last_stop[row] = bus.get("last_stop")
+            self.raw.pop(row, None)
+            self._set_number(self.lat, row, "lat", bus.get("lat"))
+            self._set_number(self.lng, row, "lng", bus.get("lng"))
+            self._set_number(self.occupancy, row, "occupancy_percent", bus.get("occupancy_percent"))
+            speed = bus.get("speed")
+            self.speed[row] = np.nan if speed is None else parse_speed(speed)
+            if speed is not None and format_speed(self.speed[row]) != speed:
+                self.raw.setdefault(row, {})["speed"] = speed
+            self._shape(row, bus)
+        return True
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def status_code(self, status: str) -> int:
+        """Code of a status (-1 if no bus has it)"""
+        return self.statuses.index(status) if status in self.statuses else -1
+
+    def route_code(self, route_id: str) -> int:
+        return self.routes.index(route_id) if route_id in self.routes else -1
+
+    def bus(self, row: int) -> Dict[str, Any]:
+        """Dict view of one row, as stored in the collection"""
+        view = {
+            "id": self.ids[row],
+            "route_id": self.routes[self.route[row]],
+            "status": self.statuses[self.status[row]],
+            "lat": _number(self.lat[row]),
+            "lng": _number(self.lng[row]),
+            "occupancy_percent": _number(self.occupancy[row]),
+            "last_stop": self.last_stop[row],
+            "speed": format_speed(self.speed[row]),
+        }
+        view.update(self.raw.get(row, {}))
+        for field in self.absent.get(row, ()):
+            del view[field]
+        view.update(self.extra.get(row, {}))
+        return view
+
+    def get(self, bus_id: str) -> Optional[Dict[str, Any]]:
+        row = self.index.get(bus_id)
+        return None if row is None else self.bus(row)
+
+    def mask(self, status: Optional[str] = None, route_id: Optional[str] = None,
+             min_occupancy: Optional[float] = None, max_occupancy: Optional[float] = None) -> "np.ndarray":
+        """Rows matching every given filter"""
+        import numpy as np
+
+        selected = np.ones(len(self), dtype=bool)
+        if status is not None:
+            selected &= self.status == self.status_code(status)
+        if route_id is not None:
+            selected &= self.route == self.route_code(route_id)
+        if min_occupancy is not None:
+            selected &= self.occupancy >= min_occupancy
+        if max_occupancy is not None:
+            selected &= self.occupancy <= max_occupancy
+        return selected
+
+    def find(self, **filters: Any) -> List[Dict[str, Any]]:
+        """Dict views of the matching buses, in collection order"""
+        import numpy as np
+
+        return [self.bus(row) for row in np.flatnonzero(self.mask(**filters)).tolist()]
+
+    def stats(self) -> Dict[str, Any]:
+        """Fleet statistics for the dashboard"""
+        import numpy as np
+
+        total = len(self)
+        counts = np.bincount(self.status, minlength=len(self.statuses))
+
+        def count(status: str) -> int:
+            code = self.status_code(status)
+            return int(counts[code]) if code >= 0 else 0
+
+        # Buses without an occupancy count as empty in the average
+        occupancy_total = float(np.nansum(self.occupancy, dtype=np.float64))
+        return {
+            "total_active_buses": count("MOVING"),
+            "total_buses": total,
+            "idle_buses": count("IDLE"),
+            "stuck_buses": count("STUCK"),
+            "average_occupancy": round(occupancy_total / total if total > 0 else 0, 1),
+            "high_occupancy_count": int(np.count_nonzero(self.occupancy > 80)),
+        }
+
+    def supply(self) -> Tuple[Dict[str, int], Dict[str, Any], int]:
+        """Buses and total occupancy per route (in first-seen order), and the fleet size"""
+        import numpy as np
+
+        buses = np.bincount(self.route, minlength=len(self.routes))
+        occupancy = np.bincount(self.route, weights=np.nan_to_num(self.occupancy).astype(np.float64),
+                                minlength=len(self.routes))
+        route_bus_count = {}
+        route_occupancy_total = {}
+        for code, route_id in enumerate(self.routes):
+            if route_id is None or not buses[code]:
+                continue
+            route_occupancy_total[route_id] = _number(occupancy[code])
+            if route_id:
+                route_bus_count[route_id] = int(buses[code])
+        return route_bus_count, route_occupancy_total, len(self)
+
+class FleetView(SharedView):
+    """The shared fleet table, kept current with this process's own bus writes without a rebuild"""
+
+    def apply(self, changes_by_id: Dict[str, Dict[str, Any]]):
+        """
+        Apply bus changes this thread has just written, if the table was
+        current right before that write; otherwise the next get() rebuilds it
+        """
+        write = get_engine().last_write(self.filename)
+        with self._lock:
+            if write is None or write[0] != self._version:
+                return
+            if self._value.patch(changes_by_id):
+                self._version = write[1]
+            else:
+                self.invalidate()
+
+fleet_table = FleetView("buses.json", FleetTable)
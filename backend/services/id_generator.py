@@ -0,0 +1,154 @@
+"""
+Snowflake-style ID generator
+
+IDs are 64-bit integers laid out as
+    41 bits  milliseconds since EPOCH_MS
+    10 bits  worker id (one per process)
+    12 bits  per-millisecond sequence
+and rendered as fixed-width Crockford base32, so string order equals
+generation order and stores can use IDs directly as sort keys.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from services import config
+
+# 2024-01-01T00:00:00Z, gives ~69 years of 41-bit milliseconds
+EPOCH_MS = 1704067200000
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+ENCODED_LENGTH = 13  # ceil(64 / 5)
+CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+WORKER_SLOT_DIR = os.path.join(tempfile.gettempdir(), "routesaathi-workers")
+
+# Open handle holding this process's slot lock
+_slot_handle = None
+
+def encode_base32(value: int) -> str:
+    """Encode a non-negative integer as fixed-width Crockford base32"""
+    chars = []
+    for _ in range(ENCODED_LENGTH):
+        chars.append(CROCKFORD_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+def decode_base32(text: str) -> int:
+    """Decode a Crockford base32 string back to its integer value"""
+    value = 0
+    for char in text.upper():
+        value = (value << 5) | CROCKFORD_ALPHABET.index(char)
+    return value
+
+def _claim_worker_slot() -> Optional[int]:
+    """
+    Claim a free worker slot on this host by holding an exclusive lock on a
+    slot file. The lock is released by the OS when the process exits, so
+    crashed workers never leak slots.
+    """
+    global _slot_handle
+    try:
+        import fcntl
+    except ImportError:
+        return None
+
+    try:
+        os.makedirs(WORKER_SLOT_DIR, exist_ok=True)
+    except OSError:
+        return None
+
+    start = os.getpid() & MAX_WORKER_ID
+    for offset in range(MAX_WORKER_ID + 1):
+        slot = (start + offset) & MAX_WORKER_ID
+        path = os.path.join(WORKER_SLOT_DIR, f"{slot}.lock")
+        try:
+            handle = open(path, "a")
+        except OSError:
+            return None
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        # Keep the handle open for the lifetime of the process
+        _slot_handle = handle
+        return slot
+    return None
+
+def resolve_worker_id() -> int:
+    """Pick the worker id for this process"""
+    if 0 <= config.WORKER_ID <= MAX_WORKER_ID:
+        return config.WORKER_ID
+    slot = _claim_worker_slot()
+    if slot is not None:
+        return slot
+    return os.getpid() & MAX_WORKER_ID
+
+class SnowflakeGenerator:
+    """Thread-safe, monotonic 64-bit ID generator for one worker"""
+
+    def __init__(self, worker_id: int):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id must be between 0 and {MAX_WORKER_ID}")
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_int(self) -> int:
+        """Return the next ID as an integer"""
+        with self._lock:
+            now_ms = int(time.time() * 1000) - EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                # Same millisecond, or the wall clock stepped backwards: keep
+                # counting on the last timestamp and borrow the next
+                # millisecond once the sequence is exhausted.
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    self._last_ms += 1
+                    self._sequence = 0
+            return (self._last_ms << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+    def next_id(self) -> str:
+        """Return the next ID as a sortable base32 string"""
+        return encode_base32(self.next_int())
+
+_generator: Optional[SnowflakeGenerator] = None
+_generator_lock = threading.Lock()
+
+def get_generator() -> SnowflakeGenerator:
+    """Get the process-wide generator, creating it on first use"""
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = SnowflakeGenerator(resolve_worker_id())
+    return _generator
+
+def _reset_after_fork():
+    """Forked children must not reuse the parent's worker id"""
+    global _generator
+    _generator = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def next_id() -> str:
+    """Generate the next sortable ID string"""
+    return get_generator().next_id()
+
+def id_timestamp_ms(id_value: str) -> int:
+    """Extract the Unix timestamp (ms) embedded in a generated ID"""
+    raw = decode_base32(id_value.rsplit("-", 1)[-1])
+    return (raw >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
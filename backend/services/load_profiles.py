@@ -0,0 +1,241 @@
+"""
+Passenger load per route segment, from ticket origin and destination stops
+
+A ticket boards at its `from` stop and alights at its `to` stop. Mapped to
+indices in the route's ordered stops, it is recorded in a difference array:
++1 at the boarding index and -1 at the alighting index. The
+running sum of the array is the number of passengers on each segment
+(stop i to stop i+1), so recording a ticket is O(1) and reading a whole
+profile is O(stops).
+
+    route profiles - per route, one array per hour of day plus an all-day
+                     total over the whole ticket history (peak segments)
+    bus loads      - per bus, one array per LOAD_BUCKET_MINUTES bucket over
+                     the last LOAD_WINDOW_MINUTES; passengers whose ticket is
+                     older than the window are taken to have alighted
+
+Segments are undirected: a ticket from a later stop to an earlier one
+covers the same segments as the reverse trip. Like the demand feature
+store, the store follows the tickets collection incrementally, and it is
+rebuilt when the routes collection changes (stop indices may have moved).
+"""
+
+import math
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from services import config, repository
+from services.demand_features import TicketCursor, minute_index, parse_event_time
+from services.storage import get_engine
+from services.ticket_archive import archive
+
+def segment_loads(diff: List[int]) -> List[int]:
+    """Passengers on each segment from a difference array over the stops"""
+    loads = []
+    running = 0
+    for value in diff[:-1]:
+        running += value
+        loads.append(running)
+    return loads
+
+class RouteLoad:
+    """Difference arrays of one route by hour of day"""
+
+    __slots__ = ("hours", "total")
+
+    def __init__(self, stops: int):
+        self.hours = [[0] * stops for _ in range(24)]
+        self.total = [0] * stops
+
+    def add(self, hour: int, board: int, alight: int, count: int):
+        for diff in (self.hours[hour], self.total):
+            diff[board] += count
+            diff[alight] -= count
+
+class BusLoad:
+    """Difference arrays of recent tickets on one bus, by time bucket"""
+
+    __slots__ = ("route_id", "stops", "buckets")
+
+    def __init__(self, route_id: str, stops: int):
+        self.route_id = route_id
+        self.stops = stops
+        self.buckets: Dict[int, List[int]] = {}
+
+    def add(self, bucket: int, board: int, alight: int, count: int):
+        diff = self.buckets.get(bucket)
+        if diff is None:
+            diff = self.buckets[bucket] = [0] * self.stops
+        diff[board] += count
+        diff[alight] -= count
+
+    def window(self, bucket: int, size: int) -> Optional[List[int]]:
+        """Combined array of the last `size` buckets up to `bucket`; older ones are dropped"""
+        for expired in [b for b in self.buckets if b <= bucket - size]:
+            del self.buckets[expired]
+        recent = [diff for b, diff in self.buckets.items() if b <= bucket]
+        if not recent:
+            return None
+        return [sum(column) for column in zip(*recent)]
+
+def _bucket(moment: datetime) -> int:
+    return minute_index(moment) // max(1, config.LOAD_BUCKET_MINUTES)
+
+def _window() -> int:
+    """Buckets in the load window"""
+    return max(1, math.ceil(config.LOAD_WINDOW_MINUTES / max(1, config.LOAD_BUCKET_MINUTES)))
+
+class LoadProfileStore:
+    """Per-route and per-bus segment loads, kept in step with the tickets collection"""
+
+    def __init__(self):
+        self._stops: Dict[str, List[str]] = {}
+        self._index: Dict[str, Dict[str, int]] = {}
+        self._routes: Dict[str, RouteLoad] = {}
+        self._buses: Dict[str, BusLoad] = {}
+        self._lock = threading.Lock()
+        self._cursor = TicketCursor()
+        self._routes_version: Any = object()
+        self.unmapped = 0
+
+    def _refresh_routes(self):
+        version = get_engine().version(repository.routes.filename)
+        if version == self._routes_version:
+            return
+        self._stops = {route["id"]: list(route.get("stops") or []) for route in repository.routes.all()}
+        self._index = {}
+        for route_id, stops in self._stops.items():
+            index: Dict[str, int] = {}
+            for position, stop in enumerate(stops):
+                index.setdefault(stop.strip().lower(), position)
+            self._index[route_id] = index
+        # Stop indices may have moved: force a full rebuild on the next sync
+        self._routes.clear()
+        self._buses.clear()
+        self.unmapped = 0
+        self._cursor.reset()
+        self._routes_version = version
+
+    def _locate(self, route_id: Any, from_stop: Any, to_stop: Any) -> Optional[Tuple[int, int]]:
+        index = self._index.get(route_id)
+        if not index or not from_stop or not to_stop:
+            return None
+        board = index.get(str(from_stop).strip().lower())
+        alight = index.get(str(to_stop).strip().lower())
+        if board is None or alight is None or board == alight:
+            return None
+        return min(board, alight), max(board, alight)
+
+    def _ingest(self, tickets: Iterable[Dict[str, Any]]):
+        # Older tickets only shape the route profiles; their passengers have alighted
+        recent = _bucket(datetime.now()) - _window()
+        for ticket in tickets:
+            route_id = ticket.get("route_id")
+            stops = self._locate(route_id, ticket.get("from"), ticket.get("to"))
+            moment = parse_event_time(ticket.get("timestamp"))
+            if stops is None or moment is None:
+                self.unmapped += 1
+                continue
+            board, alight = stops
+            size = len(self._stops[route_id])
+            route = self._routes.get(route_id)
+            if route is None:
+                route = self._routes[route_id] = RouteLoad(size)
+            route.add(moment.hour, board, alight, 1)
+
+            bus_id = ticket.get("bus_id")
+            bucket = _bucket(moment)
+            if bus_id and bucket > recent:
+                bus = self._buses.get(bus_id)
+                if bus is None or bus.route_id != route_id:
+                    # A bus moved to another route starts a fresh load
+                    bus = self._buses[bus_id] = BusLoad(route_id, size)
+                bus.add(bucket, board, alight, 1)
+
+    def _rebuild(self):
+        self._routes.clear()
+        self._buses.clear()
+        self.unmapped = 0
+        self._ingest(archive.tickets())
+
+    def sync(self) -> int:
+        """
+        Fold in tickets appended since the last sync (by any worker); returns
+        how many were read. Rebuilt from scratch, archived tickets first, if
+        the tickets collection shrank, tickets were archived or the routes
+        changed.
+        """
+        with self._lock:
+            self._refresh_routes()
+            tickets = self._cursor.pending(self._rebuild)
+            self._ingest(tickets)
+            return len(tickets)
+
+    def observe_many(self, tickets: List[Dict[str, Any]]):
+        """Fold in tickets this thread has just inserted, catching up first if another worker wrote"""
+        with self._lock:
+            self._refresh_routes()
+            if self._cursor.adopt(tickets):
+                self._ingest(tickets)
+                return
+        self.sync()
+
+    def maps(self, route_id: str, from_stop: str, to_stop: str) -> bool:
+        """Whether a ticket between these stops can be placed on the route"""
+        with self._lock:
+            self._refresh_routes()
+            return self._locate(route_id, from_stop, to_stop) is not None
+
+    def profile(self, route_id: str, hour: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Passengers per segment of a route (all day, or one hour of day) and its peak segment"""
+        self.sync()
+        with self._lock:
+            stops = self._stops.get(route_id)
+            if stops is None:
+                return None
+            route = self._routes.get(route_id)
+            diff = [0] * len(stops) if route is None else list(route.total if hour is None else route.hours[hour])
+        loads = segment_loads(diff)
+        segments = [
+            {"from": stops[i], "to": stops[i + 1], "passengers": load} for i, load in enumerate(loads)
+        ]
+        peak = max(segments, key=lambda segment: segment["passengers"], default=None)
+        return {
+            "route_id": route_id,
+            "hour": hour,
+            "boardings": sum(value for value in diff if value > 0),
+            "segments": segments,
+            "peak_segment": peak if peak and peak["passengers"] > 0 else None,
+        }
+
+    def bus_load(self, bus_id: str, last_stop: Optional[str] = None,
+                 as_of: Optional[datetime] = None) -> Optional[int]:
+        """
+        Passengers on board after the bus's last stop, from its tickets in the
+        load window (the busiest segment if the stop is not on its route).
+        None if the bus has no recent tickets that map onto a route.
+        """
+        window = _window()
+        with self._lock:
+            bus = self._buses.get(bus_id)
+            if bus is None:
+                return None
+            diff = bus.window(_bucket(as_of or datetime.now()), window)
+            if diff is None:
+                return None
+            position = self._index.get(bus.route_id, {}).get(str(last_stop or "").strip().lower())
+        loads = segment_loads(diff)
+        if position is None:
+            return max(loads, default=0)
+        return loads[position] if position < len(loads) else 0
+
+    def occupancy_percent(self, bus_id: str, last_stop: Optional[str] = None,
+                          as_of: Optional[datetime] = None) -> Optional[int]:
+        """bus_load as a percentage of BUS_CAPACITY (capped at 100)"""
+        passengers = self.bus_load(bus_id, last_stop, as_of)
+        if passengers is None:
+            return None
+        return min(100, max(0, round(passengers / max(1, config.BUS_CAPACITY) * 100)))
+
+load_profiles = LoadProfileStore()
@@ -0,0 +1,256 @@
+"""
+Low-overhead metrics in the Prometheus text format
+
+Counters, gauges and fixed-bucket histograms live in one registry. Recording
+a value costs a lock and a list increment; nothing is formatted until
+/api/metrics is scraped. MetricsMiddleware records per-route request counts,
+latency, errors and in-flight requests. Route labels are path templates
+(/api/buses/{bus_id}), so label cardinality stays bounded.
+
+Metrics are per process. Under uvicorn --workers N each scrape reflects the
+worker that served it; the `pid` in process_info tells them apart.
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _CounterValue:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+class Metric:
+    """A named metric with a fixed set of label names"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def labels(self, *values: Any) -> Any:
+        """Child metric for one combination of label values"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterValue:
+        return _CounterValue()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+            for key, child in list(self._children.items())
+        ]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def _new_child(self) -> _GaugeValue:
+        return _GaugeValue()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, child in list(self._children.items()):
+            counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class Registry:
+    """All metrics of the process, rendered together"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Any:
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+registry = Registry()
+
+PROCESS_INFO = registry.gauge("routesaathi_process_info", "Worker process serving this scrape", ("pid",))
+PROCESS_START = registry.gauge("routesaathi_process_start_time_seconds", "Unix time the worker started")
+PROCESS_START.set(time.time())
+PROCESS_INFO.labels(os.getpid()).set(1)
+
+HTTP_REQUESTS = registry.counter("routesaathi_http_requests_total", "HTTP requests", ("method", "route", "status"))
+HTTP_ERRORS = registry.counter("routesaathi_http_errors_total", "HTTP requests that failed with a 5xx or an exception",
+                               ("method", "route"))
+HTTP_LATENCY = registry.histogram("routesaathi_http_request_duration_seconds", "HTTP request latency",
+                                  ("method", "route"))
+HTTP_IN_FLIGHT = registry.gauge("routesaathi_http_requests_in_flight", "HTTP requests being served")
+
+STORAGE_SECONDS = registry.histogram("routesaathi_storage_operation_seconds", "Storage reads and writes",
+                                     ("engine", "operation", "collection"))
+STORAGE_BYTES = registry.histogram("routesaathi_storage_operation_bytes", "Bytes read or written by the JSON engine",
+                                   ("operation", "collection"), buckets=BYTES_BUCKETS)
+STORAGE_LOCK_WAIT = registry.histogram("routesaathi_storage_lock_wait_seconds",
+                                       "Time spent waiting for a collection's write lock", ("collection",))
+
+MODEL_LOAD_SECONDS = registry.histogram("routesaathi_model_load_seconds", "Demand model load time", ("format",))
+MODEL_PREDICT_SECONDS = registry.histogram("routesaathi_model_predict_seconds", "Demand model batch predict time",
+                                           ("format",))
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route request metrics"""
+
+    def __init__(self, app: Any):
+        self.app = app
+        self._routes: Optional[Dict[Any, str]] = None
+
+    def _route_label(self, scope: Dict[str, Any]) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._routes is None or endpoint not in self._routes:
+            app = scope.get("app")
+            routes = getattr(app, "routes", [])
+            self._routes = {getattr(route, "endpoint", None): getattr(route, "path", "") for route in routes}
+        return self._routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_wrapper(message: Dict[str, Any]):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        in_flight = HTTP_IN_FLIGHT.labels()
+        in_flight.inc()
+        failed = True
+        try:
+            await self.app(scope, receive, send_wrapper)
+            failed = False
+        finally:
+            elapsed = time.perf_counter() - started
+            in_flight.dec()
+            method, route = scope.get("method", ""), self._route_label(scope)
+            HTTP_LATENCY.labels(method, route).observe(elapsed)
+            HTTP_REQUESTS.labels(method, route, status[0]).inc()
+            if failed or status[0] >= 500:
+                HTTP_ERRORS.labels(method, route).inc()
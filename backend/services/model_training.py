@@ -0,0 +1,389 @@
+"""
+Offline training and export of the route demand model
+
+    python -m services.model_training
+    python -m services.model_training --synthetic-routes 200 --synthetic-days 28
+    python -m services.model_training --trees 50,100,200 --depths 6,10,none --n-jobs -1
+
+Samples are hourly snapshots per route with the same features the AI engine
+reads from services.demand_features at prediction time (15 min / 1 h demand,
+same hour last week, hour-of-day forecast, shift, buses on the route). The
+label is whether the next hour's tickets exceed the route's bus capacity.
+
+Tickets are streamed from the storage engine in pages, or generated for a
+synthetic benchmark fleet, and reduced chunk by chunk to sparse
+quarter-hour counts with NumPy. No chunk needs the whole history in memory.
+
+Every candidate (tree count x max depth) is trained with n_jobs workers and
+evaluated on a time-ordered holdout. Its train time, accuracy and inference
+latency are recorded. The best candidate is exported as a new model version
+with its feature columns, a compiled .npz (services.compiled_forest) and a
+manifest entry; services.demand_model picks it up without a restart.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from services.compiled_forest import compile_file
+from services.demand_features import SHORT_WINDOW_MINUTES, WEEK_HOURS
+from services.demand_model import MANIFEST_PATH, MODELS_DIR, read_manifest
+
+FEATURE_COLUMNS = [
+    "n_trips", "n_stop_events", "shift_afternoon", "shift_morning", "shift_other",
+    "demand_15m", "demand_1h", "demand_same_hour_last_week", "forecast_next_hour",
+]
+
+# Passengers one bus can carry on a route in an hour
+DEFAULT_BUS_CAPACITY = 40
+
+QUARTERS_PER_HOUR = 60 // SHORT_WINDOW_MINUTES
+
+EventChunk = Tuple[np.ndarray, np.ndarray]  # (route ids, event minutes since 1970)
+
+def _event_chunk(items: List[Dict[str, Any]]) -> EventChunk:
+    import pandas as pd
+
+    frame = pd.DataFrame(items, columns=["route_id", "timestamp"])
+    moments = pd.to_datetime(frame["timestamp"], errors="coerce", format="ISO8601")
+    valid = (moments.notna() & frame["route_id"].notna()).to_numpy()
+    minutes = moments[valid].to_numpy().astype("datetime64[m]").astype(np.int64)
+    return frame["route_id"].to_numpy()[valid].astype(str), minutes
+
+def stream_ticket_events(chunk_size: int = 5000) -> Iterator[EventChunk]:
+    """
+    Page through the archived and then the hot tickets, yielding parsed
+    (route, minute) arrays
+    """
+    from services import repository
+    from services.ticket_archive import archive
+
+    items: List[Dict[str, Any]] = []
+    for ticket in archive.tickets():
+        items.append({"route_id": ticket.get("route_id"), "timestamp": ticket.get("timestamp")})
+        if len(items) == chunk_size:
+            yield _event_chunk(items)
+            items = []
+    if items:
+        yield _event_chunk(items)
+
+    cursor = None
+    while True:
+        items, cursor = repository.tickets.page(limit=chunk_size, cursor=cursor, fields=["route_id", "timestamp"])
+        if items:
+            yield _event_chunk(items)
+        if cursor is None:
+            break
+
+def route_bus_counts() -> Dict[str, int]:
+    """Buses currently assigned to each route"""
+    from services import repository
+
+    return repository.buses.count_by("route_id")
+
+# Relative demand per hour of day: morning and evening peaks
+DIURNAL = np.array([
+    0.05, 0.03, 0.02, 0.02, 0.05, 0.2, 0.6, 1.2, 1.6, 1.4, 0.9, 0.7,
+    0.7, 0.7, 0.6, 0.7, 0.9, 1.3, 1.6, 1.3, 0.8, 0.5, 0.3, 0.1,
+])
+
+def synthetic_fleet(n_routes: int, days: int, seed: int = 7,
+                    bus_capacity: int = DEFAULT_BUS_CAPACITY) -> Tuple[Dict[str, int], Iterator[EventChunk]]:
+    """
+    Benchmark fleet: bus counts per route and a day-by-day stream of ticket
+    events with diurnal peaks, weekend dips and per-route load levels tuned
+    so a share of peak hours exceed capacity.
+    """
+    rng = np.random.default_rng(seed)
+    route_ids = np.array([f"R-S{i:04d}" for i in range(n_routes)])
+    buses = rng.integers(1, 8, size=n_routes)
+    # Average load at peak relative to capacity
+    load = rng.lognormal(mean=-0.2, sigma=0.35, size=n_routes)
+    start_day = np.datetime64(datetime.now().date()) - np.timedelta64(days, "D")
+
+    def events() -> Iterator[EventChunk]:
+        for day in range(days):
+            day_start = (start_day + np.timedelta64(day, "D")).astype("datetime64[m]").astype(np.int64)
+            weekday = int(((start_day + np.timedelta64(day, "D")).astype("datetime64[D]").astype(np.int64) + 3) % 7)
+            weekend = 0.6 if weekday >= 5 else 1.0
+            # Expected tickets per route and hour
+            rates = np.outer(buses * bus_capacity * load * weekend, DIURNAL) / DIURNAL.max()
+            counts = rng.poisson(rates)
+            route_index = np.repeat(np.repeat(np.arange(n_routes), 24), counts.ravel())
+            hour_index = np.repeat(np.tile(np.arange(24), n_routes), counts.ravel())
+            minutes = day_start + hour_index * 60 + rng.integers(0, 60, size=hour_index.size)
+            yield route_ids[route_index], minutes
+
+    return dict(zip(route_ids.tolist(), buses.tolist())), events()
+
+class DemandCounts:
+    """Sparse (route, quarter-hour) ticket counts accumulated chunk by chunk"""
+
+    def __init__(self):
+        self.route_index: Dict[str, int] = {}
+        self._keys: List[np.ndarray] = []
+        self._counts: List[np.ndarray] = []
+        self.events = 0
+
+    def add(self, routes: np.ndarray, minutes: np.ndarray):
+        if len(routes) == 0:
+            return
+        names, inverse = np.unique(routes, return_inverse=True)
+        codes = np.array([self.route_index.setdefault(name, len(self.route_index)) for name in names.tolist()])
+        keys = (codes[inverse].astype(np.int64) << 32) | (minutes // SHORT_WINDOW_MINUTES)
+        keys, counts = np.unique(keys, return_counts=True)
+        self._keys.append(keys)
+        self._counts.append(counts)
+        self.events += len(routes)
+
+    def hourly(self) -> Tuple[List[str], int, np.ndarray, np.ndarray]:
+        """
+        Dense matrices over the covered span: (route ids, first hour,
+        tickets per hour [route, hour], tickets in each hour's last quarter)
+        """
+        keys = np.concatenate(self._keys)
+        counts = np.concatenate(self._counts)
+        routes = (keys >> 32).astype(np.int64)
+        quarters = keys & 0xFFFFFFFF
+        first_hour = int(quarters.min()) // QUARTERS_PER_HOUR
+        hours = quarters // QUARTERS_PER_HOUR - first_hour
+        n_hours = int(hours.max()) + 1
+        per_hour = np.zeros((len(self.route_index), n_hours), dtype=np.int64)
+        np.add.at(per_hour, (routes, hours), counts)
+        last_quarter = np.zeros_like(per_hour)
+        is_last = quarters % QUARTERS_PER_HOUR == QUARTERS_PER_HOUR - 1
+        np.add.at(last_quarter, (routes[is_last], hours[is_last]), counts[is_last])
+        names = sorted(self.route_index, key=self.route_index.get)
+        return names, first_hour, per_hour, last_quarter
+
+def build_samples(counts: DemandCounts, buses_by_route: Dict[str, int],
+                  bus_capacity: int = DEFAULT_BUS_CAPACITY) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Feature matrix (FEATURE_COLUMNS order), labels and snapshot hour index.
+    One row per route and hour H, using only tickets before H; rows for
+    routes idle the whole surrounding week are skipped.
+    """
+    names, first_hour, per_hour, last_quarter = counts.hourly()
+    n_routes, n_hours = per_hour.shape
+    pad = WEEK_HOURS + 1
+    padded = np.concatenate([np.zeros((n_routes, pad), dtype=np.int64), per_hour], axis=1)
+
+    def lagged(lag: int) -> np.ndarray:
+        """per_hour shifted so column H holds hour H - lag"""
+        return padded[:, pad - lag: pad - lag + n_hours]
+
+    demand_1h = lagged(1)
+    demand_15m = np.concatenate([np.zeros((n_routes, 1), dtype=np.int64), last_quarter[:, :-1]], axis=1)
+    same_hour_last_week = lagged(WEEK_HOURS)
+
+    # Hour-of-day mean for H + 1 over the completed hours of the past week,
+    # counted from each route's first ticket like the online store
+    active = per_hour > 0
+    route_first = np.where(active.any(axis=1), active.argmax(axis=1), 0)
+    hour_grid = np.arange(n_hours)
+    totals = np.zeros((n_routes, n_hours), dtype=np.float64)
+    covered = np.zeros((n_routes, n_hours), dtype=np.float64)
+    for days_back in range(1, 8):
+        lag = 24 * days_back - 1
+        source_hour = hour_grid[None, :] - lag
+        counted = source_hour >= route_first[:, None]
+        totals += np.where(counted, lagged(lag), 0)
+        covered += counted
+    forecast_next_hour = np.divide(totals, covered, out=np.zeros_like(totals), where=covered > 0)
+
+    hour_of_day = (first_hour + hour_grid) % 24
+    shift_morning = ((hour_of_day >= 6) & (hour_of_day < 12)).astype(np.int64)
+    shift_afternoon = ((hour_of_day >= 12) & (hour_of_day < 18)).astype(np.int64)
+    shift_other = 1 - shift_morning - shift_afternoon
+
+    n_trips = np.array([buses_by_route.get(name, 0) for name in names], dtype=np.int64)
+    labels = per_hour > np.maximum(n_trips, 1)[:, None] * bus_capacity
+
+    # Keep snapshots with activity in the trailing week or the labelled hour
+    cumulative = np.cumsum(padded, axis=1)
+    trailing = cumulative[:, pad - 1: pad - 1 + n_hours] - cumulative[:, :n_hours]
+    keep = (trailing > 0) | (per_hour > 0)
+    keep[:, 0] = False
+
+    rows, hours = np.nonzero(keep)
+    columns = {
+        "n_trips": n_trips[rows],
+        "n_stop_events": demand_1h[rows, hours],
+        "shift_afternoon": shift_afternoon[hours],
+        "shift_morning": shift_morning[hours],
+        "shift_other": shift_other[hours],
+        "demand_15m": demand_15m[rows, hours],
+        "demand_1h": demand_1h[rows, hours],
+        "demand_same_hour_last_week": same_hour_last_week[rows, hours],
+        "forecast_next_hour": np.round(forecast_next_hour[rows, hours], 2),
+    }
+    features = np.column_stack([columns[name] for name in FEATURE_COLUMNS]).astype(np.float64)
+    return features, labels[rows, hours].astype(np.int64), hours
+
+def _parse_depth(value: str) -> Optional[int]:
+    return None if value.lower() in ("none", "") else int(value)
+
+def _latency_ms(model: Any, sample: Any, repeats: int) -> float:
+    """Median wall time of one predict call"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.predict(sample)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+def evaluate_candidates(features: np.ndarray, labels: np.ndarray, hours: np.ndarray, trees: List[int],
+                        depths: List[Optional[int]], n_jobs: int, seed: int,
+                        latency_repeats: int = 50) -> Tuple[List[Dict[str, Any]], Dict[Tuple, Any]]:
+    """Train and time every (trees, depth) pair on a time-ordered 80/20 split"""
+    import pandas as pd
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.metrics import accuracy_score, f1_score, roc_auc_score
+
+    split_hour = np.quantile(hours, 0.8)
+    train, test = hours < split_hour, hours >= split_hour
+    if not train.any() or not test.any():
+        train = test = np.ones(len(hours), dtype=bool)
+    x_train = pd.DataFrame(features[train], columns=FEATURE_COLUMNS)
+    x_test = pd.DataFrame(features[test], columns=FEATURE_COLUMNS)
+    y_train, y_test = labels[train], labels[test]
+    single_row = x_test.iloc[:1]
+
+    results, models = [], {}
+    for n_trees in trees:
+        for depth in depths:
+            model = RandomForestClassifier(n_estimators=n_trees, max_depth=depth, n_jobs=n_jobs, random_state=seed)
+            start = time.perf_counter()
+            model.fit(x_train, y_train)
+            train_seconds = time.perf_counter() - start
+            # Serving predicts a handful of rows per request; worker threads only add overhead
+            model.set_params(n_jobs=1)
+
+            start = time.perf_counter()
+            predicted = model.predict(x_test)
+            batch_seconds = time.perf_counter() - start
+            result = {
+                "trees": n_trees,
+                "max_depth": depth,
+                "train_seconds": round(train_seconds, 3),
+                "accuracy": round(float(accuracy_score(y_test, predicted)), 4),
+                "f1": round(float(f1_score(y_test, predicted, zero_division=0)), 4),
+                "roc_auc": None,
+                "predict_one_ms": round(_latency_ms(model, single_row, latency_repeats), 3),
+                "predict_batch_rows_per_s": round(len(x_test) / batch_seconds) if batch_seconds > 0 else None,
+                "total_nodes": int(sum(tree.tree_.node_count for tree in model.estimators_)),
+            }
+            if len(np.unique(y_test)) == 2 and len(model.classes_) == 2:
+                result["roc_auc"] = round(float(roc_auc_score(y_test, model.predict_proba(x_test)[:, 1])), 4)
+            results.append(result)
+            models[(n_trees, depth)] = model
+            print(f"trees={n_trees:<4} depth={str(depth):<5} train={result['train_seconds']:>7.2f}s "
+                  f"f1={result['f1']:.3f} acc={result['accuracy']:.3f} "
+                  f"predict_one={result['predict_one_ms']:.2f}ms nodes={result['total_nodes']}")
+    return results, models
+
+def select_candidate(results: List[Dict[str, Any]], max_latency_ms: Optional[float] = None) -> Dict[str, Any]:
+    """Best F1 within the latency budget; ties go to the faster model"""
+    eligible = [r for r in results if max_latency_ms is None or r["predict_one_ms"] <= max_latency_ms] or results
+    return max(eligible, key=lambda r: (r["f1"], r["accuracy"], -r["predict_one_ms"]))
+
+def _write_json_atomic(path: str, data: Any):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def export_model(model: Any, metadata: Dict[str, Any], make_current: bool = True) -> str:
+    """Save a model version and register it in the manifest; returns the version"""
+    import joblib
+
+    version = datetime.now().strftime("%Y%m%d%H%M%S")
+    model_file = f"demand_rf-{version}.joblib"
+    columns_file = f"feature_columns-{version}.joblib"
+    joblib.dump(model, os.path.join(MODELS_DIR, model_file))
+    joblib.dump(FEATURE_COLUMNS, os.path.join(MODELS_DIR, columns_file))
+    compiled_file = os.path.basename(compile_file(os.path.join(MODELS_DIR, model_file),
+                                                  os.path.join(MODELS_DIR, columns_file)))
+
+    manifest = read_manifest()
+    manifest.setdefault("versions", {})[version] = {
+        "model_file": model_file,
+        "columns_file": columns_file,
+        "compiled_file": compiled_file,
+        "feature_columns": FEATURE_COLUMNS,
+        "trained_at": datetime.now().isoformat(),
+        **metadata,
+    }
+    if make_current:
+        manifest["current"] = version
+    _write_json_atomic(MANIFEST_PATH, manifest)
+    return version
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Train and export the route demand model")
+    parser.add_argument("--synthetic-routes", type=int, default=0,
+                        help="train on a synthetic benchmark fleet with this many routes instead of the data files")
+    parser.add_argument("--synthetic-days", type=int, default=28)
+    parser.add_argument("--trees", default="50,100,200", help="comma-separated tree counts to compare")
+    parser.add_argument("--depths", default="8,16,none", help="comma-separated max depths to compare (none = unlimited)")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="training parallelism (-1 = all cores)")
+    parser.add_argument("--bus-capacity", type=int, default=DEFAULT_BUS_CAPACITY)
+    parser.add_argument("--max-latency-ms", type=float, default=None, help="only export candidates this fast per prediction")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--no-export", action="store_true", help="report only, do not save a model version")
+    parser.add_argument("--no-activate", action="store_true", help="export without making it the current version")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    counts = DemandCounts()
+    if args.synthetic_routes:
+        buses_by_route, events = synthetic_fleet(args.synthetic_routes, args.synthetic_days, args.seed, args.bus_capacity)
+        source = f"synthetic:{args.synthetic_routes}x{args.synthetic_days}d"
+    else:
+        buses_by_route, events = route_bus_counts(), stream_ticket_events(args.chunk_size)
+        source = "tickets"
+    for routes, minutes in events:
+        counts.add(routes, minutes)
+    if not counts.events:
+        print("No ticket events to train on")
+        return
+    features, labels, hours = build_samples(counts, buses_by_route, args.bus_capacity)
+    print(f"{counts.events} tickets -> {len(labels)} samples ({int(labels.sum())} positive) "
+          f"in {time.perf_counter() - start:.2f}s")
+    if len(np.unique(labels)) < 2:
+        print("Only one class in the labels; use more data or --synthetic-routes")
+        return
+
+    trees = [int(value) for value in args.trees.split(",")]
+    depths = [_parse_depth(value) for value in args.depths.split(",")]
+    results, models = evaluate_candidates(features, labels, hours, trees, depths, args.n_jobs, args.seed)
+    best = select_candidate(results, args.max_latency_ms)
+    print(f"Selected trees={best['trees']} depth={best['max_depth']}")
+    if args.no_export:
+        return
+
+    version = export_model(models[(best["trees"], best["max_depth"])], {
+        "source": source,
+        "samples": int(len(labels)),
+        "positive_rate": round(float(labels.mean()), 4),
+        "bus_capacity": args.bus_capacity,
+        "selected": best,
+        "candidates": results,
+    }, make_current=not args.no_activate)
+    print(f"Exported model version {version} to {MODELS_DIR}")
+
+if __name__ == "__main__":
+    main()
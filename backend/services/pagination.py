@@ -0,0 +1,36 @@
+"""
+Shared handling of list endpoint paging parameters
+
+    fields=id,lat,lng,status   projection (the primary key is always included)
+    limit=50&cursor=...        keyset pages; the next cursor is returned in
+                               the X-Next-Cursor header and is absent on the
+                               last page
+"""
+
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, Response
+
+from services.repository import Repository
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Largest page a client may request
+MAX_PAGE_SIZE = 1000
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Split a comma-separated fields= parameter (None = all fields)"""
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
+def fetch_page(repo: Repository, response: Response, limit: Optional[int] = None, cursor: Optional[str] = None,
+               fields: Optional[str] = None, **kwargs) -> List[Dict[str, Any]]:
+    """Run a paged query for an endpoint, setting the next-cursor header"""
+    try:
+        items, next_cursor = repo.page(limit=limit, cursor=cursor, fields=parse_fields(fields), **kwargs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return items
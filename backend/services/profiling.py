@@ -0,0 +1,206 @@
+"""
+On-demand request profiling
+
+Installed only when ROUTESAATHI_PROFILING_ENABLED is set; otherwise the
+middleware is not in the stack at all and costs nothing.
+
+    explicit - a request sent with "X-Profile: 1" or "?profile=1" runs under
+               cProfile. The response carries X-Profile-Id.
+    slow     - every other request is watched by a shared stack sampler
+               (one background thread, idle while nothing is in flight). If a
+               request takes longer than PROFILE_SLOW_MS, its samples are kept
+               as collapsed stacks (flamegraph input).
+
+Both profiles cover the worker's event loop while the request ran, so work
+for concurrent requests on the same loop shows up too. The last
+PROFILE_BUFFER_SIZE profiles of each worker are kept in a ring buffer and
+served by the /api/admin/profiles endpoints.
+"""
+
+import cProfile
+import io
+import itertools
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Set
+from urllib.parse import parse_qs
+
+from services import config
+
+PROFILE_HEADER = "X-Profile-Id"
+MAX_STACK_DEPTH = 64
+
+class _Collector:
+    __slots__ = ("thread_id", "stacks", "samples")
+
+    def __init__(self, thread_id: int):
+        self.thread_id = thread_id
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+class StackSampler:
+    """Samples the stacks of threads serving watched requests at a fixed interval"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._collectors: Set[_Collector] = set()
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, thread_id: int) -> _Collector:
+        collector = _Collector(thread_id)
+        with self._lock:
+            self._collectors.add(collector)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        self._active.set()
+        return collector
+
+    def release(self, collector: _Collector):
+        with self._lock:
+            self._collectors.discard(collector)
+            if not self._collectors:
+                self._active.clear()
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                collectors = list(self._collectors)
+            if not collectors:
+                continue
+            frames = sys._current_frames()
+            stacks: Dict[int, str] = {}
+            for collector in collectors:
+                if collector.thread_id not in stacks:
+                    frame = frames.get(collector.thread_id)
+                    stacks[collector.thread_id] = _collapse(frame) if frame is not None else ""
+                stack = stacks[collector.thread_id]
+                collector.samples += 1
+                if stack:
+                    collector.stacks[stack] += 1
+
+def _collapse(frame: Any) -> str:
+    """Stack as "outer;...;inner" frames of file:function:line"""
+    parts: List[str] = []
+    while frame is not None and len(parts) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+class ProfileStore:
+    """Ring buffer of the most recent profiles"""
+
+    def __init__(self, size: int):
+        self._profiles: Deque[Dict[str, Any]] = deque(maxlen=max(1, size))
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def next_id(self) -> str:
+        return f"{os.getpid()}-{next(self._ids)}"
+
+    def add(self, profile: Dict[str, Any]):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            profiles = list(self._profiles)
+        return [{k: v for k, v in p.items() if k not in ("data", "summary")} for p in reversed(profiles)]
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return next((p for p in self._profiles if p["id"] == profile_id), None)
+
+def _cprofile_result(profiler: cProfile.Profile) -> Dict[str, Any]:
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats("cumulative").print_stats(40)
+    # Same bytes pstats.Stats.dump_stats writes, loadable with pstats / snakeviz
+    return {"format": "pstats", "data": marshal.dumps(stats.stats), "summary": stream.getvalue()}
+
+def _sampled_result(collector: _Collector) -> Dict[str, Any]:
+    collapsed = "\n".join(f"{stack} {count}" for stack, count in collector.stacks.most_common())
+    leaves = Counter()
+    for stack, count in collector.stacks.items():
+        leaves[stack.rsplit(";", 1)[-1]] += count
+    summary = "\n".join(f"{count:6d}  {frame}" for frame, count in leaves.most_common(40))
+    return {"format": "collapsed", "data": collapsed.encode("utf-8"), "summary": summary, "samples": collector.samples}
+
+def _requested(scope: Dict[str, Any]) -> bool:
+    for name, value in scope.get("headers", []):
+        if name == b"x-profile":
+            return value.strip().lower() in (b"1", b"true", b"yes", b"on")
+    query = scope.get("query_string", b"")
+    if b"profile" in query:
+        values = parse_qs(query.decode("latin-1")).get("profile", [])
+        return any(v.lower() in ("1", "true", "yes", "on") for v in values)
+    return False
+
+profiles = ProfileStore(config.PROFILE_BUFFER_SIZE)
+sampler = StackSampler(config.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+# cProfile cannot run twice at once in one process
+_cprofile_lock = threading.Lock()
+
+class ProfilingMiddleware:
+    """ASGI middleware capturing requested and slow request profiles"""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        requested = _requested(scope)
+        slow_ms = config.PROFILE_SLOW_MS
+        if not requested and slow_ms <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        profiler = None
+        if requested and _cprofile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+        collector = None if profiler is not None else sampler.watch(threading.get_ident())
+        profile_id = profiles.next_id()
+
+        async def send_wrapper(message: Dict[str, Any]):
+            if requested and message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(PROFILE_HEADER.lower().encode(), profile_id.encode())]
+            await send(message)
+
+        started = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if profiler is not None:
+                profiler.disable()
+                _cprofile_lock.release()
+                result = _cprofile_result(profiler)
+            else:
+                sampler.release(collector)
+                result = _sampled_result(collector) if requested or elapsed_ms >= slow_ms else None
+            if result is not None:
+                profiles.add({
+                    "id": profile_id,
+                    "trigger": "requested" if requested else "slow",
+                    "method": scope.get("method"),
+                    "path": scope.get("path"),
+                    "duration_ms": round(elapsed_ms, 2),
+                    "captured_at": datetime.now().isoformat(),
+                    **result,
+                })
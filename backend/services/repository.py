@@ -0,0 +1,126 @@
+"""
+Repository layer - per-collection query API used by the routers
+
+Filters are passed as keyword lookups and executed by the storage engine
+(SQL on the SQLite backend), e.g.
+
+    repository.buses.count(status="MOVING")
+    repository.tickets.count_by("timestamp__hour", route_id="R-201")
+    repository.buses.find(occupancy_percent__gt=85)
+
+List endpoints page with opaque keyset cursors:
+
+    items, cursor = repository.buses.page(limit=50, fields=["id", "lat", "lng"])
+    more, cursor = repository.buses.page(limit=50, cursor=cursor, fields=["id", "lat", "lng"])
+"""
+
+import base64
+import json
+from typing import List, Dict, Any, Iterator, Optional, Sequence, Tuple
+from services.storage import get_engine, primary_key
+
+def encode_cursor(position: List[Any]) -> str:
+    """Opaque URL-safe cursor for a page position"""
+    raw = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """Page position from a cursor; raises ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, position = json.loads(raw)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(position, int):
+        raise ValueError("Invalid cursor")
+    return [value, position]
+
+class Repository:
+    """Queries and mutations for one collection"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.key = primary_key(filename)
+
+    @property
+    def engine(self):
+        return get_engine()
+
+    def all(self) -> List[Dict[str, Any]]:
+        """All items in insertion order"""
+        return self.engine.read_all(self.filename)
+
+    def get(self, key_value: Any) -> Optional[Dict[str, Any]]:
+        """Item by primary key"""
+        results = self.engine.find(self.filename, {self.key: key_value}, limit=1)
+        return results[0] if results else None
+
+    def find(self, order_by: Optional[str] = None, descending: bool = False, limit: Optional[int] = None,
+             offset: int = 0, **where) -> List[Dict[str, Any]]:
+        """Items matching the lookups"""
+        return self.engine.find(self.filename, where, order_by=order_by, descending=descending, limit=limit, offset=offset)
+
+    def tail(self, n: int, **where) -> List[Dict[str, Any]]:
+        """Last n matching items, oldest first"""
+        results = self.engine.find(self.filename, where, descending=True, limit=n)
+        results.reverse()
+        return results
+
+    def scan(self, chunk_size: int = 1000, **where) -> Iterator[List[Dict[str, Any]]]:
+        """Matching items in insertion order, a chunk at a time"""
+        return self.engine.scan(self.filename, where, chunk_size)
+
+    def page(self, limit: Optional[int] = None, cursor: Optional[str] = None, fields: Optional[Sequence[str]] = None,
+             order_by: Optional[str] = None, descending: bool = False, **where) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """One page of matching items and the cursor of the next page (None on the last page)"""
+        after = decode_cursor(cursor) if cursor else None
+        items, next_after = self.engine.find_page(self.filename, where, order_by=order_by, descending=descending,
+                                                  limit=limit, after=after, fields=fields)
+        return items, encode_cursor(next_after) if next_after is not None else None
+
+    def count(self, **where) -> int:
+        """Number of matching items"""
+        return self.engine.count(self.filename, where)
+
+    def count_by(self, group: str, **where) -> Dict[Any, int]:
+        """Matching item count per group value"""
+        return self.engine.group_count(self.filename, group, where)
+
+    def sum(self, field: str, **where):
+        """Sum of a numeric field over matching items"""
+        return self.engine.sum(self.filename, field, where)
+
+    def sum_by(self, group: str, field: str, **where) -> Dict[Any, Any]:
+        """Sum of a numeric field per group value"""
+        return self.engine.group_sum(self.filename, group, field, where)
+
+    def insert(self, *items: Dict[str, Any]) -> bool:
+        """Append items"""
+        return self.engine.insert(self.filename, list(items))
+
+    def update(self, key_value: Any, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Update an item by primary key; returns the updated item or None"""
+        return self.engine.update(self.filename, self.key, key_value, updates)
+
+    def update_many(self, updates_by_key: Dict[Any, Dict[str, Any]]) -> int:
+        """Apply per-item updates keyed by primary key"""
+        return self.engine.update_many(self.filename, updates_by_key)
+
+    def delete(self, key_value: Any) -> bool:
+        """Delete an item by primary key"""
+        return self.engine.delete(self.filename, self.key, key_value)
+
+    def take(self, **where) -> List[Dict[str, Any]]:
+        """Remove the matching items and return them"""
+        return self.engine.take(self.filename, where)
+
+    def replace_all(self, items: List[Dict[str, Any]]) -> bool:
+        """Replace the whole collection"""
+        return self.engine.write_all(self.filename, items)
+
+buses = Repository("buses.json")
+routes = Repository("routes.json")
+tickets = Repository("tickets.json")
+alerts = Repository("alerts.json")
+users = Repository("users.json")
+assignments = Repository("assignments.json")
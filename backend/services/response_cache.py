@@ -0,0 +1,141 @@
+"""
+Response cache with strong ETags for read-heavy endpoints
+
+Endpoints decorated with @cached_response("buses.json", ...) are keyed on
+the request path/query plus the version tokens of the collections they read
+(see StorageEngine.version). While no collection changes:
+    - the serialized body is reused, nothing is recomputed or re-encoded
+    - a matching If-None-Match is answered with 304 Not Modified
+Any write to a listed collection, from any worker, changes its version and
+so invalidates every cached response that depends on it.
+"""
+
+import functools
+import hashlib
+import inspect
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from starlette.responses import Response
+
+from services import config
+from services.fast_json import dumps
+from services.storage import get_engine
+
+# Revalidate on every poll; 304s keep that cheap
+DEFAULT_CACHE_CONTROL = "private, no-cache"
+
+class _Entry:
+    __slots__ = ("versions", "body", "etag", "headers")
+
+    def __init__(self, versions: Tuple, body: bytes, etag: str, headers: Dict[str, str]):
+        self.versions = versions
+        self.body = body
+        self.etag = etag
+        self.headers = headers
+
+class ResponseCache:
+    """Bounded LRU of serialized responses"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any, versions: Tuple) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.versions != versions:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Any, entry: _Entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+response_cache = ResponseCache(config.RESPONSE_CACHE_SIZE)
+
+def render_json(content: Any) -> bytes:
+    """Serialize an endpoint result the way the app's default response class would"""
+    return dumps(jsonable_encoder(content))
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag derived from the response bytes"""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header value against an ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison is correct for If-None-Match (RFC 9110 13.1.2)
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+def cached_response(*collections: str, cache_control: str = DEFAULT_CACHE_CONTROL):
+    """
+    Decorator for GET endpoints whose result depends only on the request and
+    the contents of the given collections.
+    """
+    def decorator(func: Callable):
+        signature = inspect.signature(func)
+        request_param = next(
+            (name for name, param in signature.parameters.items() if param.annotation is Request), None
+        )
+        if request_param is None:
+            request_param = "_cache_request"
+            params = list(signature.parameters.values())
+            params.append(inspect.Parameter(request_param, inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+            signature = signature.replace(parameters=params)
+
+        # Headers the endpoint sets on its injected Response are cached too
+        response_param = next(
+            (name for name, param in signature.parameters.items() if param.annotation is Response), None
+        )
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request: Request = kwargs[request_param]
+            if request_param == "_cache_request":
+                kwargs.pop(request_param)
+
+            engine = get_engine()
+            versions = tuple(engine.version(name) for name in collections)
+            key = (func.__module__, func.__qualname__, request.url.path, request.url.query)
+
+            entry = response_cache.get(key, versions)
+            if entry is None:
+                result = await func(*args, **kwargs)
+                if isinstance(result, Response):
+                    return result
+                body = render_json(result)
+                extra_headers = {}
+                if response_param is not None:
+                    extra_headers = {k: v for k, v in kwargs[response_param].headers.items() if k != "content-length"}
+                entry = _Entry(versions, body, make_etag(body), extra_headers)
+                response_cache.put(key, entry)
+
+            headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": cache_control}
+            if etag_matches(request.headers.get("if-none-match"), entry.etag):
+                return Response(status_code=304, headers=headers)
+            return Response(content=entry.body, media_type="application/json", headers=headers)
+
+        wrapper.__signature__ = signature
+        return wrapper
+    return decorator
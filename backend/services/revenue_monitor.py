@@ -0,0 +1,300 @@
+"""
+Streaming ticket revenue anomaly detection
+
+Revenue is followed per bus and per route in fixed REVENUE_BUCKET_MINUTES
+buckets. Each one keeps O(1) state: the open bucket's revenue, a Welford
+running mean and variance of closed buckets, and an EWMA of their
+revenue (the recent level). When a bucket closes its revenue is scored
+before it is folded in:
+
+    z = (revenue - ewma) / max(stddev, 1)
+
+At REVENUE_Z_ENTER or beyond (in either direction) once REVENUE_MIN_BUCKETS
+have been seen, a REVENUE_ANOMALY alert is raised: a drop may be a device
+fault or leakage, a spike an unusual rush. A spike is raised as soon as the
+open bucket's revenue gets there. The alert is resolved once a closed
+bucket scores within REVENUE_Z_EXIT, and at most one is active per bus or
+route.
+
+Buckets without tickets count as zero revenue, but only while the bus (or
+a bus on the route) is in service and for at most REVENUE_MAX_GAP_BUCKETS;
+a longer gap starts a new session. The first and last bucket of a session
+are partial, so they are neither scored nor folded in.
+
+Like the demand feature store, the monitor follows the tickets collection
+incrementally (tickets issued by any worker) and costs O(1) per ticket.
+Empty buckets are closed at most once per bucket, when the clock moves into
+a new one.
+"""
+
+import math
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from services import config, repository
+from services.data_utils import generate_id
+from services.demand_features import TicketCursor, minute_index, parse_event_time
+from services.shared_state import assignments_by_conductor, notifier
+
+ALERT_TYPE = "REVENUE_ANOMALY"
+
+IN_SERVICE = ("MOVING", "STUCK")
+
+def _bucket(moment: datetime) -> int:
+    return minute_index(moment) // max(1, config.REVENUE_BUCKET_MINUTES)
+
+class RevenueStats:
+    """Open bucket, Welford mean/variance and EWMA of one bus's or route's revenue per bucket"""
+
+    __slots__ = ("bucket", "revenue", "fresh", "n", "mean", "m2", "ewma", "anomaly", "z", "observed", "baseline")
+
+    def __init__(self, bucket: int):
+        self.bucket = bucket
+        self.revenue = 0.0
+        # The first bucket of a session is partial
+        self.fresh = True
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ewma = 0.0
+        self.anomaly: Optional[str] = None
+        # Score, revenue and expected revenue of the bucket behind the last state change
+        self.z: Optional[float] = None
+        self.observed = 0.0
+        self.baseline = 0.0
+
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+    def zscore(self, revenue: float) -> Optional[float]:
+        if self.n < config.REVENUE_MIN_BUCKETS:
+            return None
+        return (revenue - self.ewma) / max(self.std(), 1.0)
+
+    def fold(self, revenue: float):
+        self.n += 1
+        delta = revenue - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (revenue - self.mean)
+        alpha = config.REVENUE_EWMA_ALPHA
+        self.ewma = revenue if self.n == 1 else alpha * revenue + (1 - alpha) * self.ewma
+
+    def _close(self, revenue: float) -> Optional[Tuple[float, float, float]]:
+        """Score a finished bucket, then fold it in"""
+        if self.fresh:
+            self.fresh = False
+            return None
+        z, expected = self.zscore(revenue), self.ewma
+        self.fold(revenue)
+        return (z, revenue, expected) if z is not None else None
+
+    def advance(self, bucket: int, in_service: bool) -> List[Tuple[float, float, float]]:
+        """Close the open bucket and the empty ones before `bucket`; returns their (z-score, revenue, expected)"""
+        gap = bucket - self.bucket - 1
+        if not in_service or gap > config.REVENUE_MAX_GAP_BUCKETS:
+            # End of a session: the last bucket is partial, and the next one will be too
+            self.fresh = True
+            scores = []
+        else:
+            scores = [self._close(self.revenue)] + [self._close(0.0) for _ in range(gap)]
+        self.bucket = bucket
+        self.revenue = 0.0
+        return [score for score in scores if score is not None]
+
+    def transition(self, scores: List[Tuple[float, float, float]]) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        """New anomaly state after scoring closed buckets, as (old, new), or None if unchanged"""
+        state = self.anomaly
+        for z, revenue, expected in scores:
+            previous = state
+            if z >= config.REVENUE_Z_ENTER:
+                state = "SPIKE"
+            elif z <= -config.REVENUE_Z_ENTER:
+                state = "DROP"
+            elif abs(z) < config.REVENUE_Z_EXIT:
+                state = None
+            if state != previous:
+                self.z, self.observed, self.baseline = z, revenue, expected
+        return self._set(state)
+
+    def check_open(self) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        """Raise a spike as soon as the open bucket's revenue gets there"""
+        z = self.zscore(self.revenue)
+        if self.fresh or z is None or z < config.REVENUE_Z_ENTER or self.anomaly == "SPIKE":
+            return None
+        self.z, self.observed, self.baseline = z, self.revenue, self.ewma
+        return self._set("SPIKE")
+
+    def _set(self, state: Optional[str]) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        if state == self.anomaly:
+            return None
+        old, self.anomaly = self.anomaly, state
+        return old, state
+
+    def describe(self, kind: str, key: str) -> Dict[str, Any]:
+        """Current state and the figures behind it (copied, for publishing outside the lock)"""
+        return {
+            "kind": kind,
+            "id": key,
+            "anomaly": self.anomaly,
+            "z_score": round(self.z, 2) if self.z is not None else None,
+            "revenue": self.observed,
+            "expected_revenue": round(self.baseline, 2),
+        }
+
+class RevenueMonitor:
+    """Per-bus and per-route streaming revenue detector that writes deduplicated alerts"""
+
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str], RevenueStats] = {}
+        self._lock = threading.Lock()
+        self._cursor = TicketCursor()
+        self._seeded = False
+        self._swept = 0
+
+    def _observe(self, tickets: Iterable[Dict[str, Any]]) -> List[Tuple[Optional[str], Dict[str, Any]]]:
+        transitions = []
+        for ticket in tickets:
+            moment = parse_event_time(ticket.get("timestamp"))
+            if moment is None:
+                continue
+            bucket = _bucket(moment)
+            fare = float(ticket.get("fare") or 0)
+            for kind in ("bus", "route"):
+                key = ticket.get(f"{kind}_id")
+                if not key:
+                    continue
+                stats = self._stats.get((kind, key))
+                if stats is None:
+                    stats = self._stats[(kind, key)] = RevenueStats(bucket)
+                scores = stats.advance(bucket, True) if bucket > stats.bucket else []
+                # Late tickets (issued by another worker in an earlier bucket) count in the open one
+                stats.revenue += fare
+                for result in (stats.transition(scores), stats.check_open()):
+                    if result is not None:
+                        transitions.append((result[0], stats.describe(kind, key)))
+        return transitions
+
+    def _sweep(self, now: datetime) -> List[Tuple[Optional[str], Dict[str, Any]]]:
+        """Close every bucket the clock has moved past, once per bucket"""
+        bucket = _bucket(now)
+        if bucket <= self._swept:
+            return []
+        self._swept = bucket
+        buses = set()
+        routes = set()
+        for bus in repository.buses.all():
+            if bus.get("status") in IN_SERVICE:
+                buses.add(bus.get("id"))
+                routes.add(bus.get("route_id"))
+        in_service: Dict[str, Set[Any]] = {"bus": buses, "route": routes}
+        transitions = []
+        for (kind, key), stats in self._stats.items():
+            if stats.bucket < bucket:
+                result = stats.transition(stats.advance(bucket, key in in_service[kind]))
+                if result is not None:
+                    transitions.append((result[0], stats.describe(kind, key)))
+        return transitions
+
+    def sync(self, now: Optional[datetime] = None) -> int:
+        """
+        Fold in tickets issued since the last sync (by any worker) and close
+        finished buckets, raising or resolving alerts; returns how many
+        tickets were read. The first call only learns from existing tickets.
+        """
+        with self._lock:
+            # No rebuild: after an archive roll reading resumes after the last ticket seen
+            tickets = self._cursor.pending()
+            transitions = self._fold(tickets, now)
+        self._emit(transitions)
+        return len(tickets)
+
+    def observe_many(self, tickets: List[Dict[str, Any]], now: Optional[datetime] = None):
+        """Fold in tickets this thread has just inserted, catching up first if another worker wrote"""
+        with self._lock:
+            adopted = self._cursor.adopt(tickets)
+            if adopted:
+                transitions = self._fold(tickets, now)
+        if not adopted:
+            self.sync(now)
+            return
+        self._emit(transitions)
+
+    def _fold(self, tickets: List[Dict[str, Any]], now: Optional[datetime]) -> List[Tuple[Optional[str], Dict[str, Any]]]:
+        """Transitions to publish (none on the first call, which only learns); callers hold the lock"""
+        transitions = self._observe(tickets) + self._sweep(now or datetime.now())
+        emit = self._seeded
+        self._seeded = True
+        return transitions if emit else []
+
+    def _emit(self, transitions: List[Tuple[Optional[str], Dict[str, Any]]]):
+        for old, state in transitions:
+            self._publish(old, state)
+
+    def _conductor(self, bus_id: str) -> Optional[str]:
+        for conductor_id, assignment in assignments_by_conductor.get().items():
+            if assignment.get("bus_number") == bus_id:
+                return conductor_id
+        return None
+
+    def _publish(self, old: Optional[str], state: Dict[str, Any]):
+        """Resolve the previous anomaly alert and raise the new one; at most one active per bus or route"""
+        kind, key, new = state["kind"], state["id"], state["anomaly"]
+        where = {"bus_id": key} if kind == "bus" else {"route_id": key, "bus_id": None}
+        existing = repository.alerts.find(type=ALERT_TYPE, status="ACTIVE", **where)
+        if old is not None and existing:
+            repository.alerts.update_many({alert["id"]: {"status": "RESOLVED"} for alert in existing})
+            existing = []
+        if new is None or existing:
+            return
+        minutes = config.REVENUE_BUCKET_MINUTES
+        subject = f"Bus {key}" if kind == "bus" else f"Route {key}"
+        if new == "DROP":
+            message = (f"{subject}: ticket revenue dropped to ₹{state['revenue']:.0f} in {minutes} min, "
+                       f"expected about ₹{state['expected_revenue']:.0f}. Check the ticketing device.")
+            priority = "HIGH"
+        else:
+            message = (f"{subject}: ticket revenue of ₹{state['revenue']:.0f} in {minutes} min, "
+                       f"well above the usual ₹{state['expected_revenue']:.0f}")
+            priority = "MEDIUM"
+        alert = {
+            "id": generate_id("AUTO"),
+            "timestamp": datetime.now().isoformat(),
+            "sender": "SYSTEM_AI",
+            "type": ALERT_TYPE,
+            "priority": priority,
+            "message": message,
+            "status": "ACTIVE",
+            "anomaly": new,
+            "z_score": state["z_score"],
+            "revenue": state["revenue"],
+            "expected_revenue": state["expected_revenue"],
+            **where,
+        }
+        if kind == "bus":
+            alert["route_id"] = (repository.buses.get(key) or {}).get("route_id")
+            alert["conductor_id"] = self._conductor(key)
+        repository.alerts.insert(alert)
+
+    def anomalies(self) -> List[Dict[str, Any]]:
+        """Buses and routes currently flagged, with their running statistics"""
+        self.sync()
+        with self._lock:
+            flagged = [(kind, key, stats) for (kind, key), stats in self._stats.items() if stats.anomaly]
+            return [
+                {
+                    **stats.describe(kind, key),
+                    "open_bucket_revenue": stats.revenue,
+                    "mean_revenue": round(stats.mean, 2),
+                    "stddev_revenue": round(stats.std(), 2),
+                    "buckets": stats.n,
+                }
+                for kind, key, stats in flagged
+            ]
+
+    def start(self):
+        """Also check when buses report in, so a bus that stops selling is noticed without new tickets"""
+        for filename in (repository.tickets.filename, repository.buses.filename):
+            notifier.subscribe(filename, lambda _: self.sync())
+
+revenue_monitor = RevenueMonitor()
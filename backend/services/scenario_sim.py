@@ -0,0 +1,244 @@
+"""
+What-if simulation of bus reallocations
+
+A FleetSnapshot holds the aggregates the AI engine plans with: buses and
+on-board load per route, standby buses, model features and predictions,
+expected demand and the optimizer's target allocation. Each scenario forks
+the snapshot copy-on-write. The per-route maps become ChainMaps whose writes
+land in a small overlay, so the snapshot is never copied and scenarios never
+see each other's changes.
+
+A scenario replays its actions with the same move rules as apply-allocation
+(services.fleet_optimizer.plan_moves). It then re-scores demand on the
+routes it touched, so the model sees the new bus counts, and projects
+occupancy from the load on board. From SIMULATION_PARALLEL_MIN scenarios
+on they are evaluated in parallel in a process pool; smaller requests run
+inline, where they cost less than the round trip to the pool.
+
+The base snapshot is not sent with every task. It is pickled once into a
+file named by its digest, and pool tasks carry only that key and their
+actions. Each worker loads a snapshot the first time it sees its key and
+keeps the last few, so repeated what-ifs against an unchanged fleet send
+nothing but the actions.
+"""
+
+import asyncio
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from collections import ChainMap, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from services import config, demand_model
+from services.fleet_optimizer import expected_passengers, plan_moves
+
+class FleetSnapshot:
+    """Planning aggregates for the whole fleet at one moment"""
+
+    def __init__(self, counts: Dict[str, int], standby: int, on_board: Dict[str, float],
+                 features: Dict[str, Dict[str, Any]], predictions: Dict[str, float], demand: Dict[str, float],
+                 target: Dict[str, int], capacity: float, bus_capacity: float, min_buses: int = 1):
+        self.counts = counts
+        self.standby = standby
+        self.on_board = on_board
+        self.features = features
+        self.predictions = predictions
+        self.demand = demand
+        self.target = target
+        self.capacity = capacity
+        self.bus_capacity = bus_capacity
+        self.min_buses = min_buses
+
+    def fork(self) -> "FleetSnapshot":
+        """Copy-on-write view: changes to the fork never reach this snapshot"""
+        return FleetSnapshot(
+            ChainMap({}, self.counts), self.standby, self.on_board, self.features,
+            ChainMap({}, self.predictions), ChainMap({}, self.demand), self.target,
+            self.capacity, self.bus_capacity, self.min_buses
+        )
+
+    def move(self, source: Optional[str], destination: Optional[str], count: int):
+        """Move buses between routes (None is the standby pool)"""
+        if source is None:
+            self.standby -= count
+        else:
+            self.counts[source] = self.counts.get(source, 0) - count
+        if destination is None:
+            self.standby += count
+        else:
+            self.counts[destination] = self.counts.get(destination, 0) + count
+
+    def rescore(self, routes: Set[str]):
+        """Re-run the demand model and expected demand for routes whose bus count changed"""
+        scored = [route for route in routes if route in self.features]
+        model = demand_model.load_model() if scored else None
+        if model is not None:
+            rows = [{**self.features[route], "n_trips": self.counts.get(route, 0)} for route in scored]
+            try:
+                self.predictions.update(zip(scored, model.predict(rows)))
+            except Exception as e:
+                print(f"Prediction error: {e}")
+        for route in routes:
+            features = self.features.get(route, {})
+            self.demand[route] = expected_passengers(
+                features.get("demand_1h", 0), features.get("forecast_next_hour", 0.0), self.on_board.get(route, 0.0),
+                self.counts.get(route, 0), self.predictions.get(route, 0), self.capacity
+            )
+
+    def route_metrics(self, route: str) -> Dict[str, Any]:
+        buses = self.counts.get(route, 0)
+        demand = self.demand.get(route, 0.0)
+        on_board = self.on_board.get(route, 0.0)
+        return {
+            "route_id": route,
+            "buses": buses,
+            "expected_demand": round(demand, 1),
+            "overcrowding": round(max(0.0, demand - buses * self.capacity), 1),
+            "projected_occupancy": round(on_board / (buses * self.bus_capacity) * 100, 1) if buses else None,
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        """Fleet-wide service metrics"""
+        routes = set(self.counts) | set(self.demand)
+        in_service = sum(self.counts.values())
+        overcrowding = 0.0
+        overcrowded = unserved = 0
+        peak_occupancy = 0.0
+        for route in routes:
+            buses = self.counts.get(route, 0)
+            demand = self.demand.get(route, 0.0)
+            if demand > buses * self.capacity:
+                overcrowding += demand - buses * self.capacity
+                overcrowded += 1
+            if demand > 0 and buses == 0:
+                unserved += 1
+            if buses:
+                peak_occupancy = max(peak_occupancy, self.on_board.get(route, 0.0) / (buses * self.bus_capacity) * 100)
+        on_board = sum(self.on_board.get(route, 0.0) for route in routes if self.counts.get(route, 0))
+        return {
+            "buses_in_service": in_service,
+            "standby_buses": self.standby,
+            "overcrowding": round(overcrowding, 1),
+            "overcrowded_routes": overcrowded,
+            "unserved_routes": unserved,
+            "average_occupancy": round(on_board / (in_service * self.bus_capacity) * 100, 1) if in_service else 0.0,
+            "peak_route_occupancy": round(peak_occupancy, 1),
+        }
+
+def run_scenario(snapshot: FleetSnapshot, actions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Apply actions to a fork of the snapshot and measure the result"""
+    state = snapshot.fork()
+    moves = []
+    touched: Set[str] = set()
+    for action in actions:
+        planned = plan_moves(action["route_id"], action["action"], abs(action["buses_change"]),
+                             state.counts, state.standby, state.target, state.min_buses,
+                             state.demand, state.capacity)
+        for source, destination, count in planned:
+            state.move(source, destination, count)
+            moves.append({"from_route": source, "to_route": destination, "buses": count})
+            touched.update(route for route in (source, destination) if route is not None)
+    state.rescore(touched)
+    return {
+        "moves": moves,
+        "metrics": state.metrics(),
+        "routes": [
+            {**state.route_metrics(route), "before": snapshot.route_metrics(route)} for route in sorted(touched)
+        ],
+    }
+
+# Snapshot files kept for in-flight requests, and snapshots cached per worker
+SNAPSHOT_FILES = 4
+WORKER_SNAPSHOTS = 2
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_snapshot_dir: Optional[str] = None
+
+# In pool workers: snapshots by key, least recently used first
+_worker_snapshots: "OrderedDict[str, FleetSnapshot]" = OrderedDict()
+
+def _publish(snapshot: FleetSnapshot) -> Tuple[str, str]:
+    """Write the snapshot for the pool workers (once per distinct snapshot); returns (directory, key)"""
+    global _snapshot_dir
+    payload = pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+    key = hashlib.blake2b(payload, digest_size=16).hexdigest()
+    with _pool_lock:
+        if _snapshot_dir is None:
+            _snapshot_dir = tempfile.mkdtemp(prefix="routesaathi-scenarios-")
+        directory = _snapshot_dir
+    path = os.path.join(directory, f"{key}.pkl")
+    if os.path.exists(path):
+        os.utime(path)
+        return directory, key
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+    # Keep the newest few for requests still running
+    files = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith(".pkl")),
+        key=lambda entry: entry.stat().st_mtime_ns, reverse=True
+    )
+    for entry in files[SNAPSHOT_FILES:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+    return directory, key
+
+def _run_published(directory: str, key: str, actions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Pool task: run a scenario against a published snapshot, loading it on first use"""
+    snapshot = _worker_snapshots.get(key)
+    if snapshot is None:
+        with open(os.path.join(directory, f"{key}.pkl"), "rb") as f:
+            snapshot = pickle.load(f)
+        _worker_snapshots[key] = snapshot
+        while len(_worker_snapshots) > WORKER_SNAPSHOTS:
+            _worker_snapshots.popitem(last=False)
+    else:
+        _worker_snapshots.move_to_end(key)
+    return run_scenario(snapshot, actions)
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: never fork a server process that has threads running
+            _pool = ProcessPoolExecutor(max_workers=config.SIMULATION_WORKERS, mp_context=get_context("spawn"))
+        return _pool
+
+def shutdown():
+    """Stop the worker pool and remove published snapshots"""
+    global _pool, _snapshot_dir
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _snapshot_dir is not None:
+            shutil.rmtree(_snapshot_dir, ignore_errors=True)
+            _snapshot_dir = None
+
+async def simulate(snapshot: FleetSnapshot, scenarios: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Run scenarios, in parallel worker processes when there are enough of them"""
+    if len(scenarios) < max(2, config.SIMULATION_PARALLEL_MIN) or config.SIMULATION_WORKERS < 2:
+        return [run_scenario(snapshot, actions) for actions in scenarios]
+    loop = asyncio.get_running_loop()
+    try:
+        directory, key = _publish(snapshot)
+        pool = _executor()
+        return list(await asyncio.gather(
+            *(loop.run_in_executor(pool, _run_published, directory, key, actions) for actions in scenarios)
+        ))
+    except BrokenProcessPool as e:
+        print(f"Simulation pool failed, running inline: {e}")
+        shutdown()
+    except OSError as e:
+        print(f"Simulation snapshot unavailable, running inline: {e}")
+    return [run_scenario(snapshot, actions) for actions in scenarios]
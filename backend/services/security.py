@@ -0,0 +1,185 @@
+"""
+Password hashing and session tokens
+
+- Passwords are stored as bcrypt hashes ("password_hash"); legacy plaintext
+  "password" records are upgraded in place on their first successful login.
+- Bcrypt runs in the threadpool so login bursts never stall the event loop.
+- Sessions are stateless HS256 JWTs. Decoded tokens are kept in a bounded LRU
+  keyed by the raw token, so verifying a repeat caller is a dict lookup.
+"""
+
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwt
+from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+
+from services import config, repository
+
+JWT_ALGORITHM = "HS256"
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=config.BCRYPT_ROUNDS)
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+def _load_secret() -> str:
+    """
+    JWT signing secret. Taken from ROUTESAATHI_JWT_SECRET, otherwise generated
+    once per host into the data directory so every worker signs alike.
+    """
+    if config.JWT_SECRET:
+        return config.JWT_SECRET
+    path = os.path.join(config.DATA_DIR, ".jwt_secret")
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_urlsafe(48))
+    except FileExistsError:
+        pass
+    with open(path, "r") as f:
+        return f.read().strip()
+
+_secret: Optional[str] = None
+_dummy_hash: Optional[str] = None
+
+def get_secret() -> str:
+    global _secret
+    if _secret is None:
+        _secret = _load_secret()
+    return _secret
+
+def hash_password(password: str) -> str:
+    """Hash a password with bcrypt"""
+    return pwd_context.hash(password)
+
+def _reject(password: str) -> bool:
+    """
+    Burn one bcrypt verification on a dummy hash, so failed logins for
+    unknown emails take as long as those for known ones
+    """
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_urlsafe(16))
+    pwd_context.verify(password, _dummy_hash)
+    return False
+
+def _verify_user_password(user: Optional[Dict[str, Any]], password: str) -> bool:
+    """Blocking credential check for one user record (None = unknown user)"""
+    if user is None:
+        return _reject(password)
+    if user.get("password_hash"):
+        return pwd_context.verify(password, user["password_hash"])
+    legacy = user.get("password")
+    if legacy is None or not hmac.compare_digest(str(legacy).encode(), password.encode()):
+        return _reject(password)
+    # Upgrade the legacy plaintext record to a bcrypt hash (a single-record
+    # update, so concurrent writes to other users are kept)
+    repository.users.update(user["id"], {"password": None, "password_hash": hash_password(password)})
+    return True
+
+async def verify_user_password(user: Optional[Dict[str, Any]], password: str) -> bool:
+    """Check a password off the event loop"""
+    return await run_in_threadpool(_verify_user_password, user, password)
+
+def public_user(user: Dict[str, Any]) -> Dict[str, Any]:
+    """User record without credential fields"""
+    return {k: v for k, v in user.items() if k not in ("password", "password_hash")}
+
+def create_access_token(user: Dict[str, Any]) -> Tuple[str, int]:
+    """Issue a signed session token; returns (token, lifetime in seconds)"""
+    lifetime = config.TOKEN_TTL_MINUTES * 60
+    now = int(time.time())
+    claims = {
+        "sub": user["id"],
+        "name": user.get("name"),
+        "email": user.get("email"),
+        "role": user.get("role"),
+        "iat": now,
+        "exp": now + lifetime,
+    }
+    return jwt.encode(claims, get_secret(), algorithm=JWT_ALGORITHM), lifetime
+
+class TokenCache:
+    """Thread-safe bounded LRU of decoded token claims"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            claims = self._items.get(token)
+            if claims is None:
+                self.misses += 1
+                return None
+            if claims["exp"] <= time.time():
+                del self._items[token]
+                self.misses += 1
+                return None
+            self._items.move_to_end(token)
+            self.hits += 1
+            return claims
+
+    def put(self, token: str, claims: Dict[str, Any]):
+        with self._lock:
+            self._items[token] = claims
+            self._items.move_to_end(token)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+token_cache = TokenCache(config.TOKEN_CACHE_SIZE)
+
+def decode_token(token: str) -> Dict[str, Any]:
+    """Verify a token, using the LRU for tokens seen before"""
+    claims = token_cache.get(token)
+    if claims is not None:
+        return claims
+    try:
+        claims = jwt.decode(token, get_secret(), algorithms=[JWT_ALGORITHM])
+    except JWTError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    token_cache.put(token, claims)
+    return claims
+
+async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)) -> Optional[Dict[str, Any]]:
+    """
+    Dependency returning the caller's token claims. Rejects unauthenticated
+    requests unless ROUTESAATHI_AUTH_REQUIRED is disabled, in which case
+    anonymous callers get None.
+    """
+    if credentials is None:
+        if not config.AUTH_REQUIRED:
+            return None
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return decode_token(credentials.credentials)
+
+def require_role(*roles: str):
+    """Dependency factory restricting an endpoint to the given roles"""
+    async def check(user: Optional[Dict[str, Any]] = Depends(get_current_user)) -> Optional[Dict[str, Any]]:
+        if user is not None and user.get("role") not in roles:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Insufficient permissions")
+        return user
+    return check
@@ -0,0 +1,110 @@
+"""
+Shared state for multi-worker deployments
+
+When uvicorn runs with --workers N every process has its own memory, so any
+state kept in module-level dicts diverges between workers. Shared state
+therefore lives in the storage engine, and each worker keeps only derived,
+read-optimised views of it that are revalidated against the collection's
+version token (see StorageEngine.version) before use.
+
+    SharedView      - cached index over a collection, rebuilt when any worker
+                      writes the collection (read-your-writes across workers)
+    ChangeNotifier  - background poller that calls subscribers when a
+                      collection changes in any process on the host
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from services import config
+from services.storage import get_engine
+
+class SharedView:
+    """Per-process cache of a derived view over one collection"""
+
+    def __init__(self, filename: str, build: Callable[[List[Dict[str, Any]]], Any]):
+        self.filename = filename
+        self._build = build
+        self._lock = threading.Lock()
+        self._version: Any = object()
+        self._value: Any = None
+
+    def get(self) -> Any:
+        """Current view, rebuilt if the collection changed since the last build"""
+        version = get_engine().version(self.filename)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._value = self._build(get_engine().read_all(self.filename))
+                    self._version = version
+        return self._value
+
+    def invalidate(self):
+        """Force a rebuild on next access"""
+        self._version = object()
+
+class ChangeNotifier:
+    """
+    Polls collection versions and notifies subscribers of changes made by any
+    worker process. Polling a version token is a stat() for the JSON engine
+    and one indexed lookup for SQLite, so a short interval is cheap.
+    """
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self._subscribers: Dict[str, List[Callable[[str], None]]] = {}
+        self._versions: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, filename: str, callback: Callable[[str], None]):
+        """Call callback(filename) whenever the collection changes"""
+        with self._lock:
+            if filename not in self._versions:
+                self._versions[filename] = get_engine().version(filename)
+            self._subscribers.setdefault(filename, []).append(callback)
+
+    def poll(self) -> List[str]:
+        """Check every watched collection once; returns the ones that changed"""
+        changed = []
+        with self._lock:
+            watched = list(self._subscribers.items())
+        for filename, callbacks in watched:
+            version = get_engine().version(filename)
+            if version == self._versions.get(filename):
+                continue
+            self._versions[filename] = version
+            changed.append(filename)
+            for callback in callbacks:
+                try:
+                    callback(filename)
+                except Exception as e:
+                    print(f"Change subscriber for {filename} failed: {e}")
+        return changed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def start(self):
+        """Start the background poller (idempotent)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="change-notifier", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background poller"""
+        self._stop.set()
+
+notifier = ChangeNotifier(interval=config.CHANGE_POLL_INTERVAL)
+
+def _index_by(field: str) -> Callable[[List[Dict[str, Any]]], Dict[Any, Dict[str, Any]]]:
+    def build(items: List[Dict[str, Any]]) -> Dict[Any, Dict[str, Any]]:
+        return {item[field]: item for item in items if item.get(field) is not None}
+    return build
+
+users_by_id = SharedView("users.json", _index_by("id"))
+users_by_email = SharedView("users.json", _index_by("email"))
+assignments_by_conductor = SharedView("assignments.json", _index_by("conductor_id"))
@@ -0,0 +1,909 @@
+"""
+Pluggable storage engines behind the data_utils / repository interface
+
+Collections are named after their data files ("buses.json" -> "buses").
+Two engines are available, selected with ROUTESAATHI_STORAGE:
+
+    json    - one JSON array file per collection (default, original format)
+    sqlite  - one table per collection in a WAL-mode SQLite database
+
+Filters are given as a dict of field lookups, Django style:
+    {"status": "MOVING", "occupancy_percent__gt": 80, "type__iexact": "sos"}
+Supported lookups: eq (default), ne, gt, gte, lt, lte, in, iexact.
+Grouping also accepts "timestamp__hour" to bucket ISO timestamps by hour.
+
+find_page() adds keyset pagination and field projection: a page is resumed
+from the (sort value, insertion position) of the last item returned, so
+deep pages cost the same as the first and stay stable under appends.
+
+Every engine exposes version(collection), a token that changes whenever any
+process on the host writes the collection. It is the basis for cross-worker
+cache invalidation (see services.shared_state).
+"""
+
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Sequence, Tuple
+
+from services import config
+from services.metrics import STORAGE_BYTES, STORAGE_LOCK_WAIT, STORAGE_SECONDS
+
+# Primary key field of each collection (defaults to "id")
+COLLECTION_KEYS = {
+    "tickets": "tid",
+    "assignments": "conductor_id",
+}
+
+# Fields stored as real, indexed columns in the SQLite backend
+INDEXED_FIELDS = ("route_id", "bus_id", "status", "type", "timestamp")
+
+# Column layout of every SQLite collection table (plus the seq rowid)
+COLUMNS = ("pk",) + INDEXED_FIELDS + ("body",)
+
+LOOKUPS = ("eq", "ne", "gt", "gte", "lt", "lte", "in", "iexact")
+
+# Transforms only valid in grouping expressions
+GROUP_TRANSFORMS = ("hour",)
+
+# Per-thread (version before, version after) of each engine's last write to a collection
+_thread_writes = threading.local()
+
+FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+def collection_name(filename: str) -> str:
+    """Map a data file name to its collection name"""
+    return os.path.splitext(os.path.basename(filename))[0]
+
+def primary_key(collection: str) -> str:
+    """Get the primary key field for a collection"""
+    return COLLECTION_KEYS.get(collection_name(collection), "id")
+
+def parse_lookup(expression: str, group: bool = False) -> Tuple[str, str]:
+    """Split "field__op" into (field, op)"""
+    field, _, op = expression.partition("__")
+    op = op or "eq"
+    allowed = GROUP_TRANSFORMS + ("eq",) if group else LOOKUPS
+    if op not in allowed:
+        raise ValueError(f"Unsupported lookup: {expression}")
+    if not FIELD_PATTERN.match(field):
+        raise ValueError(f"Invalid field name: {field}")
+    return field, op
+
+def _timestamp_hour(value: Any) -> Optional[int]:
+    """Hour of an ISO timestamp, or None if it cannot be parsed"""
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "")).hour
+    except (TypeError, ValueError):
+        return None
+
+def _group_value(item: Dict[str, Any], expression: str) -> Any:
+    """Value of a grouping expression for one item"""
+    field, op = parse_lookup(expression, group=True)
+    value = item.get(field)
+    if op == "hour":
+        return _timestamp_hour(value) if value else None
+    return value
+
+def _compare(value: Any, op: str, target: Any) -> bool:
+    """Apply a single lookup to a value"""
+    if op == "eq":
+        return value == target
+    if op == "ne":
+        return value != target
+    if op == "in":
+        return value in target
+    if op == "iexact":
+        return value is not None and str(value).upper() == str(target).upper()
+    if value is None:
+        return False
+    try:
+        if op == "gt":
+            return value > target
+        if op == "gte":
+            return value >= target
+        if op == "lt":
+            return value < target
+        if op == "lte":
+            return value <= target
+    except TypeError:
+        return False
+    return False
+
+def matches(item: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """Check whether an item satisfies every lookup in a filter"""
+    if not where:
+        return True
+    for expression, target in where.items():
+        field, op = parse_lookup(expression)
+        if not _compare(item.get(field), op, target):
+            return False
+    return True
+
+def _sort_key(field: str):
+    """Sort key putting missing values first, like SQL NULLs"""
+    def key(item: Dict[str, Any]):
+        value = item.get(field)
+        return (value is not None, value if value is not None else 0)
+    return key
+
+def project(item: Dict[str, Any], fields: Optional[Sequence[str]]) -> Dict[str, Any]:
+    """Keep only the given fields of an item (all fields when None)"""
+    if fields is None:
+        return item
+    return {field: item[field] for field in fields if field in item}
+
+def _projection(collection: str, fields: Optional[Sequence[str]]) -> Optional[List[str]]:
+    """Validated projection that always includes the primary key"""
+    if fields is None:
+        return None
+    key = primary_key(collection)
+    selected = [key]
+    for field in fields:
+        if not FIELD_PATTERN.match(field):
+            raise ValueError(f"Invalid field name: {field}")
+        if field not in selected:
+            selected.append(field)
+    return selected
+
+def _is_after(sort_key: Any, position: int, cursor_key: Any, cursor_position: int, descending: bool) -> bool:
+    """Whether (sort_key, position) comes after the cursor in a keyset ordering"""
+    if sort_key != cursor_key:
+        return sort_key < cursor_key if descending else sort_key > cursor_key
+    return position > cursor_position
+
+class StorageEngine:
+    """
+    Base storage engine. Every query method has a generic implementation on
+    top of read_all/write_all; engines override them with native versions.
+    """
+
+    name = "base"
+
+    def read_all(self, collection: str) -> List[Dict[str, Any]]:
+        """Read every item of a collection in insertion order"""
+        raise NotImplementedError
+
+    def write_all(self, collection: str, items: List[Dict[str, Any]]) -> bool:
+        """Replace the contents of a collection"""
+        raise NotImplementedError
+
+    def version(self, collection: str) -> Any:
+        """Opaque token that changes whenever the collection is written by any process"""
+        raise NotImplementedError
+
+    def last_write(self, collection: str) -> Optional[Tuple[Any, Any]]:
+        """
+        (version before, version after) of the last write this thread made to
+        a collection. Both are read under the write lock, so no other write
+        falls between them.
+        """
+        versions = getattr(_thread_writes, "versions", None)
+        return versions.get((id(self), collection_name(collection))) if versions else None
+
+    def _record_write(self, collection: str, before: Any, after: Any):
+        if not hasattr(_thread_writes, "versions"):
+            _thread_writes.versions = {}
+        _thread_writes.versions[(id(self), collection_name(collection))] = (before, after)
+
+    def insert(self, collection: str, items: List[Dict[str, Any]]) -> bool:
+        """Append items to a collection"""
+        data = self.read_all(collection)
+        data.extend(items)
+        return self.write_all(collection, data)
+
+    def update(self, collection: str, field: str, value: Any, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Update the first item whose field equals value; returns the updated item"""
+        data = self.read_all(collection)
+        for item in data:
+            if item.get(field) == value:
+                item.update(updates)
+                return item if self.write_all(collection, data) else None
+        return None
+
+    def update_many(self, collection: str, updates_by_key: Dict[Any, Dict[str, Any]]) -> int:
+        """Apply per-item updates keyed by primary key; returns the number updated"""
+        if not updates_by_key:
+            return 0
+        key = primary_key(collection)
+        data = self.read_all(collection)
+        updated = 0
+        for item in data:
+            updates = updates_by_key.get(item.get(key))
+            if updates:
+                item.update(updates)
+                updated += 1
+        if updated:
+            self.write_all(collection, data)
+        return updated
+
+    def delete(self, collection: str, field: str, value: Any) -> bool:
+        """Delete every item whose field equals value"""
+        data = self.read_all(collection)
+        filtered = [item for item in data if item.get(field) != value]
+        if len(filtered) != len(data):
+            return self.write_all(collection, filtered)
+        return False
+
+    def take(self, collection: str, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Remove every matching item and return them, in insertion order"""
+        data = self.read_all(collection)
+        taken = [item for item in data if matches(item, where)]
+        if taken and not self.write_all(collection, [item for item in data if not matches(item, where)]):
+            return []
+        return taken
+
+    def find(self, collection: str, where: Optional[Dict[str, Any]] = None, order_by: Optional[str] = None,
+             descending: bool = False, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        """Filter, sort and slice a collection (insertion order when order_by is None)"""
+        results = [item for item in self.read_all(collection) if matches(item, where)]
+        if order_by:
+            results.sort(key=_sort_key(order_by), reverse=descending)
+        elif descending:
+            results.reverse()
+        end = offset + limit if limit is not None else None
+        return results[offset:end]
+
+    def scan(self, collection: str, where: Optional[Dict[str, Any]] = None,
+             chunk_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """Matching items in insertion order, a chunk at a time"""
+        items = [item for item in self.read_all(collection) if matches(item, where)]
+        for start in range(0, len(items), chunk_size):
+            yield items[start:start + chunk_size]
+
+    def find_page(self, collection: str, where: Optional[Dict[str, Any]] = None, order_by: Optional[str] = None,
+                  descending: bool = False, limit: Optional[int] = None, after: Optional[Sequence[Any]] = None,
+                  fields: Optional[Sequence[str]] = None) -> Tuple[List[Dict[str, Any]], Optional[List[Any]]]:
+        """
+        One keyset page in find() order. `after` is the position returned with
+        the previous page; the returned position is None on the last page.
+        Positions are [sort value, insertion position] ([None, insertion
+        position] without order_by).
+        """
+        fields = _projection(collection, fields)
+        rows = [(position, item) for position, item in enumerate(self.read_all(collection), 1) if matches(item, where)]
+        if order_by:
+            value_key = _sort_key(order_by)
+            # Stable sort: ties stay in insertion order, as in find()
+            rows.sort(key=lambda row: value_key(row[1]), reverse=descending)
+        elif descending:
+            rows.reverse()
+        if after is not None:
+            cursor_value, cursor_position = after
+            if order_by:
+                cursor_key = value_key({order_by: cursor_value})
+                try:
+                    rows = [row for row in rows if _is_after(value_key(row[1]), row[0], cursor_key, cursor_position, descending)]
+                except TypeError:
+                    raise ValueError("Cursor does not match this query")
+            else:
+                rows = [row for row in rows if (row[0] < cursor_position if descending else row[0] > cursor_position)]
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
+        next_after = None
+        if has_more and rows:
+            position, item = rows[-1]
+            next_after = [item.get(order_by) if order_by else None, position]
+        return [project(item, fields) for _, item in rows], next_after
+
+    def count(self, collection: str, where: Optional[Dict[str, Any]] = None) -> int:
+        """Count items matching a filter"""
+        return sum(1 for item in self.read_all(collection) if matches(item, where))
+
+    def sum(self, collection: str, field: str, where: Optional[Dict[str, Any]] = None):
+        """Sum a numeric field over matching items"""
+        return sum(item.get(field) or 0 for item in self.read_all(collection) if matches(item, where))
+
+    def group_count(self, collection: str, group: str, where: Optional[Dict[str, Any]] = None) -> Dict[Any, int]:
+        """Count matching items per distinct group value (None groups are skipped)"""
+        counts: Dict[Any, int] = {}
+        for item in self.read_all(collection):
+            if matches(item, where):
+                value = _group_value(item, group)
+                if value is not None:
+                    counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    def group_sum(self, collection: str, group: str, field: str, where: Optional[Dict[str, Any]] = None) -> Dict[Any, Any]:
+        """Sum a numeric field per distinct group value (None groups are skipped)"""
+        totals: Dict[Any, Any] = {}
+        for item in self.read_all(collection):
+            if matches(item, where):
+                value = _group_value(item, group)
+                if value is not None:
+                    totals[value] = totals.get(value, 0) + (item.get(field) or 0)
+        return totals
+
+class JsonStorage(StorageEngine):
+    """
+    One pretty-printed JSON array file per collection (the original format).
+
+    Files are replaced atomically, so readers in other processes never see a
+    half-written file, and read-modify-write mutations hold an exclusive
+    lock file per collection (where fcntl is available).
+    """
+
+    name = "json"
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self._thread_locks: Dict[str, threading.RLock] = {}
+
+    def path(self, collection: str) -> str:
+        """Get the file path of a collection"""
+        return os.path.join(self.data_dir, f"{collection_name(collection)}.json")
+
+    @contextmanager
+    def _locked(self, collection: str):
+        """Serialise mutations of a collection across threads and processes"""
+        name = collection_name(collection)
+        thread_lock = self._thread_locks.setdefault(name, threading.RLock())
+        waiting_since = time.perf_counter()
+        with thread_lock:
+            try:
+                import fcntl
+            except ImportError:
+                STORAGE_LOCK_WAIT.labels(name).observe(time.perf_counter() - waiting_since)
+                before = self.version(collection)
+                yield
+                self._record_write(collection, before, self.version(collection))
+                return
+            with open(os.path.join(self.data_dir, f".{name}.lock"), "a") as handle:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+                STORAGE_LOCK_WAIT.labels(name).observe(time.perf_counter() - waiting_since)
+                try:
+                    before = self.version(collection)
+                    yield
+                    self._record_write(collection, before, self.version(collection))
+                finally:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+    def version(self, collection: str) -> Any:
+        try:
+            stat = os.stat(self.path(collection))
+        except FileNotFoundError:
+            return None
+        # Atomic replaces give every write a new inode, even within one mtime tick
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def insert(self, collection: str, items: List[Dict[str, Any]]) -> bool:
+        with self._locked(collection):
+            return super().insert(collection, items)
+
+    def update(self, collection: str, field: str, value: Any, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self._locked(collection):
+            return super().update(collection, field, value, updates)
+
+    def update_many(self, collection: str, updates_by_key: Dict[Any, Dict[str, Any]]) -> int:
+        with self._locked(collection):
+            return super().update_many(collection, updates_by_key)
+
+    def delete(self, collection: str, field: str, value: Any) -> bool:
+        with self._locked(collection):
+            return super().delete(collection, field, value)
+
+    def take(self, collection: str, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        with self._locked(collection):
+            return super().take(collection, where)
+
+    def read_all(self, collection: str) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        try:
+            with open(self.path(collection), 'rb') as f:
+                raw = f.read()
+            items = json.loads(raw)
+        except FileNotFoundError:
+            return []
+        except json.JSONDecodeError:
+            return []
+        name = collection_name(collection)
+        STORAGE_SECONDS.labels(self.name, "read", name).observe(time.perf_counter() - started)
+        STORAGE_BYTES.labels("read", name).observe(len(raw))
+        return items
+
+    def write_all(self, collection: str, items: List[Dict[str, Any]]) -> bool:
+        path = self.path(collection)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, prefix=".tmp-", suffix=".json")
+            try:
+                started = time.perf_counter()
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(items, f, indent=2, ensure_ascii=False)
+                    size = f.tell()
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            name = collection_name(collection)
+            STORAGE_SECONDS.labels(self.name, "write", name).observe(time.perf_counter() - started)
+            STORAGE_BYTES.labels("write", name).observe(size)
+            return True
+        except Exception as e:
+            print(f"Error writing to {collection}: {e}")
+            return False
+
+class SQLiteStorage(StorageEngine):
+    """
+    One table per collection in a single SQLite database.
+
+    Every item is stored as a JSON body plus copies of the INDEXED_FIELDS as
+    real columns so filters, grouping and ordering on them hit an index.
+    Other fields are reached through json_extract. Connections are opened
+    per thread in WAL mode, so readers never block the single writer, and
+    all statements are parameterised so sqlite3 reuses prepared statements.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str, data_dir: Optional[str] = None):
+        self.db_path = db_path
+        self.data_dir = data_dir
+        self._local = threading.local()
+        self._tables = set()
+        self._tables_lock = threading.Lock()
+        if data_dir and not self._get_meta("json_migrated"):
+            migrate_from_json(self, data_dir)
+
+    def connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS collection_versions (collection TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self.connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        self.connection().execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def table(self, collection: str) -> str:
+        """Get the (created on demand) table name for a collection"""
+        name = collection_name(collection)
+        if not FIELD_PATTERN.match(name):
+            raise ValueError(f"Invalid collection name: {collection}")
+        if name not in self._tables:
+            with self._tables_lock:
+                if name not in self._tables:
+                    self._create_table(name)
+                    self._tables.add(name)
+        return name
+
+    def _create_table(self, name: str):
+        columns = ", ".join(INDEXED_FIELDS)
+        conn = self.connection()
+        conn.execute(
+            f'CREATE TABLE IF NOT EXISTS "{name}" ('
+            f'seq INTEGER PRIMARY KEY AUTOINCREMENT, pk, {columns}, body TEXT NOT NULL)'
+        )
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{name}_pk" ON "{name}" (pk)')
+        for field in INDEXED_FIELDS:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{name}_{field}" ON "{name}" ({field})')
+
+    def _row(self, collection: str, item: Dict[str, Any]) -> tuple:
+        """Column values for one item: pk, indexed fields, JSON body"""
+        key = primary_key(collection)
+        return (item.get(key), *(item.get(field) for field in INDEXED_FIELDS), json.dumps(item, ensure_ascii=False))
+
+    def _column(self, collection: str, field: str) -> str:
+        """SQL expression for a field"""
+        if not FIELD_PATTERN.match(field):
+            raise ValueError(f"Invalid field name: {field}")
+        if field == primary_key(collection):
+            return "pk"
+        if field in INDEXED_FIELDS:
+            return field
+        return f"json_extract(body, '$.{field}')"
+
+    def _where(self, collection: str, where: Optional[Dict[str, Any]]) -> Tuple[str, list]:
+        """Translate a lookup filter into a WHERE clause and parameters"""
+        if not where:
+            return "", []
+        clauses, params = [], []
+        for expression, target in where.items():
+            field, op = parse_lookup(expression)
+            column = self._column(collection, field)
+            if op == "eq":
+                if target is None:
+                    clauses.append(f"{column} IS NULL")
+                else:
+                    clauses.append(f"{column} = ?")
+                    params.append(target)
+            elif op == "ne":
+                if target is None:
+                    clauses.append(f"{column} IS NOT NULL")
+                else:
+                    clauses.append(f"({column} IS NULL OR {column} != ?)")
+                    params.append(target)
+            elif op == "in":
+                values = list(target)
+                if not values:
+                    clauses.append("0")
+                else:
+                    clauses.append(f"{column} IN ({', '.join('?' for _ in values)})")
+                    params.extend(values)
+            elif op == "iexact":
+                clauses.append(f"UPPER({column}) = UPPER(?)")
+                params.append(target)
+            else:
+                symbol = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}[op]
+                clauses.append(f"{column} {symbol} ?")
+                params.append(target)
+        return " WHERE " + " AND ".join(clauses), params
+
+    def _group_column(self, collection: str, group: str) -> str:
+        field, op = parse_lookup(group, group=True)
+        column = self._column(collection, field)
+        if op == "hour":
+            # ISO "YYYY-MM-DDTHH..." -> HH
+            return f"CASE WHEN {column} GLOB '????-??-??[T ]??*' THEN CAST(substr({column}, 12, 2) AS INTEGER) END"
+        return column
+
+    def _query(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        return self.connection().execute(sql, tuple(params)).fetchall()
+
+    def version(self, collection: str) -> Any:
+        row = self.connection().execute(
+            "SELECT version FROM collection_versions WHERE collection = ?", (collection_name(collection),)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _bump_version(self, conn: sqlite3.Connection, collection: str):
+        """Increment a collection's version inside the writing transaction"""
+        conn.execute(
+            "INSERT INTO collection_versions (collection, version) VALUES (?, 1) "
+            "ON CONFLICT(collection) DO UPDATE SET version = version + 1",
+            (collection_name(collection),),
+        )
+
+    def read_all(self, collection: str) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        table = self.table(collection)
+        items = [json.loads(body) for (body,) in self._query(f'SELECT body FROM "{table}" ORDER BY seq')]
+        STORAGE_SECONDS.labels(self.name, "read", collection_name(collection)).observe(time.perf_counter() - started)
+        return items
+
+    def find(self, collection: str, where: Optional[Dict[str, Any]] = None, order_by: Optional[str] = None,
+             descending: bool = False, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        table = self.table(collection)
+        clause, params = self._where(collection, where)
+        direction = "DESC" if descending else "ASC"
+        if order_by:
+            ordering = f"{self._column(collection, order_by)} {direction}, seq ASC"
+        else:
+            ordering = f"seq {direction}"
+        sql = f'SELECT body FROM "{table}"{clause} ORDER BY {ordering}'
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params = params + [limit if limit is not None else -1, offset]
+        return [json.loads(body) for (body,) in self._query(sql, params)]
+
+    def scan(self, collection: str, where: Optional[Dict[str, Any]] = None,
+             chunk_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        table = self.table(collection)
+        clause, params = self._where(collection, where)
+        clause = f"{clause} AND seq > ?" if clause else " WHERE seq > ?"
+        last = 0
+        while True:
+            # Keyset on seq: each chunk is one short indexed query, nothing stays open in between
+            rows = self._query(f'SELECT seq, body FROM "{table}"{clause} ORDER BY seq LIMIT ?', params + [last, chunk_size])
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [json.loads(body) for _, body in rows]
+
+    def find_page(self, collection: str, where: Optional[Dict[str, Any]] = None, order_by: Optional[str] = None,
+                  descending: bool = False, limit: Optional[int] = None, after: Optional[Sequence[Any]] = None,
+                  fields: Optional[Sequence[str]] = None) -> Tuple[List[Dict[str, Any]], Optional[List[Any]]]:
+        table = self.table(collection)
+        fields = _projection(collection, fields)
+        clause, params = self._where(collection, where)
+        column = self._column(collection, order_by) if order_by else "NULL"
+        if after is not None:
+            cursor_value, cursor_position = after
+            if not order_by:
+                keyset = "seq < ?" if descending else "seq > ?"
+                keyset_params = [cursor_position]
+            elif cursor_value is None:
+                # NULLs sort first ascending and last descending
+                if descending:
+                    keyset = f"({column} IS NULL AND seq > ?)"
+                    keyset_params = [cursor_position]
+                else:
+                    keyset = f"({column} IS NOT NULL OR seq > ?)"
+                    keyset_params = [cursor_position]
+            elif descending:
+                keyset = f"({column} < ? OR {column} IS NULL OR ({column} = ? AND seq > ?))"
+                keyset_params = [cursor_value, cursor_value, cursor_position]
+            else:
+                keyset = f"({column} > ? OR ({column} = ? AND seq > ?))"
+                keyset_params = [cursor_value, cursor_value, cursor_position]
+            clause = f"{clause} AND {keyset}" if clause else f" WHERE {keyset}"
+            params = params + keyset_params
+        direction = "DESC" if descending else "ASC"
+        ordering = f"{column} {direction}, seq ASC" if order_by else f"seq {direction}"
+        sql = f'SELECT seq, {column}, body FROM "{table}"{clause} ORDER BY {ordering}'
+        if limit is not None:
+            # One extra row tells whether another page exists
+            sql += " LIMIT ?"
+            params = params + [limit + 1]
+        rows = self._query(sql, params)
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
+        next_after = [rows[-1][1], rows[-1][0]] if has_more and rows else None
+        return [project(json.loads(body), fields) for _, _, body in rows], next_after
+
+    def count(self, collection: str, where: Optional[Dict[str, Any]] = None) -> int:
+        table = self.table(collection)
+        clause, params = self._where(collection, where)
+        return self._query(f'SELECT COUNT(*) FROM "{table}"{clause}', params)[0][0]
+
+    def sum(self, collection: str, field: str, where: Optional[Dict[str, Any]] = None):
+        table = self.table(collection)
+        clause, params = self._where(collection, where)
+        column = self._column(collection, field)
+        return self._query(f'SELECT COALESCE(SUM({column}), 0) FROM "{table}"{clause}', params)[0][0]
+
+    def group_count(self, collection: str, group: str, where: Optional[Dict[str, Any]] = None) -> Dict[Any, int]:
+        table = self.table(collection)
+        clause, params = self._where(collection, where)
+        column = self._group_column(collection, group)
+        rows = self._query(f'SELECT {column} AS g, COUNT(*) FROM "{table}"{clause} GROUP BY g ORDER BY MIN(seq)', params)
+        return {value: count for value, count in rows if value is not None}
+
+    def group_sum(self, collection: str, group: str, field: str, where: Optional[Dict[str, Any]] = None) -> Dict[Any, Any]:
+        table = self.table(collection)
+        clause, params = self._where(collection, where)
+        column = self._group_column(collection, group)
+        value = self._column(collection, field)
+        rows = self._query(
+            f'SELECT {column} AS g, COALESCE(SUM({value}), 0) FROM "{table}"{clause} GROUP BY g ORDER BY MIN(seq)', params
+        )
+        return {group_value: total for group_value, total in rows if group_value is not None}
+
+    def _transaction(self, collection: str):
+        return _Transaction(self, collection)
+
+    def _insert_rows(self, conn: sqlite3.Connection, collection: str, items: List[Dict[str, Any]]):
+        table = self.table(collection)
+        conn.executemany(
+            f'INSERT INTO "{table}" ({", ".join(COLUMNS)}) VALUES ({", ".join("?" for _ in COLUMNS)})',
+            [self._row(collection, item) for item in items],
+        )
+
+    def _update_rows(self, conn: sqlite3.Connection, collection: str, rows: List[Tuple[int, Dict[str, Any]]]):
+        table = self.table(collection)
+        conn.executemany(
+            f'UPDATE "{table}" SET {", ".join(f"{c} = ?" for c in COLUMNS)} WHERE seq = ?',
+            [self._row(collection, item) + (seq,) for seq, item in rows],
+        )
+
+    def write_all(self, collection: str, items: List[Dict[str, Any]]) -> bool:
+        """
+        Replace a collection. Rows are diffed by primary key so unchanged
+        rows are not rewritten and surviving rows keep their position.
+        """
+        table = self.table(collection)
+        key = primary_key(collection)
+        try:
+            with self._transaction(collection) as conn:
+                existing = conn.execute(f'SELECT seq, pk, body FROM "{table}" ORDER BY seq').fetchall()
+                keys = [item.get(key) for item in items]
+                key_set = set(keys)
+                existing_keys = [pk for _, pk, _ in existing]
+                existing_set = set(existing_keys)
+                unique = None not in key_set and len(key_set) == len(keys) and len(existing_set) == len(existing_keys)
+                # An in-place diff is only possible if surviving rows keep their relative order
+                if not unique or [pk for pk in existing_keys if pk in key_set] != [pk for pk in keys if pk in existing_set]:
+                    conn.execute(f'DELETE FROM "{table}"')
+                    self._insert_rows(conn, collection, items)
+                    self._bump_version(conn, collection)
+                    return True
+                incoming = dict(zip(keys, items))
+                removed = [(seq,) for seq, pk, _ in existing if pk not in key_set]
+                changed = [
+                    (seq, incoming[pk]) for seq, pk, body in existing
+                    if pk in key_set and json.dumps(incoming[pk], ensure_ascii=False) != body
+                ]
+                added = [item for item in items if item.get(key) not in existing_set]
+                conn.executemany(f'DELETE FROM "{table}" WHERE seq = ?', removed)
+                self._update_rows(conn, collection, changed)
+                self._insert_rows(conn, collection, added)
+                if removed or changed or added:
+                    self._bump_version(conn, collection)
+            return True
+        except sqlite3.Error as e:
+            print(f"Error writing to {collection}: {e}")
+            return False
+
+    def insert(self, collection: str, items: List[Dict[str, Any]]) -> bool:
+        try:
+            with self._transaction(collection) as conn:
+                self._insert_rows(conn, collection, items)
+                self._bump_version(conn, collection)
+            return True
+        except sqlite3.Error as e:
+            print(f"Error writing to {collection}: {e}")
+            return False
+
+    def update(self, collection: str, field: str, value: Any, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        table = self.table(collection)
+        column = self._column(collection, field)
+        try:
+            with self._transaction(collection) as conn:
+                row = conn.execute(f'SELECT seq, body FROM "{table}" WHERE {column} = ? ORDER BY seq LIMIT 1', (value,)).fetchone()
+                if row is None:
+                    return None
+                item = json.loads(row[1])
+                item.update(updates)
+                self._update_rows(conn, collection, [(row[0], item)])
+                self._bump_version(conn, collection)
+            return item
+        except sqlite3.Error as e:
+            print(f"Error writing to {collection}: {e}")
+            return None
+
+    def update_many(self, collection: str, updates_by_key: Dict[Any, Dict[str, Any]]) -> int:
+        if not updates_by_key:
+            return 0
+        table = self.table(collection)
+        keys = list(updates_by_key)
+        try:
+            with self._transaction(collection) as conn:
+                rows = []
+                # Stay well below SQLITE_MAX_VARIABLE_NUMBER
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    rows.extend(conn.execute(
+                        f'SELECT seq, pk, body FROM "{table}" WHERE pk IN ({", ".join("?" for _ in chunk)})', chunk
+                    ).fetchall())
+                changed = []
+                for seq, pk, body in rows:
+                    item = json.loads(body)
+                    item.update(updates_by_key[pk])
+                    changed.append((seq, item))
+                self._update_rows(conn, collection, changed)
+                if changed:
+                    self._bump_version(conn, collection)
+            return len(changed)
+        except sqlite3.Error as e:
+            print(f"Error writing to {collection}: {e}")
+            return 0
+
+    def delete(self, collection: str, field: str, value: Any) -> bool:
+        table = self.table(collection)
+        column = self._column(collection, field)
+        try:
+            with self._transaction(collection) as conn:
+                deleted = conn.execute(f'DELETE FROM "{table}" WHERE {column} = ?', (value,)).rowcount
+                if deleted:
+                    self._bump_version(conn, collection)
+            return deleted > 0
+        except sqlite3.Error as e:
+            print(f"Error writing to {collection}: {e}")
+            return False
+
+    def take(self, collection: str, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        table = self.table(collection)
+        clause, params = self._where(collection, where)
+        try:
+            with self._transaction(collection) as conn:
+                rows = conn.execute(f'SELECT body FROM "{table}"{clause} ORDER BY seq', params).fetchall()
+                if rows:
+                    conn.execute(f'DELETE FROM "{table}"{clause}', params)
+                    self._bump_version(conn, collection)
+            return [json.loads(body) for (body,) in rows]
+        except sqlite3.Error as e:
+            print(f"Error writing to {collection}: {e}")
+            return []
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE ... COMMIT/ROLLBACK on an autocommit connection. The wait
+    for BEGIN IMMEDIATE (SQLite's write lock) is recorded as lock wait, and
+    the transaction up to its commit as a write of the collection.
+    """
+
+    def __init__(self, engine: "SQLiteStorage", collection: str):
+        self.engine = engine
+        self.conn = engine.connection()
+        self.collection = collection
+        self.name = collection_name(collection)
+        self.started = 0.0
+        self.before: Any = None
+
+    def __enter__(self) -> sqlite3.Connection:
+        waiting_since = time.perf_counter()
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.started = time.perf_counter()
+        STORAGE_LOCK_WAIT.labels(self.name).observe(self.started - waiting_since)
+        self.before = self.engine.version(self.collection)
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            after = self.engine.version(self.collection)
+            self.conn.execute("COMMIT")
+            STORAGE_SECONDS.labels(self.engine.name, "write", self.name).observe(time.perf_counter() - self.started)
+            self.engine._record_write(self.collection, self.before, after)
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+def migrate_from_json(engine: SQLiteStorage, data_dir: str, force: bool = False) -> Dict[str, int]:
+    """
+    One-shot import of every data/*.json collection into SQLite.
+    Collections that already hold rows are skipped unless force is set.
+    """
+    source = JsonStorage(data_dir)
+    imported = {}
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith(".json"):
+            continue
+        collection = collection_name(filename)
+        if not force and engine.count(collection) > 0:
+            continue
+        items = source.read_all(collection)
+        if isinstance(items, list) and engine.write_all(collection, items):
+            imported[collection] = len(items)
+    engine._set_meta("json_migrated", datetime.now().isoformat())
+    return imported
+
+_engine: Optional[StorageEngine] = None
+_engine_lock = threading.Lock()
+
+def create_engine(backend: Optional[str] = None) -> StorageEngine:
+    """Build the storage engine named by configuration"""
+    backend = (backend or config.STORAGE_BACKEND).lower()
+    if backend == "sqlite":
+        return SQLiteStorage(config.SQLITE_PATH, config.DATA_DIR)
+    if backend != "json":
+        print(f"Unknown storage backend {backend!r}, falling back to json")
+    return JsonStorage(config.DATA_DIR)
+
+def get_engine() -> StorageEngine:
+    """Get the process-wide storage engine"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine()
+    return _engine
+
+def set_engine(engine: StorageEngine):
+    """Swap the process-wide storage engine (tools and tests)"""
+    global _engine
+    _engine = engine
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="RouteSaathi storage tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="Import data/*.json into the SQLite database")
+    migrate.add_argument("--force", action="store_true", help="Re-import collections that already hold rows")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        sqlite_engine = SQLiteStorage(config.SQLITE_PATH)
+        result = migrate_from_json(sqlite_engine, config.DATA_DIR, force=args.force)
+        for name, total in result.items():
+            print(f"Imported {total} {name} into {config.SQLITE_PATH}")
+        if not result:
+            print("Nothing to import")
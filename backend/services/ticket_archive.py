@@ -0,0 +1,407 @@
+"""
+Day-partitioned archive of past tickets
+
+Tickets from before today are rolled out of the hot tickets collection into
+one compressed partition per day:
+
+    data/archive/tickets/<YYYY-MM-DD>.jsonl.gz  - one JSON ticket per line
+    data/archive/tickets/manifest.json          - per partition: ticket count,
+                                                  min/max timestamp, tickets
+                                                  and revenue per route
+
+The hot collection then holds only today's tickets. History queries combine
+both: per-route counts and revenue come straight from the manifest, and
+queries that need the tickets themselves (hourly patterns, rebuilding the
+demand and load stores, training) prune partitions by date and route from
+the manifest and read only the days they need. Hourly summaries of several
+partitions are computed in parallel worker processes and cached per
+partition file.
+
+Rolling runs on a background thread when ROUTESAATHI_ARCHIVE_ENABLED is set
+(or once with `python -m services.ticket_archive`). A lock file makes sure
+only one worker rolls at a time, and partitions are written before the
+tickets leave the hot collection, so a crash never loses tickets. Every roll
+bumps the manifest's generation, which tells the in-memory ticket stores to
+rebuild.
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from multiprocessing import get_context
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from services import config, repository
+from services.demand_features import parse_event_time
+
+MANIFEST = "manifest.json"
+
+def read_partition(path: str) -> List[Dict[str, Any]]:
+    """Tickets of one partition file, in issue order"""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def summarize_partition(path: str) -> Dict[str, List[int]]:
+    """Tickets per hour of day for each route of one partition"""
+    hours: Dict[str, List[int]] = {}
+    for ticket in read_partition(path):
+        moment = parse_event_time(ticket.get("timestamp"))
+        if moment is None:
+            continue
+        counts = hours.get(ticket.get("route_id"))
+        if counts is None:
+            counts = hours[ticket.get("route_id")] = [0] * 24
+        counts[moment.hour] += 1
+    return hours
+
+def _day_start(day: date) -> str:
+    return datetime.combine(day, time.min).isoformat()
+
+def hot_range(start: Optional[date], end: Optional[date]) -> Dict[str, str]:
+    """Timestamp lookups selecting hot tickets issued between start and end (inclusive days)"""
+    where = {}
+    if start is not None:
+        where["timestamp__gte"] = _day_start(start)
+    if end is not None:
+        where["timestamp__lt"] = _day_start(end + timedelta(days=1))
+    return where
+
+class TicketArchive:
+    """Compressed per-day ticket partitions with a manifest"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._manifest: Dict[str, Any] = {}
+        self._manifest_stamp: Any = object()
+        self._summaries: Dict[str, Tuple[Any, Dict[str, List[int]]]] = {}
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+
+    def path(self, day: str) -> str:
+        return os.path.join(self.root, f"{day}.jsonl.gz")
+
+    def manifest(self) -> Dict[str, Any]:
+        """{"generation": n, "partitions": {day: entry}}, re-read when the file changes"""
+        path = os.path.join(self.root, MANIFEST)
+        try:
+            stat = os.stat(path)
+            stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            return {"generation": 0, "partitions": {}}
+        if stamp != self._manifest_stamp:
+            with self._lock:
+                if stamp != self._manifest_stamp:
+                    try:
+                        with open(path, "r", encoding="utf-8") as f:
+                            self._manifest = json.load(f)
+                    except (OSError, json.JSONDecodeError) as e:
+                        print(f"Error reading ticket archive manifest: {e}")
+                        return {"generation": 0, "partitions": {}}
+                    self._manifest_stamp = stamp
+        return self._manifest
+
+    def generation(self) -> int:
+        """Changes whenever tickets move into the archive"""
+        return self.manifest().get("generation", 0)
+
+    def _write_json(self, path: str, payload: Any):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(payload, f, indent=2)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def partitions(self, start: Optional[date] = None, end: Optional[date] = None,
+                   route_id: Optional[str] = None) -> List[str]:
+        """Days with archived tickets in the range (and on the route), oldest first"""
+        days = []
+        for day, entry in self.manifest().get("partitions", {}).items():
+            if start is not None and day < start.isoformat():
+                continue
+            if end is not None and day > end.isoformat():
+                continue
+            if route_id is not None and route_id not in entry.get("routes", {}):
+                continue
+            days.append(day)
+        return sorted(days)
+
+    def tickets(self, start: Optional[date] = None, end: Optional[date] = None,
+                route_id: Optional[str] = None, newest_first: bool = False) -> Iterator[Dict[str, Any]]:
+        """Archived tickets in the range, one partition in memory at a time"""
+        days = self.partitions(start, end, route_id)
+        for day in reversed(days) if newest_first else days:
+            tickets = read_partition(self.path(day))
+            for ticket in reversed(tickets) if newest_first else tickets:
+                if route_id is None or ticket.get("route_id") == route_id:
+                    yield ticket
+
+    def route_totals(self, start: Optional[date] = None, end: Optional[date] = None) -> Tuple[Dict[str, int], Dict[str, float]]:
+        """Archived tickets and revenue per route, from the manifest alone"""
+        partitions = self.manifest().get("partitions", {})
+        counts: Dict[str, int] = {}
+        revenue: Dict[str, float] = {}
+        for day in self.partitions(start, end):
+            entry = partitions[day]
+            for route_id, count in entry.get("routes", {}).items():
+                counts[route_id] = counts.get(route_id, 0) + count
+            for route_id, total in entry.get("revenue", {}).items():
+                revenue[route_id] = revenue.get(route_id, 0) + total
+        return counts, revenue
+
+    def count(self, start: Optional[date] = None, end: Optional[date] = None) -> int:
+        partitions = self.manifest().get("partitions", {})
+        return sum(partitions[day].get("count", 0) for day in self.partitions(start, end))
+
+    def fare_total(self, start: Optional[date] = None, end: Optional[date] = None):
+        partitions = self.manifest().get("partitions", {})
+        return sum(partitions[day].get("fare_total", 0) for day in self.partitions(start, end))
+
+    def hourly(self, route_id: Optional[str] = None, start: Optional[date] = None,
+               end: Optional[date] = None) -> List[int]:
+        """Archived tickets per hour of day, for one route or all"""
+        totals = [0] * 24
+        for summary in self._summaries_for(self.partitions(start, end, route_id)):
+            for summary_route, counts in summary.items():
+                if route_id is None or summary_route == route_id:
+                    for hour, count in enumerate(counts):
+                        totals[hour] += count
+        return totals
+
+    def _summaries_for(self, days: List[str]) -> List[Dict[str, List[int]]]:
+        results: Dict[str, Dict[str, List[int]]] = {}
+        missing: List[Tuple[str, Any]] = []
+        for day in days:
+            try:
+                stat = os.stat(self.path(day))
+            except FileNotFoundError:
+                continue
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            cached = self._summaries.get(day)
+            if cached is not None and cached[0] == stamp:
+                results[day] = cached[1]
+            else:
+                missing.append((day, stamp))
+        if missing:
+            paths = [self.path(day) for day, _ in missing]
+            for (day, stamp), summary in zip(missing, self._summarize(paths)):
+                self._summaries[day] = (stamp, summary)
+                results[day] = summary
+        return [results[day] for day in days if day in results]
+
+    def _summarize(self, paths: List[str]) -> List[Dict[str, List[int]]]:
+        """Summaries of partition files, across worker processes when there are several"""
+        if len(paths) < 2 or config.ARCHIVE_WORKERS < 2:
+            return [summarize_partition(path) for path in paths]
+        try:
+            return list(self._executor().map(summarize_partition, paths))
+        except BrokenProcessPool as e:
+            print(f"Archive pool failed, reading inline: {e}")
+            self.shutdown()
+            return [summarize_partition(path) for path in paths]
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: never fork a server process that has threads running
+                self._pool = ProcessPoolExecutor(max_workers=config.ARCHIVE_WORKERS, mp_context=get_context("spawn"))
+            return self._pool
+
+
+    @contextmanager
+    def _roll_lock(self) -> Iterator[bool]:
+        """Exclusive across processes; yields False if another process is rolling"""
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            import fcntl
+        except ImportError:
+            yield True
+            return
+        with open(os.path.join(self.root, ".roll.lock"), "a") as handle:
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+    def _append(self, manifest: Dict[str, Any], tickets: List[Dict[str, Any]]):
+        """Merge tickets into their day partitions (idempotent by ticket id)"""
+        by_day: Dict[str, List[Dict[str, Any]]] = {}
+        for ticket in tickets:
+            by_day.setdefault(parse_event_time(ticket.get("timestamp")).date().isoformat(), []).append(ticket)
+        partitions = manifest.setdefault("partitions", {})
+        for day, new in sorted(by_day.items()):
+            existing = read_partition(self.path(day))
+            seen = {ticket.get("tid") for ticket in existing}
+            merged = existing + [ticket for ticket in new if ticket.get("tid") not in seen]
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp-", suffix=".jsonl.gz")
+            try:
+                with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+                    for ticket in merged:
+                        f.write(json.dumps(ticket, ensure_ascii=False))
+                        f.write("\n")
+                os.replace(tmp_path, self.path(day))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            routes: Dict[str, int] = {}
+            revenue: Dict[str, float] = {}
+            for ticket in merged:
+                route_id = ticket.get("route_id")
+                if route_id is not None:
+                    routes[route_id] = routes.get(route_id, 0) + 1
+                    revenue[route_id] = revenue.get(route_id, 0) + (ticket.get("fare") or 0)
+            timestamps = [str(ticket.get("timestamp")) for ticket in merged]
+            partitions[day] = {
+                "file": os.path.basename(self.path(day)),
+                "count": len(merged),
+                "fare_total": sum(ticket.get("fare") or 0 for ticket in merged),
+                "min_timestamp": min(timestamps),
+                "max_timestamp": max(timestamps),
+                "routes": routes,
+                "revenue": revenue,
+            }
+
+    def roll(self, today: Optional[date] = None) -> int:
+        """Move tickets issued before today into the archive; returns how many moved"""
+        cutoff = _day_start(today or date.today())
+        with self._roll_lock() as acquired:
+            if not acquired or not repository.tickets.count(timestamp__lt=cutoff):
+                return 0
+            manifest = json.loads(json.dumps(self.manifest()))
+            # Write the partitions first: a crash before the take leaves duplicates, never gaps
+            pending = repository.tickets.find(timestamp__lt=cutoff)
+            archivable = [ticket for ticket in pending if parse_event_time(ticket.get("timestamp")) is not None]
+            self._append(manifest, archivable)
+            self._write_json(os.path.join(self.root, MANIFEST), manifest)
+
+            taken = repository.tickets.take(timestamp__lt=cutoff)
+            written = {ticket.get("tid") for ticket in archivable}
+            late = [ticket for ticket in taken if ticket.get("tid") not in written]
+            unparsable = [ticket for ticket in late if parse_event_time(ticket.get("timestamp")) is None]
+            if unparsable:
+                # Undated tickets cannot be placed in a day partition; keep them hot
+                repository.tickets.insert(*unparsable)
+            self._append(manifest, [ticket for ticket in late if parse_event_time(ticket.get("timestamp")) is not None])
+            manifest["generation"] = manifest.get("generation", 0) + 1
+            manifest["rolled_at"] = datetime.now().isoformat()
+            self._write_json(os.path.join(self.root, MANIFEST), manifest)
+            return len(taken) - len(unparsable)
+
+    def _run(self):
+        while True:
+            try:
+                moved = self.roll()
+                if moved:
+                    print(f"Archived {moved} ticket(s)")
+            except Exception as e:
+                print(f"Ticket archive roll failed: {e}")
+            if self._stop.wait(config.ARCHIVE_CHECK_SECONDS):
+                return
+
+    def start(self):
+        """Roll now and then periodically on a background thread (idempotent)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ticket-archive", daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        """Stop the roller and the worker pool"""
+        self._stop.set()
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+archive = TicketArchive(config.ARCHIVE_DIR)
+
+# History queries over the hot collection plus the archive
+
+def count_by_route(start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, int]:
+    """Tickets per route"""
+    counts = dict(repository.tickets.count_by("route_id", **hot_range(start, end)))
+    for route_id, archived in archive.route_totals(start, end)[0].items():
+        counts[route_id] = counts.get(route_id, 0) + archived
+    return counts
+
+def revenue_by_route(start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, Any]:
+    """Fare revenue per route"""
+    revenue = dict(repository.tickets.sum_by("route_id", "fare", **hot_range(start, end)))
+    for route_id, archived in archive.route_totals(start, end)[1].items():
+        revenue[route_id] = revenue.get(route_id, 0) + archived
+    return revenue
+
+def count(start: Optional[date] = None, end: Optional[date] = None) -> int:
+    """Number of tickets"""
+    return repository.tickets.count(**hot_range(start, end)) + archive.count(start, end)
+
+def total_revenue(start: Optional[date] = None, end: Optional[date] = None):
+    """Sum of all fares"""
+    return repository.tickets.sum("fare", **hot_range(start, end)) + archive.fare_total(start, end)
+
+def count_by_hour(route_id: Optional[str] = None, start: Optional[date] = None,
+                  end: Optional[date] = None) -> Dict[int, int]:
+    """Tickets per hour of day (hours without tickets are left out)"""
+    where = hot_range(start, end)
+    if route_id is not None:
+        where["route_id"] = route_id
+    counts = dict(repository.tickets.count_by("timestamp__hour", **where))
+    for hour, archived in enumerate(archive.hourly(route_id, start, end)):
+        if archived:
+            counts[hour] = counts.get(hour, 0) + archived
+    return counts
+
+def scan(start: Optional[date] = None, end: Optional[date] = None, route_id: Optional[str] = None,
+         chunk_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+    """Archived then hot tickets, oldest first, a chunk at a time"""
+    chunk: List[Dict[str, Any]] = []
+    for ticket in archive.tickets(start, end, route_id):
+        chunk.append(ticket)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+    where = hot_range(start, end)
+    if route_id is not None:
+        where["route_id"] = route_id
+    yield from repository.tickets.scan(chunk_size, **where)
+
+def tail(n: int, route_id: Optional[str] = None, bus_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Last n matching tickets, oldest first, reaching into the archive when today has fewer"""
+    where = {key: value for key, value in (("route_id", route_id), ("bus_id", bus_id)) if value is not None}
+    recent = repository.tickets.tail(n, **where)
+    if len(recent) < n:
+        older = []
+        for ticket in archive.tickets(route_id=route_id, newest_first=True):
+            if bus_id is None or ticket.get("bus_id") == bus_id:
+                older.append(ticket)
+                if len(older) + len(recent) >= n:
+                    break
+        recent = older[::-1] + recent
+    return recent
+
+if __name__ == "__main__":
+    print(f"Archived {archive.roll()} ticket(s) to {archive.root}")
+    archive.shutdown()
@@ -0,0 +1,210 @@
+"""
+Historical bus tracks
+
+Every position update is appended to a per-bus, per-day segment file
+
+    data/tracks/<YYYY-MM-DD>/<bus_id>.trk
+
+as a fixed-width little-endian record (epoch seconds, lat, lng as float64;
+speed in km/h as float32; 28 bytes). Appends are single O_APPEND writes, so
+several workers can record the same bus safely. Reads memory-map the segment
+files for the requested days and slice them with NumPy, and nothing is
+loaded into buses.json.
+
+Replays are downsampled to a requested number of points with
+Largest-Triangle-Three-Buckets on the (lat, lng) path, which keeps turns and
+stops, or to one point per fixed interval. Day directories older than
+TRACK_RETENTION_DAYS are deleted.
+"""
+
+import os
+import re
+import shutil
+import struct
+import threading
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+from services import config
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# NumPy is imported on first read only, so recording positions stays light
+RECORD = struct.Struct("<dddf")
+
+@lru_cache(maxsize=None)
+def record_dtype() -> "np.dtype":
+    import numpy as np
+
+    return np.dtype([("epoch", "<f8"), ("lat", "<f8"), ("lng", "<f8"), ("speed", "<f4")])
+
+_SPEED = re.compile(r"[-+]?\d+(?:\.\d+)?")
+_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]")
+
+def parse_speed(value: Any) -> float:
+    """Speed in km/h from a number or a string such as "22km/h" (0 if unknown)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _SPEED.search(str(value or ""))
+    return float(match.group()) if match else 0.0
+
+def lttb(x: "np.ndarray", y: "np.ndarray", z: "np.ndarray", threshold: int) -> "np.ndarray":
+    """
+    Indices of `threshold` points chosen by Largest-Triangle-Three-Buckets on
+    the (y, z) path; x only orders the points. The first and last are kept.
+    """
+    import numpy as np
+
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1][:max(threshold, 0)], dtype=np.int64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket (the last point for the final bucket)
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else n
+        avg_y, avg_z = y[next_start:next_end].mean(), z[next_start:next_end].mean()
+        area = np.abs(
+            (y[previous] - avg_y) * (z[start:end] - z[previous])
+            - (y[previous] - y[start:end]) * (avg_z - z[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+def interval_sample(epochs: "np.ndarray", seconds: float) -> "np.ndarray":
+    """Indices of the last point in each fixed time interval"""
+    import numpy as np
+
+    if not len(epochs) or seconds <= 0:
+        return np.arange(len(epochs))
+    buckets = np.floor(epochs / seconds).astype(np.int64)
+    last = np.flatnonzero(np.diff(buckets)) if len(buckets) > 1 else np.array([], dtype=np.int64)
+    return np.append(last, len(epochs) - 1)
+
+class TrackStore:
+    """Append-only binary track segments, one file per bus per day"""
+
+    def __init__(self, root: str, retention_days: int):
+        self.root = root
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._pruned_on: Optional[date] = None
+
+    def _segment(self, day: date, bus_id: str) -> str:
+        return os.path.join(self.root, day.isoformat(), f"{_UNSAFE.sub('_', bus_id)}.trk")
+
+    def append_many(self, points: Iterable[Tuple[str, float, float, float, float]]):
+        """Record (bus_id, epoch, lat, lng, speed) points"""
+        by_file: Dict[str, List[bytes]] = {}
+        for bus_id, epoch, lat, lng, speed in points:
+            day = datetime.fromtimestamp(epoch).date()
+            by_file.setdefault(self._segment(day, bus_id), []).append(RECORD.pack(epoch, lat, lng, speed))
+        for path, records in by_file.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, b"".join(records))
+            finally:
+                os.close(fd)
+        self._maybe_prune()
+
+    def append(self, bus_id: str, lat: float, lng: float, speed: Any = 0.0, epoch: Optional[float] = None):
+        """Record one position (epoch defaults to now)"""
+        epoch = datetime.now().timestamp() if epoch is None else epoch
+        self.append_many([(bus_id, epoch, float(lat), float(lng), parse_speed(speed))])
+
+    def read(self, bus_id: str, start: float, end: float) -> "np.ndarray":
+        """All recorded points of a bus with start <= epoch <= end, oldest first"""
+        import numpy as np
+
+        dtype = record_dtype()
+        parts = []
+        day = datetime.fromtimestamp(start).date()
+        last_day = datetime.fromtimestamp(end).date()
+        while day <= last_day:
+            path = self._segment(day, bus_id)
+            day += timedelta(days=1)
+            try:
+                count = os.path.getsize(path) // RECORD.size
+            except OSError:
+                continue
+            if count == 0:
+                continue
+            # A record still being written is excluded by the whole-record count
+            segment = np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+            parts.append(segment[(segment["epoch"] >= start) & (segment["epoch"] <= end)])
+        if not parts:
+            return np.empty(0, dtype=dtype)
+        points = np.concatenate(parts)
+        # Concurrent writers can interleave slightly out of order
+        if len(points) > 1 and np.any(np.diff(points["epoch"]) < 0):
+            points = points[np.argsort(points["epoch"], kind="stable")]
+        return points
+
+    def replay(self, bus_id: str, start: float, end: float, points: int = 500,
+               interval: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Path of a bus over a time range, downsampled to at most `points`. An
+        interval too short for the whole range to fit in `points` is widened
+        (the interval used is returned).
+        """
+        track = self.read(bus_id, start, end)
+        result: Dict[str, Any] = {}
+        if interval:
+            # A range spans at most range / interval + 1 interval buckets
+            interval = max(interval, (end - start) / max(1, points - 1))
+            result["interval"] = interval
+        if not len(track):
+            sampled = track
+        elif interval:
+            sampled = track[interval_sample(track["epoch"], interval)]
+        else:
+            sampled = track[lttb(track["epoch"], track["lat"], track["lng"], points)]
+        return {
+            **result,
+            "total_points": int(len(track)),
+            "points": [
+                {
+                    "timestamp": datetime.fromtimestamp(float(epoch)).isoformat(),
+                    "lat": float(lat),
+                    "lng": float(lng),
+                    "speed": round(float(speed), 1),
+                }
+                for epoch, lat, lng, speed in sampled.tolist()
+            ],
+        }
+
+    def prune(self, today: Optional[date] = None) -> int:
+        """Delete day directories older than the retention period; returns how many"""
+        if self.retention_days <= 0 or not os.path.isdir(self.root):
+            return 0
+        cutoff = (today or date.today()) - timedelta(days=self.retention_days)
+        removed = 0
+        for name in os.listdir(self.root):
+            try:
+                day = date.fromisoformat(name)
+            except ValueError:
+                continue
+            if day < cutoff:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                removed += 1
+        return removed
+
+    def _maybe_prune(self):
+        today = date.today()
+        if self._pruned_on == today:
+            return
+        with self._lock:
+            if self._pruned_on != today:
+                self._pruned_on = today
+                self.prune(today)
+
+track_store = TrackStore(config.TRACKS_DIR, config.TRACK_RETENTION_DAYS)
@@ -0,0 +1,133 @@
+"""
+Background warmup of a freshly started worker
+
+A new worker binds its port straight away and warms up on a background
+thread while it already serves requests:
+
+    storage - opens the storage engine and reads every collection once
+    indexes - builds the shared user / assignment indexes, the demand
+              feature store, segment load profiles, fare tables, the
+              fleet table, the congestion detector's bus state, the
+              revenue monitor's running statistics and the sync change log
+    model   - loads the demand model (importing NumPy, or sklearn and pandas
+              for an uncompiled model) and runs one prediction
+
+/api/health/ready reports 503 until the required components are warm. The
+model is optional: if it fails to load the worker is ready but degraded and
+the AI engine falls back to its heuristics, as it does at request time.
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services import config
+from services.metrics import registry
+
+COLLECTIONS = ("buses.json", "routes.json", "tickets.json", "alerts.json", "users.json", "assignments.json")
+
+WARMUP_SECONDS = registry.gauge("routesaathi_warmup_seconds", "Time each startup warmup component took",
+                                ("component",))
+
+def _warm_storage():
+    from services.storage import get_engine
+
+    engine = get_engine()
+    for collection in COLLECTIONS:
+        engine.read_all(collection)
+
+def _warm_indexes():
+    from services.change_log import change_log
+    from services.congestion_detector import detector
+    from services.demand_features import demand_store
+    from services.fare_tables import fare_tables
+    from services.fleet_table import fleet_table
+    from services.load_profiles import load_profiles
+    from services.revenue_monitor import revenue_monitor
+    from services.shared_state import assignments_by_conductor, users_by_email, users_by_id
+
+    users_by_id.get()
+    users_by_email.get()
+    assignments_by_conductor.get()
+    demand_store.sync()
+    load_profiles.sync()
+    fare_tables.refresh()
+    fleet_table.get()
+    detector.sync()
+    revenue_monitor.sync()
+    change_log.record()
+
+def _warm_model():
+    from services import demand_model
+
+    model = demand_model.load_model()
+    if model is None:
+        raise RuntimeError("demand model could not be loaded")
+    model.predict([{}])
+
+# (component, step, required for readiness)
+STEPS: List[Tuple[str, Callable[[], None], bool]] = [
+    ("storage", _warm_storage, True),
+    ("indexes", _warm_indexes, True),
+    ("model", _warm_model, False),
+]
+
+class Warmup:
+    """Runs the warmup steps once on a background thread and records their outcome"""
+
+    def __init__(self, steps: List[Tuple[str, Callable[[], None], bool]]):
+        self.steps = steps
+        self._components: Dict[str, Dict[str, Any]] = {
+            name: {"status": "pending", "required": required} for name, _, required in steps
+        }
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._started_at: Optional[str] = None
+        self._finished = threading.Event()
+
+    def start(self):
+        """Start warming up in the background (idempotent)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._started_at = datetime.now().isoformat()
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def run(self):
+        """Run every step in order; a failed step does not stop the later ones"""
+        for name, step, _ in self.steps:
+            self._set(name, status="running")
+            started = time.perf_counter()
+            try:
+                step()
+                result = {"status": "ready"}
+            except Exception as e:
+                print(f"Warmup of {name} failed: {e}")
+                result = {"status": "failed", "error": str(e)}
+            elapsed = time.perf_counter() - started
+            WARMUP_SECONDS.labels(name).set(elapsed)
+            self._set(name, seconds=round(elapsed, 3), **result)
+        self._finished.set()
+
+    def _set(self, name: str, **fields: Any):
+        with self._lock:
+            self._components[name] = {**self._components[name], **fields}
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def state(self) -> Dict[str, Any]:
+        """Readiness and per-component status and timings"""
+        with self._lock:
+            components = {name: dict(component) for name, component in self._components.items()}
+        ready = all(c["status"] == "ready" for c in components.values() if c["required"])
+        degraded = any(c["status"] == "failed" for c in components.values())
+        if ready:
+            status = "degraded" if degraded else "ready"
+        else:
+            status = "failed" if self._finished.is_set() else "warming_up"
+        return {"status": status, "ready": ready, "started_at": self._started_at, "components": components}
+
+warmup = Warmup(STEPS if config.WARMUP_ENABLED else [])
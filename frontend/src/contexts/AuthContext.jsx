@@ -1,4 +1,5 @@
 import { createContext, useContext, useState, useEffect } from 'react';
+import { TOKEN_STORAGE_KEY } from '../services/api';
 
 const AuthContext = createContext(null);
 
@@ -9,7 +10,8 @@ export function AuthProvider({ children }) {
   useEffect(() => {
     // Check for stored user session
     const storedUser = localStorage.getItem('routesaathi_user');
-    if (storedUser) {
+    // Sessions from before token auth have no token; force a fresh login
+    if (storedUser && localStorage.getItem(TOKEN_STORAGE_KEY)) {
       try {
         setUser(JSON.parse(storedUser));
       } catch (e) {
@@ -19,14 +21,18 @@ export function AuthProvider({ children }) {
     setLoading(false);
   }, []);
 
-  const login = (userData) => {
+  const login = (userData, token) => {
     setUser(userData);
     localStorage.setItem('routesaathi_user', JSON.stringify(userData));
+    if (token) {
+      localStorage.setItem(TOKEN_STORAGE_KEY, token);
+    }
   };
 
   const logout = () => {
     setUser(null);
     localStorage.removeItem('routesaathi_user');
+    localStorage.removeItem(TOKEN_STORAGE_KEY);
   };
 
   const isCoordinator = () => user?.role === 'coordinator';
@@ -33,7 +33,7 @@ function Login() {
     try {
       const response = await authAPI.login(loginEmail, loginPassword);
       if (response.data.success) {
-        login(response.data.user);
+        login(response.data.user, response.data.access_token);
         const role = response.data.user.role;
         navigate(role === 'coordinator' ? '/coordinator' : role === 'conductor' ? '/conductor' : '/passenger');
       }
@@ -33,13 +33,20 @@ function Ticketing() {
     }
   };
 
-  const calculateFare = (from, to) => {
-    const fromIndex = stops.indexOf(from);
-    const toIndex = stops.indexOf(to);
-    const distance = Math.abs(toIndex - fromIndex);
-    const baseFare = 10 + (distance * 5);
-    setFare(baseFare);
-    return baseFare;
+  const calculateFare = async (from, to) => {
+    try {
+      const res = await ticketsAPI.getFareQuote(selectedRoute?.id, from, to);
+      setFare(res.data.fare);
+      return res.data.fare;
+    } catch (err) {
+      // Offline or unknown route: estimate from the number of stops
+      const fromIndex = stops.indexOf(from);
+      const toIndex = stops.indexOf(to);
+      const distance = Math.abs(toIndex - fromIndex);
+      const baseFare = 10 + (distance * 5);
+      setFare(baseFare);
+      return baseFare;
+    }
   };
 
   const handleIssueTicket = async () => {
@@ -58,7 +65,7 @@ function Ticketing() {
         id: res.data.ticket_ids?.[0] || `T${Date.now()}`,
         from: fromStop,
         to: toStop,
-        fare: fare * quantity,
+        fare: res.data.total_fare ?? fare * quantity,
         quantity: quantity,
         time: new Date().toLocaleTimeString()
       };
@@ -1,7 +1,7 @@
 import { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import CoordinatorLayout from '../../components/CoordinatorLayout';
-import { busesAPI, routesAPI, notificationsAPI, aiAPI } from '../../services/api';
+import { dashboardAPI } from '../../services/api';
 import { Bus, MessageCircle, Lightbulb, ChevronRight, TrendingUp, TrendingDown, AlertCircle, Zap } from 'lucide-react';
 
 function Dashboard() {
@@ -20,19 +20,14 @@ function Dashboard() {
 
   const loadData = async () => {
     try {
-      const [busStats, routeStats, aiStats, recentAlerts] = await Promise.all([
-        busesAPI.getStats(),
-        routesAPI.getStats(),
-        aiAPI.getMLSuggestionsCount(),
-        notificationsAPI.getRecent(4),
-      ]);
+      const { data } = await dashboardAPI.getSummary(4);
       setStats({
-        activeBuses: busStats.data.total_active_buses || 35,
-        highDemand: routeStats.data.routes_with_high_demand || 12,
-        lowDemand: routeStats.data.routes_with_low_demand || 7,
-        aiSuggestions: aiStats.data.ml_suggested_reallocations || 9,
+        activeBuses: data.buses.total_active_buses || 35,
+        highDemand: data.routes.routes_with_high_demand || 12,
+        lowDemand: data.routes.routes_with_low_demand || 7,
+        aiSuggestions: data.ml_suggestions.ml_suggested_reallocations || 9,
       });
-      setAlerts(recentAlerts.data || []);
+      setAlerts(data.recent_alerts || []);
     } catch (e) {
       console.error(e);
     }
@@ -45,7 +45,7 @@ function PassengerHome() {
 
   const loadBuses = async () => {
     try {
-      const res = await busesAPI.getAll();
+      const res = await busesAPI.getAll({ fields: 'id,route_id,lat,lng,occupancy_percent,last_stop' });
       setBuses(res.data || []);
     } catch (e) {
       console.error(e);
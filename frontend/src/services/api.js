@@ -14,16 +14,45 @@ const api = axios.create({
     },
 });
 
+export const TOKEN_STORAGE_KEY = 'routesaathi_token';
+
+// Attach the session token to every request
+api.interceptors.request.use((config) => {
+    const token = localStorage.getItem(TOKEN_STORAGE_KEY);
+    if (token) {
+        config.headers.Authorization = `Bearer ${token}`;
+    }
+    return config;
+});
+
+// Expired or invalid session: clear it and go back to login
+api.interceptors.response.use(
+    (response) => response,
+    (error) => {
+        const isLogin = error.config?.url?.includes('/auth/login');
+        if (error.response?.status === 401 && !isLogin) {
+            localStorage.removeItem(TOKEN_STORAGE_KEY);
+            localStorage.removeItem('routesaathi_user');
+            if (window.location.pathname !== '/login') {
+                window.location.assign('/login');
+            }
+        }
+        return Promise.reject(error);
+    }
+);
+
 // Auth API
 export const authAPI = {
     login: (email, password) => api.post('/auth/login', { email, password }),
+    me: () => api.get('/auth/me'),
     getUsers: () => api.get('/auth/users'),
     getConductors: () => api.get('/auth/conductors'),
 };
 
 // Buses API
 export const busesAPI = {
-    getAll: () => api.get('/buses'),
+    // params: { fields, status, route_id, min_occupancy, max_occupancy, limit, cursor }
+    getAll: (params) => api.get('/buses', { params }),
     getStats: () => api.get('/buses/stats'),
     getById: (busId) => api.get(`/buses/${busId}`),
     getByRoute: (routeId) => api.get(`/buses/by-route/${routeId}`),
@@ -45,6 +74,7 @@ export const ticketsAPI = {
     getAll: () => api.get('/tickets'),
     getStats: () => api.get('/tickets/stats'),
     issue: (ticketData) => api.post('/tickets/issue', ticketData),
+    getFareQuote: (routeId, fromStop, toStop) => api.get('/tickets/fare-quote', { params: { route_id: routeId, from_stop: fromStop, to_stop: toStop } }),
     getByBus: (busId) => api.get(`/tickets/by-bus/${busId}`),
     getHourlyDemand: (routeId) => api.get(`/tickets/hourly-demand/${routeId}`),
 };
@@ -75,6 +105,11 @@ export const aiAPI = {
     getMLSuggestionsCount: () => api.get('/ai/ml-suggestions-count'),
 };
 
+// Dashboard API
+export const dashboardAPI = {
+    getSummary: (recentAlerts = 4) => api.get('/dashboard/summary', { params: { recent_alerts: recentAlerts } }),
+};
+
 // Conductors API
 export const conductorsAPI = {
     getAssignment: (conductorId) => api.get(`/conductors/assignment/${conductorId}`),
@@ -86,4 +121,9 @@ export const conductorsAPI = {
     getAll: () => api.get('/conductors/all'),
 };
 
+// Delta sync API: pass the `version` of the previous response as `since`
+export const syncAPI = {
+    getChanges: (since = 0, collections) => api.get('/sync', { params: { since, collections } }),
+};
+
 export default api;
@@ -1,10 +1,22 @@
 import joblib
 import pandas as pd
+import json
 import os
+import sys
 
-# Define paths
-MODEL_PATH = r"c:\Users\Irfan IR\Documents\IR Projects\RouteSaathi 2.0\backend\models\backup_predictor_rf.joblib"
-FEATURE_COLS_PATH = r"c:\Users\Irfan IR\Documents\IR Projects\RouteSaathi 2.0\backend\models\feature_columns.joblib"
+# Define paths (relative to this script; pass a version to inspect a trained export)
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend", "models")
+MODEL_PATH = os.path.join(MODELS_DIR, "backup_predictor_rf.joblib")
+FEATURE_COLS_PATH = os.path.join(MODELS_DIR, "feature_columns.joblib")
+
+if len(sys.argv) > 1:
+    with open(os.path.join(MODELS_DIR, "manifest.json"), "r") as f:
+        manifest = json.load(f)
+    version = manifest["current"] if sys.argv[1] == "current" else sys.argv[1]
+    entry = manifest["versions"][version]
+    MODEL_PATH = os.path.join(MODELS_DIR, entry["model_file"])
+    FEATURE_COLS_PATH = os.path.join(MODELS_DIR, entry["columns_file"])
+    print(f"Model version: {version} (trained {entry.get('trained_at')}, source {entry.get('source')})")
 
 try:
     # Load model and feature columns